@@ -1,5 +1,5 @@
 #!/bin/bash
 
 . venv/bin/activate
-python intercom
+python intercom "$@"
 deactivate
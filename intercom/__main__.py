@@ -1,7 +1,21 @@
-"""Application Entry"""
+"""Application Entry
 
+--profile-startup: 起動の段階ごとの時間を、ready になった時に標準出力へ書き出す
+"""
+
+import sys
 from pathlib import Path
-from kivy.config import Config
+
+# 起動の段階ごとの時間: kivy より先に import して、時刻の原点とする
+from libs.startup import PROFILER
+
+# kivy は import の時に引数を解釈するので、それより前に取り除く
+if "--profile-startup" in sys.argv:
+    sys.argv.remove("--profile-startup")
+    PROFILER.enabled = True
+
+with PROFILER.phase("import kivy"):
+    from kivy.config import Config
 
 log_dir = str(Path().absolute()) + "/logs"
 
@@ -31,12 +45,14 @@ Config.set("input", "hid_%(name)s", "probesysfs,provider=hidinput")
 
 if __name__ == "__main__":
     # To use japanese font in Kivy
-    from kivy.core.text import LabelBase, DEFAULT_FONT
-    from kivy.resources import resource_add_path
+    with PROFILER.phase("font"):
+        from kivy.core.text import LabelBase, DEFAULT_FONT
+        from kivy.resources import resource_add_path
 
-    resource_add_path("/usr/share/fonts/opentype/ipaexfont-gothic")
-    LabelBase.register(DEFAULT_FONT, "ipaexg.ttf")
+        resource_add_path("/usr/share/fonts/opentype/ipaexfont-gothic")
+        LabelBase.register(DEFAULT_FONT, "ipaexg.ttf")
 
-    from intercom import IntercomApp
+    with PROFILER.phase("import intercom"):
+        from intercom import IntercomApp
 
     IntercomApp().run()
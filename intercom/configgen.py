@@ -0,0 +1,450 @@
+"""configgen
+
+部屋の一覧(config/rooms.ini)から、Asterisk の pjsip.conf と extensions.conf、
+部屋ごとの intercom.ini を生成する。
+
+  python -m intercom.configgen config/rooms.ini -o build
+
+  build/asterisk/pjsip.conf
+  build/asterisk/extensions.conf
+  build/部屋/intercom.ini
+
+pjsip.conf は共通の設定をテンプレート([名前](!))にまとめ、部屋ごとの endpoint、
+auth、aor はテンプレートを継承した数行だけにする。extensions.conf は末尾が数字の
+部屋の名前を、最後の1桁のパターン(_60[1-9] など)にまとめる。
+intercom.ini は config/intercom.ini をひな形にして、コメントを残したまま
+アカウント、通話相手、コーデック、部屋の一覧を書き換える。
+
+pjsua2 と kivy に依存しない。
+"""
+
+import argparse
+import logging
+from configparser import ConfigParser
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# intercom.ini の [CODEC] Priority の名前 -> Asterisk の allow の名前
+ASTERISK_CODECS = {"opus": "opus", "g722": "g722", "pcmu": "ulaw", "pcma": "alaw"}
+
+# pjsua2 の同時に扱える通話の数の上限(PJSUA_MAX_CALLS)
+PJSUA_MAX_CALLS = 32
+# pjsua2 の通話相手(Buddy)の数の上限(PJSUA_MAX_BUDDIES)
+PJSUA_MAX_BUDDIES = 256
+
+# Asterisk のパターンで特別な意味を持つ文字(英字は大文字と小文字を区別しない)
+PATTERN_CHARS = frozenset("NXZnxz.!")
+
+
+def load_inventory(inventory: ConfigParser) -> tuple[dict, list[dict]]:
+    """部屋の一覧を読み込む
+
+    [DEFAULT] に SIPサーバーと共通の設定、[ROOM 名前] セクションごとに1部屋。
+    部屋のセクションに無いキーは [DEFAULT] の値を使う。
+
+    :param ConfigParser inventory: 部屋の一覧
+    :return tuple[dict, list[dict]]: 共通の設定と、部屋ごとの設定
+    """
+
+    server = inventory.get("DEFAULT", "SipServer")
+    codecs = [
+        name.strip().lower()
+        for name in inventory.get("DEFAULT", "Codecs", fallback="pcmu").split(",")
+        if name.strip()
+    ]
+    unknown = [name for name in codecs if name not in ASTERISK_CODECS]
+    if unknown:
+        raise ValueError(f"unknown codec: {', '.join(unknown)}")
+
+    settings = {
+        "server": server,
+        "codecs": codecs,
+        "context": inventory.get("DEFAULT", "Context", fallback="from-internal"),
+        "qualify": inventory.getint("DEFAULT", "Qualify", fallback=30),
+        "qualify_timeout": inventory.getfloat(
+            "DEFAULT", "QualifyTimeout", fallback=3.0
+        ),
+        "dial_timeout": inventory.getint("DEFAULT", "DialTimeout", fallback=3),
+        "profile": inventory.get("DEFAULT", "Profile", fallback="balanced"),
+        "call_mode": inventory.get("DEFAULT", "CallMode", fallback="server"),
+    }
+
+    rooms = []
+    names = set()
+    for section in inventory.sections():
+        if not section.startswith("ROOM "):
+            continue
+
+        name = section[5:].strip()
+        if name in names:
+            raise ValueError(f"duplicate room: {name}")
+        names.add(name)
+
+        password = inventory.get(section, "Password", fallback="")
+        if not password:
+            raise ValueError(f"no password: {name}")
+
+        host = inventory.get(section, "Host", fallback="")
+        port = inventory.getint(section, "Port", fallback=5060)
+        rooms.append(
+            {
+                "name": name,
+                "label": inventory.get(section, "Name", fallback=name),
+                "uri": f"sip:{name}@{server}",
+                "direct": f"sip:{name}@{host}:{port}" if host else "",
+                "password": password,
+                "page": inventory.getboolean(section, "Page", fallback=True),
+                "buddy": inventory.get(section, "Buddy", fallback=""),
+            }
+        )
+
+    if len(rooms) < 2:
+        raise ValueError("at least two rooms are required")
+
+    for room in rooms:
+        if room["buddy"] and room["buddy"] not in names:
+            raise ValueError(f"unknown buddy: {room['buddy']} ({room['name']})")
+
+    return settings, rooms
+
+
+def render_pjsip_conf(settings: dict, rooms: list[dict]) -> str:
+    """Asterisk の pjsip.conf
+
+    :param dict settings: 共通の設定
+    :param list rooms: 部屋ごとの設定
+    :return str: pjsip.conf
+    """
+
+    allow = ",".join(ASTERISK_CODECS[name] for name in settings["codecs"])
+    lines = [
+        "; intercom.configgen で生成: 部屋の一覧(rooms.ini)を編集して生成し直すこと",
+        "",
+        "[transport-udp]",
+        "type = transport",
+        "protocol = udp",
+        "bind = 0.0.0.0",
+        "",
+        "[transport-tcp]",
+        "type = transport",
+        "protocol = tcp",
+        "bind = 0.0.0.0",
+        "",
+        ";=== templates ===",
+        "[intercom-endpoint](!)",
+        "type = endpoint",
+        f"context = {settings['context']}",
+        "disallow = all",
+        "; intercom.ini の [CODEC] Priority と同じ順にする"
+        "(opus は codec_opus か res_format_attr_opus が必要)",
+        f"allow = {allow}",
+        "; 音声(RTP)は Asterisk を経由せず、部屋どうしで直接流す"
+        "(Asterisk が re-INVITE する)",
+        "direct_media = yes",
+        "direct_media_method = invite",
+        "; NAT の内側の部屋だけは Asterisk で中継する",
+        "disable_direct_media_on_nat = yes",
+        "",
+        "[intercom-auth](!)",
+        "type = auth",
+        "auth_type = userpass",
+        "",
+        "[intercom-aor](!)",
+        "type = aor",
+        "max_contacts = 1",
+        "remove_existing = yes",
+        "; OPTIONS で部屋に届くかを確かめる間隔と、応答を待つ時間(秒)",
+        f"qualify_frequency = {settings['qualify']}",
+        f"qualify_timeout = {settings['qualify_timeout']:g}",
+    ]
+
+    for room in rooms:
+        name = room["name"]
+        lines += [
+            "",
+            f";=== for {name} ===",
+            f"[{name}](intercom-endpoint)",
+            f"auth = auth{name}",
+            f"aors = {name}",
+            "",
+            f"[auth{name}](intercom-auth)",
+            f"password = {room['password']}",
+            f"username = {name}",
+            "",
+            f"[{name}](intercom-aor)",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def _digits(digits: list[str]) -> str:
+    """最後の1桁の集合を、Asterisk のパターンの1文字にする
+
+    :param list digits: 数字(昇順、重複なし)
+    :return str: "X", "Z", "N", "5", "[1-35]" など
+    """
+
+    values = [int(digit) for digit in digits]
+    if len(values) == 1:
+        return digits[0]
+    if values == list(range(10)):
+        return "X"
+    if values == list(range(1, 10)):
+        return "Z"
+    if values == list(range(2, 10)):
+        return "N"
+
+    ranges = []
+    start = previous = values[0]
+    for value in values[1:] + [None]:
+        if value is not None and value == previous + 1:
+            previous = value
+            continue
+        if previous - start >= 2:
+            ranges.append(f"{start}-{previous}")
+        else:
+            ranges.append("".join(str(n) for n in range(start, previous + 1)))
+        if value is not None:
+            start = previous = value
+
+    return "[" + "".join(ranges) + "]"
+
+
+def _literal(text: str) -> str:
+    """パターンの中の文字列(特別な意味を持つ文字は [] で囲む)
+
+    :param str text: 部屋の名前の一部
+    :return str: パターン
+    """
+
+    return "".join(f"[{char}]" if char in PATTERN_CHARS else char for char in text)
+
+
+def dial_patterns(names: list[str]) -> list[str]:
+    """部屋の名前を、extensions.conf の exten にまとめる
+
+    末尾の1桁だけが違う名前(intercom1, intercom2 など)を1つのパターンにする。
+    まとめられない名前は、そのままの名前で書く。
+
+    :param list names: 部屋の名前
+    :return list[str]: "_60[1-9]", "intercom" など(最初に現れた順)
+    """
+
+    # (名前から最後の1桁を除いた部分, 最後が数字かどうか) -> 最後の1桁
+    groups: dict[tuple[str, bool], list[str]] = {}
+    for name in names:
+        if name[-1:] and name[-1] in "0123456789":
+            groups.setdefault((name[:-1], True), []).append(name[-1])
+        else:
+            groups.setdefault((name, False), [])
+
+    patterns = []
+    for (stem, numbered), digits in groups.items():
+        if not numbered:
+            patterns.append(stem)
+        elif len(digits) == 1:
+            patterns.append(stem + digits[0])
+        else:
+            patterns.append("_" + _literal(stem) + _digits(sorted(set(digits))))
+    return patterns
+
+
+def render_extensions_conf(settings: dict, rooms: list[dict]) -> str:
+    """Asterisk の extensions.conf
+
+    :param dict settings: 共通の設定
+    :param list rooms: 部屋ごとの設定
+    :return str: extensions.conf
+    """
+
+    lines = [
+        "; intercom.configgen で生成: 部屋の一覧(rooms.ini)を編集して生成し直すこと",
+        "",
+        f"[{settings['context']}]",
+        "exten = 100,1,Answer()",
+        "same = n,Wait(1)",
+        "same = n,Playback(hello-world)",
+        "same = n,Hangup()",
+    ]
+
+    for pattern in dial_patterns([room["name"] for room in rooms]):
+        lines += [
+            "",
+            f"exten = {pattern},1,Dial(PJSIP/${{EXTEN}},{settings['dial_timeout']})",
+            "same = n,Hangup()",
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def _device_values(settings: dict, rooms: list[dict], room: dict) -> dict:
+    """部屋の intercom.ini で書き換える値
+
+    :param dict settings: 共通の設定
+    :param list rooms: 部屋ごとの設定
+    :param dict room: 書き出す部屋
+    :return dict: セクション -> キー -> 値
+    """
+
+    others = [other for other in rooms if other is not room]
+    buddy = next(
+        (other for other in others if other["name"] == room["buddy"]), others[0]
+    )
+
+    # 一斉呼出の通話の数だけ通話を扱えるようにする(pjsua2 の上限まで)
+    # 上限を超える部屋に一斉呼出するなら、RTPマルチキャストで放送する
+    pages = sum(other["page"] for other in others)
+    max_calls = min(PJSUA_MAX_CALLS, max(4, pages + 1))
+
+    return {
+        "DEFAULT": {
+            "SipServer": f"sip:{settings['server']}",
+            "AccountUri": room["uri"],
+            "AccountName": room["name"],
+            "AccountData": room["password"],
+            "BuddyUri": buddy["uri"],
+        },
+        "PJSIP": {"MaxCalls": str(max_calls), "CallMode": settings["call_mode"]},
+        "AUDIO": {"Profile": settings["profile"]},
+        "CODEC": {"Priority": ", ".join(settings["codecs"])},
+        "MULTICAST": {"PageMode": "call" if pages < PJSUA_MAX_CALLS else "multicast"},
+    }
+
+
+def render_intercom_ini(
+    template: str, settings: dict, rooms: list[dict], room: dict
+) -> str:
+    """部屋ごとの intercom.ini
+
+    ひな形の [ROOM ...] セクションを除き、書き換えるキーの値を置き換えてから、
+    自分以外の部屋の [ROOM ...] セクションを末尾に加える。
+    コメントにしたキー(# キー = 値)は、その行を書き換えて有効にする。
+    ひな形のセクションに無いキーは、そのセクションの最後のキーの後に加える。
+
+    :param str template: ひな形の intercom.ini
+    :param dict settings: 共通の設定
+    :param list rooms: 部屋ごとの設定
+    :param dict room: 書き出す部屋
+    :return str: intercom.ini
+    """
+
+    values = _device_values(settings, rooms, room)
+
+    # セクションごとの行: (セクション名, 行)
+    blocks: list[tuple[str, list[str]]] = [("", [])]
+    for line in template.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]"):
+            blocks.append((stripped[1:-1].strip(), [line]))
+        else:
+            blocks[-1][1].append(line)
+
+    lines = []
+    for section, block in blocks:
+        if section.startswith("ROOM "):
+            continue
+
+        pending = {
+            key.lower(): (key, value) for key, value in values.get(section, {}).items()
+        }
+        last = 0
+        for index, line in enumerate(block):
+            stripped = line.lstrip()
+            commented = stripped.startswith(("#", ";"))
+            key, separator, _ = stripped.lstrip("#; ").partition("=")
+            key = key.strip()
+            if not separator or (commented and not key.isidentifier()):
+                continue
+            if not commented:
+                last = index
+            if key.lower() in pending:
+                _, value = pending.pop(key.lower())
+                block[index] = f"{key} = {value}"
+
+        added = [f"{key} = {value}" for key, value in pending.values()]
+        lines += block[: last + 1] + added + block[last + 1 :]
+
+    # 部屋のセクションは空行で区切る(ひな形の説明のコメントの直後は区切らない)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    separator = [] if lines and lines[-1].lstrip().startswith(("#", ";")) else [""]
+
+    for other in rooms:
+        if other is room:
+            continue
+        lines += separator + [
+            f"[ROOM {other['name']}]",
+            f"Name = {other['label']}",
+            f"Uri = {other['uri']}",
+            f"Page = {'yes' if other['page'] else 'no'}",
+        ]
+        if other["direct"]:
+            lines.append(f"Direct = {other['direct']}")
+        separator = [""]
+
+    return "\n".join(lines) + "\n"
+
+
+def generate(inventory: ConfigParser, template: str) -> dict[str, str]:
+    """部屋の一覧から、すべての設定ファイルを生成する
+
+    :param ConfigParser inventory: 部屋の一覧
+    :param str template: ひな形の intercom.ini
+    :return dict[str, str]: 出力先からの相対パス -> 内容
+    """
+
+    settings, rooms = load_inventory(inventory)
+
+    # 上限を超える部屋も着信は受け入れるが、Buddy を作らずプレゼンスを表示しない
+    if len(rooms) - 1 > PJSUA_MAX_BUDDIES:
+        logger.warning(
+            f"{len(rooms)} 部屋: 部屋ごとの通話相手が pjsua2 の上限 "
+            f"{PJSUA_MAX_BUDDIES} を超える(超えた部屋はプレゼンスを表示しない)"
+        )
+
+    files = {
+        "asterisk/pjsip.conf": render_pjsip_conf(settings, rooms),
+        "asterisk/extensions.conf": render_extensions_conf(settings, rooms),
+    }
+    for room in rooms:
+        files[f"{room['name']}/intercom.ini"] = render_intercom_ini(
+            template, settings, rooms, room
+        )
+    return files
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m intercom.configgen",
+        description="部屋の一覧から Asterisk と部屋ごとの intercom.ini を生成する",
+    )
+    parser.add_argument("inventory", help="部屋の一覧(rooms.ini)")
+    parser.add_argument("-o", "--output", default="build", help="出力先のディレクトリ")
+    parser.add_argument(
+        "-t",
+        "--template",
+        default=str(Path(__file__).parent.parent / "config" / "intercom.ini"),
+        help="ひな形の intercom.ini",
+    )
+    args = parser.parse_args(argv)
+
+    inventory = ConfigParser()
+    with open(args.inventory, encoding="utf-8") as file:
+        inventory.read_file(file)
+    template = Path(args.template).read_text(encoding="utf-8")
+
+    try:
+        files = generate(inventory, template)
+    except ValueError as message:
+        parser.error(str(message))
+
+    for name, content in files.items():
+        path = Path(args.output) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+    print(f"{len(files)} files -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
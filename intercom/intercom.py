@@ -1,19 +1,41 @@
-"""intercom"""
+"""intercom
 
-from contextlib import contextmanager
+起動では、kivy のビューを先に表示し、pjsua2 と PulseAudio の import と初期化は
+起動用のスレッドで並行して行う。どちらも終わったら(ready)、UIスレッドで
+ビューに関連付けて、操作を受け付ける。
+EventMode が polling では、pjsua2 のコールバックを UIスレッドで受けるので、
+並行するのは pjsua2 の import だけで、初期化は ready で UIスレッドで行う。
+"""
+
+from __future__ import annotations
+
+import importlib
+import math
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from kivy.app import App
-from kivy.clock import Clock
+from kivy.clock import Clock, mainthread
+from kivy.logger import Logger
 from kivy.uix.boxlayout import BoxLayout
-from kivy.properties import ObjectProperty
-
-import pjsua2 as pj
-from libs.pjsip.useragent import UserAgent as UA
-from libs.pjsip.account import Account as ACC
-from libs.pjsip.call import Call as CALL
-
-from libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+from kivy.uix.recycleview import RecycleView
+from kivy.properties import ObjectProperty, StringProperty
+
+# pjsua2 と libpulse に依存しないモジュールだけを、ここで import する
+from libs.pjsip.events import RegState, CallState, BuddyState
+from libs.pjsip.codec import OpusSettings
+from libs.pjsip.adaptive import AdaptivePolicy
+from libs.pjsip.telemetry import Telemetry
+from libs.pjsip.direct import DirectDial
+from libs.pjsip.uri import normalize_uri
+from libs.startup import PROFILER
+
+if TYPE_CHECKING:
+    from libs.pjsip.useragent import UserAgent as UA
+    from libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+    from libs.pulseaudio.libpulse import LevelMeterPulseaudio as LPA
 
 from configparser import ConfigParser
 
@@ -22,6 +44,213 @@ config = ConfigParser()
 config.read(ini_dir + "/intercom.ini")
 
 
+def load_rooms(config: ConfigParser) -> list[dict]:
+    """設定ファイルから部屋(通話相手)の一覧を読み込む
+
+    [ROOM 名前] セクションごとに1部屋。
+      Uri: 部屋の SIP URI
+      Name: 表示名(省略時はセクション名の 名前)
+      Page: 一斉呼出に含めるかどうか(省略時は yes)
+      Direct: SIPサーバーを経由しない直接の URI "sip:user@ip:port"(省略時は無し)
+    [ROOM ...] セクションが無ければ、DEFAULT の BuddyUri(と BuddyDirect)だけを部屋とする。
+
+    :param ConfigParser config: 設定
+    :return list[dict]: 部屋ごとの name, uri, page, direct
+    """
+
+    rooms = []
+    for section in config.sections():
+        if not section.startswith("ROOM "):
+            continue
+
+        rooms.append(
+            {
+                "name": config.get(section, "Name", fallback=section[5:].strip()),
+                "uri": config.get(section, "Uri"),
+                "page": config.getboolean(section, "Page", fallback=True),
+                "direct": config.get(section, "Direct", fallback=""),
+            }
+        )
+
+    if not rooms:
+        uri = config["DEFAULT"]["BuddyUri"]
+        direct = config.get("DEFAULT", "BuddyDirect", fallback="")
+        rooms.append({"name": uri, "uri": uri, "page": True, "direct": direct})
+
+    return rooms
+
+
+class VolumeControl(BoxLayout):
+    """音量調整の部品
+
+    スライダーと VolumePulseaudio の音量値を双方向に反映する。
+    * スライダーの操作: 音量値を設定する
+    * サーバー側の変化: スライダーに反映する(音量値の設定はしない)
+    LevelMeterPulseaudio のピーク値をVUメーターに表示する。
+    """
+
+    # 機器名
+    device = ObjectProperty()
+    # 音量スライダー
+    slider = ObjectProperty()
+    # VUメーター
+    level = ObjectProperty()
+
+    # VUメーターの表示範囲(dB)
+    LEVEL_RANGE_DB = 60.0
+
+    def bind_volume(self, vpa: VPA):
+        """音量コントロールを関連付ける
+
+        :param VolumePulseaudio vpa: 音量コントロール
+        """
+
+        self.vpa = vpa
+        self._showing = False
+
+        vpa.subscribe(self.notify_volume)
+        self.show_volume(vpa.value)
+        self.slider.bind(value=self.set_volume)
+
+    @mainthread
+    def notify_volume(self, value: int, origin: str):
+        """callback: 音量値の変化をビューに反映
+
+        PulseAudioの専用スレッドから呼び出されるので、UIスレッドで実行する。
+        自分で設定した音量値("LOCAL")は、既にスライダーに反映されている。
+
+        :param int value: 音量値
+        :param str origin: 変化の発生元 "SERVER" か "LOCAL"
+        """
+
+        if origin == "SERVER":
+            self.show_volume(value)
+
+    def show_volume(self, value: int):
+        """音量値をスライダーに反映
+
+        スライダーの値が変わらなければ、何もしない(再レイアウトもしない)。
+        反映による value の変化では、音量値を設定しない。
+
+        :param int value: 音量値
+        """
+
+        if self.slider.value == value:
+            return
+
+        self._showing = True
+        try:
+            self.slider.value = value
+        finally:
+            self._showing = False
+
+    def set_volume(self, obj, value: float):
+        """ビューから音量値を設定
+
+        設定の完了は待たないので、UIスレッドはブロックしない。
+        サーバー側の変化を反映しただけの場合や、音量値が変わらない場合は設定しない。
+
+        :param float value: スライダーの値
+        """
+
+        if self._showing or int(value) == self.vpa.value:
+            return
+
+        self.vpa.value = int(value)
+
+    def bind_level(self, lpa: LPA | None, listener=None):
+        """レベルメーターを関連付け、測定を開始する
+
+        :param LevelMeterPulseaudio lpa: レベルメーター(None なら測定しない)
+        :param Callable listener: ピーク値とRMS値を、PulseAudioの専用スレッドで受け取る関数
+        """
+
+        self.lpa = lpa
+        self._level_listener = listener
+        if lpa is not None:
+            lpa.start(self._on_level)
+
+    def _on_level(self, peak: float, rms: float):
+        """callback: レベルメーターの測定値
+
+        PulseAudioの専用スレッドで listener に渡してから、VUメーターに反映する。
+
+        :param float peak: ピーク値(0.0 - 1.0)
+        :param float rms: RMS値(0.0 - 1.0)
+        """
+
+        if self._level_listener is not None:
+            self._level_listener(peak, rms)
+        self.notify_level(peak, rms)
+
+    @mainthread
+    def notify_level(self, peak: float, rms: float):
+        """callback: ピーク値をVUメーターに反映
+
+        PulseAudioの専用スレッドから呼び出されるので、UIスレッドで実行する。
+        -LEVEL_RANGE_DB dB から 0 dB までを、0.0 から 1.0 で表示する。
+
+        :param float peak: ピーク値(0.0 - 1.0)
+        :param float rms: RMS値(0.0 - 1.0)
+        """
+
+        if peak <= 0.0:
+            value = 0.0
+        else:
+            value = max(0.0, 1.0 + 20.0 * math.log10(peak) / self.LEVEL_RANGE_DB)
+
+        if self.level.value != value:
+            self.level.value = value
+
+
+class RoomEntry(BoxLayout):
+    """部屋の一覧の1行
+
+    RecycleView が data の内容を設定して使い回す。
+    """
+
+    # 部屋の表示名
+    name = StringProperty()
+    # 部屋の SIP URI
+    uri = StringProperty()
+    # プレゼンス状態
+    status = StringProperty()
+
+
+class RoomDirectory(RecycleView):
+    """部屋の一覧
+
+    RecycleView は見えている行の分だけ RoomEntry を作って使い回すので、
+    部屋が数百あってもフレームごとの処理は増えない。
+    プレゼンス状態の更新は、URI から行番号を引いて、その行だけを書き換える。
+    """
+
+    def set_rooms(self, rooms: list[dict]):
+        """部屋の一覧を表示する
+
+        :param list rooms: 部屋ごとの name, uri
+        """
+
+        self.data = [
+            {"name": room["name"], "uri": room["uri"], "status": ""} for room in rooms
+        ]
+        self._rows = {normalize_uri(room["uri"]): row for row, room in enumerate(rooms)}
+
+    def set_status(self, uri: str, status: str):
+        """部屋のプレゼンス状態を表示する
+
+        :param str uri: 部屋の SIP URI
+        :param str status: プレゼンス状態
+        """
+
+        row = self._rows.get(normalize_uri(uri))
+        if row is None or self.data[row]["status"] == status:
+            return
+
+        self.data[row]["status"] = status
+        self.refresh_from_data()
+
+
 class MainBoxLayout(BoxLayout):
     """メインビュー
 
@@ -36,41 +265,311 @@ class MainBoxLayout(BoxLayout):
     speakervolume = ObjectProperty()
     # 通話ボタン
     calltogglebutton = ObjectProperty()
+    # 部屋の一覧
+    directory = ObjectProperty()
+    # 一斉呼出ボタン
+    pagetogglebutton = ObjectProperty()
+
+    # 通話の開始・切断時のスピーカーのフェードの秒数
+    FADE_SECONDS = 0.3
+    # Opus の設定を見直す間隔(秒)
+    ADAPT_SECONDS = 2.0
+    # 直接の発信の応答を確かめる間隔(秒)
+    DIRECT_SECONDS = 0.25
+    # 音声が SIPサーバーで中継されていないかを確かめる間隔(秒)
+    MEDIA_PATH_SECONDS = 3.0
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-        self.user_agent = UA()
+        # 起動中: pjsua2 と PulseAudio の初期化が終わる(ready)まで、操作を受け付けない
+        self.user_agent: UA | None = None
+        self.ready = False
+        # フェードアウト後の切断の予定(切断中なら、もう一度押しても予定しない)
+        self._hangup_event = None
+        self.titlebar.title.text = "インターホン: 起動中"
+        self._startup_widgets = (
+            self.calltogglebutton,
+            self.pagetogglebutton,
+            self.micvolume,
+            self.speakervolume,
+        )
+        for widget in self._startup_widgets:
+            widget.disabled = True
+
+        # PJSUA2ライブラリィの実行方法: "polling"(UIスレッド) か "thread"(専用スレッド)
+        self.event_mode = config.get("PJSIP", "EventMode", fallback="polling")
+
+        # コーデックの優先度と Opus の設定
+        packet_loss = config.getint("CODEC", "OpusPacketLoss", fallback=0)
+        self.opus = OpusSettings(
+            bitrate=config.getint("CODEC", "OpusBitrate", fallback=24000),
+            complexity=config.getint("CODEC", "OpusComplexity", fallback=5),
+            cbr=config.getboolean("CODEC", "OpusCbr", fallback=False),
+            packet_loss=packet_loss,
+            fec=packet_loss > 0,
+            sample_rate=config.getint("CODEC", "OpusSampleRate", fallback=16000),
+        )
+
+        # 通話状態、通話可能かどうかは、変化の通知を受けた時だけビューに反映
+        self.registered = False
+        self.buddy_offline = False
+        self.buddy_uri = normalize_uri(config["DEFAULT"]["BuddyUri"])
+
+        # 発信の方法: "server"(SIPサーバーを経由) か "direct"(部屋へ直接)
+        self.call_mode = config.get("PJSIP", "CallMode", fallback="server")
+        self.fallback = config.getboolean("PJSIP", "Fallback", fallback=True)
+
+        # 部屋の一覧は、pjsua2 の初期化を待たずに表示する
+        self.rooms = load_rooms(config)
+        self.directory.set_rooms(self.rooms)
+
+        # 部屋への直接の発信: 届かなければ SIPサーバーを経由して発信し直す
+        routes = {room["uri"]: room["direct"] for room in self.rooms if room["direct"]}
+        buddy_direct = config.get("DEFAULT", "BuddyDirect", fallback="")
+        if buddy_direct:
+            routes.setdefault(config["DEFAULT"]["BuddyUri"], buddy_direct)
+        self.direct = DirectDial(
+            routes if self.call_mode == "direct" else {},
+            self.fallback,
+            config.getfloat("PJSIP", "DirectTimeout", fallback=2.0),
+        )
+
+        # 通話ごとの音声品質を記録し、Prometheus のテキスト形式で公開
+        self.telemetry = Telemetry(config.getint("TELEMETRY", "Capacity", fallback=120))
+        self.telemetry_file = config.get("TELEMETRY", "TextFile", fallback="")
+        http_port = config.getint("TELEMETRY", "HttpPort", fallback=0)
+        if http_port:
+            self.telemetry.serve(
+                config.get("TELEMETRY", "HttpAddress", fallback="127.0.0.1"), http_port
+            )
+
+        # 一斉呼出: "call"(部屋ごとに通話) か "multicast"(RTPマルチキャストで放送)
+        self.page_mode = config.get("MULTICAST", "PageMode", fallback="call")
+
+        # pjsua2 と PulseAudio の初期化を、起動用のスレッドで並行して行う
+        self._startup = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+        self._pjsip_started = self._startup.submit(self.start_pjsip)
+        self._pulseaudio_started = self._startup.submit(self.start_pulseaudio)
+        self._pjsip_started.add_done_callback(self.notify_started)
+        self._pulseaudio_started.add_done_callback(self.notify_started)
+
+    def start_pjsip(self) -> UA | None:
+        """起動用のスレッド: pjsua2 の import と初期化
+
+        "polling" では、pjsua2 のコールバックを UIスレッドで受けるので、
+        初期化は ready で UIスレッドで行う(import だけをここで済ませる)。
+
+        :return UserAgent: 初期化した UserAgent、"polling" では None
+        """
+
+        with PROFILER.phase("import pjsua2"):
+            importlib.import_module("libs.pjsip.useragent")
+            importlib.import_module("libs.pjsip.paging")
 
-        # PJSUA2ライブラリィの実行をポーリング開始
-        Clock.schedule_interval(self.polling_pjlib, 0.01)
+        if self.event_mode == "polling":
+            return None
+        return self.create_user_agent()
+
+    def create_user_agent(self) -> UA:
+        """pjsua2 の初期化、アカウントと通話相手の登録
+
+        "thread" では起動用のスレッドで、"polling" では UIスレッドで呼び出す。
+
+        :return UserAgent: 初期化した UserAgent
+        """
+
+        from libs.pjsip.useragent import UserAgent as UA
+        from libs.pjsip.error import PJError
+        from libs.pjsip.paging import GroupPage
+        from libs.pjsip.multicast import MulticastPage, MulticastListener
+
+        with PROFILER.phase("pjsua2 init"):
+            max_calls = config.getint("PJSIP", "MaxCalls", fallback=4)
+            # 遅延のプロファイル: ジッターバッファとサウンドデバイスのバッファ
+            profile = config.get("AUDIO", "Profile", fallback="balanced")
+            user_agent = UA(self.event_mode, max_calls, profile)
+
+        # コールバックの通知は、ready から UIスレッドで受け取る
+        user_agent.dispatcher.subscribe(RegState, self.notify_regstate)
+        user_agent.dispatcher.subscribe(CallState, self.notify_callstate)
+        user_agent.dispatcher.subscribe(BuddyState, self.notify_buddystate)
+
+        with PROFILER.phase("pjsua2 codecs"):
+            user_agent.configureCodecs(
+                config.get("CODEC", "Priority", fallback="pcmu"), self.opus
+            )
 
         # アカウント登録
-        self.user_agent.registryAccount(
-            config["DEFAULT"]["AccountUri"],
-            config["DEFAULT"]["SipServer"],
-            config["DEFAULT"]["AccountName"],
-            config["DEFAULT"]["AccountData"],
+        # "direct" で SIPサーバーに戻らない場合は、登録しないアカウントとする
+        with PROFILER.phase("pjsua2 account"):
+            if self.call_mode == "direct" and not self.fallback:
+                user_agent.registryLocalAccount(
+                    config["DEFAULT"]["AccountUri"],
+                    config["DEFAULT"]["AccountName"],
+                    config["DEFAULT"]["AccountData"],
+                )
+            else:
+                user_agent.registryAccount(
+                    config["DEFAULT"]["AccountUri"],
+                    config["DEFAULT"]["SipServer"],
+                    config["DEFAULT"]["AccountName"],
+                    config["DEFAULT"]["AccountData"],
+                )
+
+        # 通話中は、RTCP の統計から Opus のビットレートと FEC を見直す
+        if config.getboolean("CODEC", "Adaptive", fallback=False):
+            user_agent.account.adaptive = AdaptivePolicy()
+            user_agent.account.opus = self.opus
+
+        # 接続可の通話先登録: 通話ボタンの通話先、続けて部屋ごと
+        # プレゼンスの購読は、既定では通話ボタンの通話先だけ(部屋どうしで N² にしない)
+        presence = config.get("PJSIP", "Presence", fallback="buddy")
+        with PROFILER.phase("pjsua2 buddies"):
+            user_agent.registryBuddy(
+                config["DEFAULT"]["BuddyUri"], presence in ("buddy", "rooms")
+            )
+            for room in self.rooms:
+                user_agent.registryBuddy(room["uri"], presence == "rooms")
+
+        self.page = GroupPage(user_agent.account)
+        group = config.get("MULTICAST", "Group", fallback="239.255.0.1")
+        port = config.getint("MULTICAST", "Port", fallback=5004)
+        self.multicast_page = MulticastPage(
+            group, port, config.getint("MULTICAST", "TTL", fallback=1)
         )
 
-        # 接続可の通話先登録
-        self.user_agent.registryBuddy(config["DEFAULT"]["BuddyUri"])
+        # 他の部屋からの放送を受信して、スピーカーで鳴らす
+        # 受信できなくても(ポートが使用中など)、SIPの通話は使えるようにする
+        self.multicast_listener = MulticastListener(group, port)
+        if config.getboolean("MULTICAST", "Listen", fallback=False):
+            try:
+                self.multicast_listener.start()
+            except PJError as message:
+                Logger.warning(f"Intercom: 放送を受信しない: {message}")
 
-        # 通話状態の監視を開始(通話中かどうか、通話可能かどうか)
-        self.event = Clock.schedule_interval(self.notify_invite, 0.1)
-        Clock.schedule_interval(self.notify_callabled, 0.1)
+        return user_agent
 
-        # マイクの音量コントロールを登録
-        self.micvolume.device.text = "マイク"
-        self.vpa_mic = VPA("SOURCE", "mic")
-        Clock.schedule_interval(self.get_micvolume_value, 0.1)
-        self.micvolume.slider.bind(value=self.set_micvolume_value)
+    def start_pulseaudio(self) -> None:
+        """起動用のスレッド: libpulse の import と、PulseAudio サーバーへの接続
+
+        ビューへの関連付け(購読とレベルメーターの開始)は、ready で UIスレッドで行う。
+        """
+
+        with PROFILER.phase("import libpulse"):
+            from libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+            from libs.pulseaudio.libpulse import LevelMeterPulseaudio as LPA
+            from libs.pulseaudio.libpulse import VolumeRamp, VolumeDucking
+
+        with PROFILER.phase("pulseaudio speaker"):
+            self.vpa_speaker = VPA("SINK", "speaker")
+            self.lpa_speaker = self.create_level_meter(LPA, "SINK", "speaker-level")
+
+        with PROFILER.phase("pulseaudio mic"):
+            self.vpa_mic = VPA("SOURCE", "mic")
+            self.lpa_mic = self.create_level_meter(LPA, "SOURCE", "mic-level")
+
+        # スピーカーのフェードと、話している間のダッキング(通話中だけ)
+        self.speaker_ramp = VolumeRamp(self.vpa_speaker)
+        self.ducking = VolumeDucking(self.speaker_ramp)
+
+    @staticmethod
+    def create_level_meter(lpa: type, device: str, name: str) -> LPA | None:
+        """レベルメーターを作る
+
+        NumPy が無ければ、レベルメーター無しで音量コントロールだけを使う。
+
+        :param type lpa: LevelMeterPulseaudio
+        :param str device: "SINK" か "SOURCE"
+        :param str name: ストリームの名前
+        :return LevelMeterPulseaudio: レベルメーター、作れなければ None
+        """
+
+        try:
+            return lpa(device, name)
+        except ImportError as message:
+            Logger.warning(f"Intercom: {name}: {message}")
+            return None
+
+    @mainthread
+    def notify_started(self, future: Future):
+        """callback: 起動用のスレッドの初期化が終わった
+
+        pjsua2 と PulseAudio のどちらも終わったら ready にする。
+        初期化の例外は、ここで UIスレッドに送り出す。
+
+        :param Future future: 終わった初期化
+        """
+
+        if self.ready:
+            return
+        if not (self._pjsip_started.done() and self._pulseaudio_started.done()):
+            return
+
+        self._startup.shutdown(wait=False)
+
+        # 起動用のスレッドで import 済みなので、ここでは待たない
+        from libs.pjsip.error import PJError
+        from libs.pulseaudio.libpulse import PAError
+
+        try:
+            user_agent = self._pjsip_started.result()
+            self._pulseaudio_started.result()
+
+            if user_agent is None:
+                # "polling": UIスレッドで初期化し、UIスレッドで polling する
+                user_agent = self.create_user_agent()
+                Clock.schedule_interval(self.polling_pjlib, 0.01)
+            else:
+                # "thread": 起動用のスレッドで作ったので、UIスレッドを登録する
+                user_agent.registerThread("ui")
+            self.user_agent = user_agent
+
+            with PROFILER.phase("bind"):
+                self.bind_pulseaudio()
+
+        except (PJError, PAError) as message:
+            # 操作は受け付けないまま、起動できなかったことをタイトルに表示する
+            Logger.error(f"Intercom: 起動できない: {message}")
+            self.titlebar.title.text = f"インターホン: 起動できない ({message})"
+            return
+
+        # コールバックから受け渡された処理を、フレームごとに実行
+        Clock.schedule_interval(self.dispatch_pjlib, 0)
+
+        if user_agent.account.adaptive is not None:
+            Clock.schedule_interval(self.adapt_calls, self.ADAPT_SECONDS)
+        if self.call_mode == "direct":
+            Clock.schedule_interval(self.expire_direct, self.DIRECT_SECONDS)
+
+        # SIPサーバーを経由した通話でも、音声は部屋どうしで直接流す
+        Clock.schedule_interval(self.check_media_path, self.MEDIA_PATH_SECONDS)
+
+        interval = config.getfloat("TELEMETRY", "Interval", fallback=5.0)
+        if interval > 0:
+            Clock.schedule_interval(self.sample_telemetry, interval)
+
+        for widget in self._startup_widgets:
+            widget.disabled = False
+        self.ready = True
+        self.show_title()
+
+        PROFILER.mark("ready")
+        if PROFILER.enabled:
+            print(PROFILER.report(), flush=True)
+
+    def bind_pulseaudio(self):
+        """PulseAudio の音量コントロールとレベルメーターをビューに関連付ける"""
 
         # スピーカーの音量コントロールを登録
         self.speakervolume.device.text = "スピーカー"
-        self.vpa_speaker = VPA("SINK", "speaker")
-        Clock.schedule_interval(self.get_speakervolume_value, 0.1)
-        self.speakervolume.slider.bind(value=self.set_speakervolume_value)
+        self.speakervolume.bind_volume(self.vpa_speaker)
+        self.speakervolume.bind_level(self.lpa_speaker)
+
+        # マイクの音量コントロールを登録
+        self.micvolume.device.text = "マイク"
+        self.micvolume.bind_volume(self.vpa_mic)
+        self.micvolume.bind_level(self.lpa_mic, self.ducking.on_level)
 
     def polling_pjlib(self, dt):
         """callback: pjsua2ライブラリィの実行をpolling
@@ -82,50 +581,48 @@ class MainBoxLayout(BoxLayout):
         # 利用上の注意点－呼び出し元のスレッドをブロックする。
         self.user_agent.endpoint.libHandleEvents(10)
 
-    def get_micvolume_value(self, dt):
-        """callback: マイクの音量値をビューに反映
+    def dispatch_pjlib(self, dt):
+        """callback: pjsua2のコールバックから受け渡された処理を実行
 
-        :param float dt: 呼び出しの秒間隔
-        """
-        self.micvolume.slider.value = self.vpa_mic.value
-
-    def get_speakervolume_value(self, dt):
-        """callback: スピーカーの音量値をビューに反映
+        ブロックしない。
 
         :param float dt: 呼び出しの秒間隔
         """
-        self.speakervolume.slider.value = self.vpa_speaker.value
 
-    def set_micvolume_value(self, obj, value: int):
-        """ビューからマイクの音量値を設定
+        self.user_agent.dispatcher.drain()
 
-        :param int value: 音量値
+    def adapt_calls(self, dt):
+        """callback: 通話ごとに、RTCP の統計から Opus の設定を見直す
+
+        :param float dt: 呼び出しの秒間隔
         """
 
-        self.vpa_mic.value = int(value)
+        for call in self.user_agent.account.calls:
+            call.adaptCodec()
 
-    def set_speakervolume_value(self, obj, value: int):
-        """ビューからスピーカーの音量値を設定
+    def check_media_path(self, dt):
+        """callback: 音声が SIPサーバーで中継されている通話は、re-INVITE する
 
-        :param int value: 音量値
+        :param float dt: 呼び出しの秒間隔
         """
 
-        self.vpa_speaker.value = int(value)
+        for call in self.user_agent.account.calls:
+            call.checkMediaPath()
 
-    @contextmanager
-    def pause_clockevent(self, clockevent):
-        """ClockEvent を一時中断
+    def sample_telemetry(self, dt):
+        """callback: 通話ごとに音声品質の標本を記録し、テキストファイルに書き出す
 
-        :param clockevent event: 中断したいclockイベント
+        :param float dt: 呼び出しの秒間隔
         """
 
-        def clockEventPause(clockevent):
-            clockevent.cancel()
+        for call in self.user_agent.account.calls:
+            call.sampleTelemetry(self.telemetry)
 
-        try:
-            yield
-        finally:
-            clockevent()
+        if self.telemetry_file:
+            try:
+                self.telemetry.write_textfile(self.telemetry_file)
+            except OSError as message:
+                pass
 
     def on_press_calltogglebutton(self, state):
         """通話ボタン(calltogglebutton)をpressした際の操作
@@ -136,85 +633,239 @@ class MainBoxLayout(BoxLayout):
         :param str state: calltogglebutton.state
         """
 
-        # この処理中、Clockイベント(notify_inviteルーチン) を一時停止する
-        with self.pause_clockevent(self.event):
-            if state == "normal":
-                # down(通話中) -> normal(非通話)
-                self.hang_up()
+        if state == "normal":
+            # down(通話中) -> normal(非通話)
+            self.hang_up()
+        else:
+            # normal(非通話) -> down(発信)
+            self.make_call()
+
+    def on_press_pagetogglebutton(self, state):
+        """一斉呼出ボタン(pagetogglebutton)をpressした際の操作
+
+        down(一斉呼出) <- normal: 一斉呼出に含めるすべての部屋に発信する
+        normal <- down(一斉呼出): すべての通話を切断する
+        PageMode が "multicast" の場合は、通話をせずに放送を開始／終了する。
+
+        :param str state: pagetogglebutton.state
+        """
+
+        if self.page_mode == "multicast":
+            self.broadcast(state == "down")
+        elif state == "normal":
+            self.hang_up()
+        else:
+            uris = [room["uri"] for room in self.rooms if room["page"]]
+            if self.page.start(self.direct.targets(uris)):
+                self.calltogglebutton.state = "down"
             else:
-                # normal(非通話) -> down(発信)
-                self.make_call()
+                self.pagetogglebutton.state = "normal"
+
+    def broadcast(self, start: bool):
+        """RTPマルチキャストによる一斉放送の開始／終了
+
+        :param bool start: 開始ならTrue
+        """
+
+        from libs.pjsip.error import PJError
+
+        if not start:
+            self.multicast_page.stop()
+            return
+
+        try:
+            self.multicast_page.start()
+        except PJError as message:
+            self.pagetogglebutton.state = "normal"
+
+    def call_room(self, uri: str):
+        """部屋の一覧から1部屋に発信
+
+        :param str uri: 部屋の SIP URI
+        """
+
+        if not self.ready or self.user_agent.account.calls.current is not None:
+            return
+
+        self.calltogglebutton.state = "down"
+        self.make_call(uri)
 
     def hang_up(self):
         """通話の切断
 
-        発信の通話でも着信の通話でも切断します。
+        発信の通話でも着信の通話でも、一斉呼出の通話もすべて切断します。
+        スピーカーをフェードアウトしてから切断し、音量を元に戻します。
+        """
+
+        calls = list(self.user_agent.account.calls)
+        if not calls or self._hangup_event is not None:
+            return
+
+        self.ducking.active = False
+        self.speaker_ramp.fade_out(self.FADE_SECONDS)
+        self._hangup_event = Clock.schedule_once(
+            lambda dt: self.disconnect(calls), self.FADE_SECONDS
+        )
+
+    def disconnect(self, calls):
+        """フェードアウト後の切断
+
+        :param list calls: 切断する通話
         """
 
-        call = self.user_agent.account.call_list[-1]
+        import pjsua2 as pj
+
+        self._hangup_event = None
+
+        # 一斉呼出の通話は GroupPage で切断し、残りの通話をここで切断する
+        paged = set(self.page.call_ids)
+        self.page.hangup()
+
         prm = pj.CallOpParam()
-        call.hangup(prm)
+        for call in calls:
+            if call.getId() in paged:
+                continue
+            try:
+                call.hangup(prm)
 
-        self.user_agent.account.call_list.pop()
+            except pj.Error as message:
+                # フェードアウト中に相手が切断した
+                pass
 
-    def make_call(self):
+        self.speaker_ramp.restore()
+
+    def make_call(self, uri: str | None = None, direct: bool = True):
         """通話の発信
 
-        接続可の通話先への発信
+        接続可の通話先への発信。CallMode が "direct" なら、部屋の直接の URI へ発信する。
+
+        :param str uri: 通話先(省略時は通話ボタンの通話先)
+        :param bool direct: 直接の URI があれば使うかどうか(False: SIPサーバーを経由)
         """
 
+        import pjsua2 as pj
+        from libs.pjsip.call import Call as CALL
+
         prm = pj.CallOpParam()
         prm.opt.audioCount = 1
         prm.opt.videoCount = 0
 
+        if uri is None:
+            uri = self.user_agent.buddy.getInfo().uri
+
+        target = self.direct.target(uri) if direct else uri
         call = CALL(self.user_agent.account)
-        call.makeCall(self.user_agent.buddy.getInfo().uri, prm)
+        call.makeCall(target, prm)
 
-        self.user_agent.account.call_list.append(call)
+        # 切断されたら、Call.onCallState で登録簿から除かれる
+        if self.user_agent.account.calls.add(call) and target != uri:
+            self.direct.started(call.getId(), uri, time.monotonic())
 
-    def notify_invite(self, dt):
-        """callback: 通話状態(通話[INVITE]/切断[not INVITE])をビューに反映
+    def expire_direct(self, dt):
+        """callback: 応答を待つ時間を過ぎた直接の発信を取り消す
 
-        通話状態に応じて、calltogglebutton.stateを変更します。
-        * 通話中: calltogglebutton.state を"down"にする。
-        * 切断状態(無CALLを含む): calltogglebutton.state を"normal"にする。
+        取り消した通話の切断(CallState)で、SIPサーバーを経由して発信し直す。
 
         :param float dt: 呼び出しの秒間隔
         """
 
-        if self.user_agent.account.call_list:
-            values = [
-                self.calltogglebutton.state,
-                self.user_agent.account.call_list[-1].isActive(),
-            ]
-            match values:
-                case ["normal", True]:
-                    self.calltogglebutton.state = "down"
-                case ["down", False]:
-                    self.calltogglebutton.state = "normal"
-                case _:
-                    pass
-        else:
+        import pjsua2 as pj
+
+        prm = pj.CallOpParam()
+        for call_id in self.direct.expired(time.monotonic()):
+            call = self.user_agent.account.calls.get(call_id)
+            if call is None:
+                continue
+            try:
+                call.hangup(prm)
+            except pj.Error as message:
+                pass
+
+    def notify_callstate(self, event: CallState):
+        """callback: 通話状態(通話中/切断)をビューに反映
+
+        通話状態の変化の通知を受けた時だけ、calltogglebutton.stateを変更します。
+        * 通話中: calltogglebutton.state を"down"にする。
+        * すべて切断: calltogglebutton.state, pagetogglebutton.state を"normal"にする。
+          通話は Call.onCallState で登録簿から除かれ、破棄される。
+
+        :param CallState event: 通話状態の変化
+        """
+
+        import pjsua2 as pj
+
+        if event.disconnected:
+            self.telemetry.remove(event.call_id)
+
+        # 直接の発信が届かなかった: SIPサーバーを経由して発信し直す
+        retry = self.direct.update(event)
+        if retry is not None:
+            try:
+                self.make_call(retry, direct=False)
+            except pj.Error as message:
+                pass
+
+        if event.confirmed:
+            self.calltogglebutton.state = "down"
+            # 最初の通話の開始: スピーカーをフェードインし、ダッキングを開始
+            if not self.ducking.active:
+                self.speaker_ramp.fade_in(self.FADE_SECONDS)
+                self.ducking.active = True
+
+        elif event.disconnected and self.user_agent.account.calls.current is None:
             self.calltogglebutton.state = "normal"
+            if not self.multicast_page.active:
+                self.pagetogglebutton.state = "normal"
+            # 相手が切断: ダッキングを終了
+            self.ducking.active = False
 
-    def notify_callabled(self, dt):
+    def notify_regstate(self, event: RegState):
         """callback: 通話可能かどうかをビューに反映
 
         * アカウントが登録されている OK/NO
 
-        :param float dt: 呼び出しの秒間隔
+        :param RegState event: 登録状態の変化
         """
 
-        if self.user_agent.account.getInfo().regIsActive:
-            self.titlebar.title.text = "インターホン: OK"
-        else:
+        self.registered = event.active
+        self.show_title()
+
+    def notify_buddystate(self, event: BuddyState):
+        """callback: 通話相手が不在かどうかをビューに反映
+
+        部屋の一覧にプレゼンス状態を表示し、通話ボタンの通話相手ならタイトルにも反映する。
+        プレゼンスが不明の場合は、不在として扱わない。
+
+        :param BuddyState event: プレゼンス状態の変化
+        """
+
+        self.directory.set_status(event.uri, event.text)
+
+        if normalize_uri(event.uri) == self.buddy_uri:
+            self.buddy_offline = event.offline
+            self.show_title()
+
+    def show_title(self):
+        """通話可能かどうかをタイトルに表示"""
+
+        if not self.registered and self.call_mode != "direct":
             self.titlebar.title.text = "インターホン: NO"
+        elif self.buddy_offline:
+            self.titlebar.title.text = "インターホン: OK (相手: 不在)"
+        else:
+            self.titlebar.title.text = "インターホン: OK"
+
 
 class IntercomApp(App):
     def build(self):
-        self.root = MainBoxLayout()
+        with PROFILER.phase("build"):
+            self.root = MainBoxLayout()
         return self.root
 
+    def on_start(self):
+        # ビューを表示した最初のフレーム
+        Clock.schedule_once(lambda dt: PROFILER.mark("first frame"))
+
     def on_stop(self):
         super().on_stop()
 
@@ -1 +1 @@
-"""pulseaudio, pjsip"""
+"""pulseaudio, pjsip, startup"""
@@ -1 +1,2 @@
-"""demo, error, useragent, account, call"""
+"""demo, error, useragent, account, call, dispatcher, events, registry, uri, paging,
+rtp, multicast, codec, adaptive, telemetry, profile, direct"""
@@ -4,6 +4,12 @@ import pjsua2 as pj
 
 from .error import PJError, PJLogging, logger
 from .call import Call as CALL
+from .dispatcher import Dispatcher
+from .events import RegState, BuddyState
+from .registry import CallRegistry
+from .adaptive import AdaptivePolicy
+from .codec import OpusSettings
+from .uri import BuddyIndex
 
 
 class Account(pj.Account):
@@ -11,17 +17,46 @@ class Account(pj.Account):
 
     アカウントをSIPサーバへ登録する。
     着信を待機し、応答もしくは切断する。
+    通話は calls(CallRegistry)で call id をキーにして保持し、
+    切断されたら Call.onCallState で登録簿から除く。
     """
 
-    def __init__(self):
+    def __init__(self, dispatcher: Dispatcher | None = None):
         super().__init__()
 
+        # コールバックからUIスレッドへの処理の受け渡し
+        self.dispatcher = dispatcher if dispatcher is not None else Dispatcher()
+
         # 切断するまで、callインスタンスを保持する。
-        self.call_list = []
+        self.calls = CallRegistry()
+
+        # 着信を受け入れる通話相手の URI の索引(通話相手の登録時に更新する)
+        self.buddies = BuddyIndex()
+
+        # 通話ごとの Opus の設定の適応: 規則と最初の設定(None なら適応しない)
+        self.adaptive: AdaptivePolicy | None = None
+        self.opus: OpusSettings | None = None
+
+        # SIPサーバーの IP アドレス: 音声が SIPサーバーで中継されているかの判定に使う
+        self.servers: frozenset[str] = frozenset()
 
     def __del__(self):
         super().shutdown()
 
+    def onRegState(self, prm):
+        """登録状態の変更を通知
+
+        AccountInfo を取得せずに、コールバック変数から登録状態を作って配る。
+        :param OnRegStateParam prm: コールバック変数
+        """
+
+        active = (
+            prm.status == pj.PJ_SUCCESS and prm.code // 100 == 2 and prm.expiration > 0
+        )
+        self.dispatcher.publish(RegState(active, prm.code, prm.reason))
+
+        logger.info(f"登録状態: {prm.code} {prm.reason}")
+
     def onIncomingCall(self, prm):
         """着信時の通知
 
@@ -31,16 +66,13 @@ class Account(pj.Account):
 
         try:
             call = CALL(self, prm.callId)
+            self.calls.add(call)
             call_info = call.getInfo()
             call_prm = pj.CallOpParam()
 
             # 着信相手をbuddyに限定
-            # 書式が異なるので、変換: CallInfo.remoteUri <= BuddyInfo.uri
-            buddy_uri_list = map(
-                lambda buddy: "<" + buddy.getInfo().uri + ">", self.enumBuddies2()
-            )
-
-            if call_info.remoteUri in buddy_uri_list:
+            # 書式が異なるので、正規化した URI で比較: CallInfo.remoteUri <=> BuddyInfo.uri
+            if call_info.remoteUri in self.buddies:
 
                 call_prm.statusCode = pj.PJSIP_SC_RINGING
                 call.answer(call_prm)
@@ -48,8 +80,6 @@ class Account(pj.Account):
                 call_prm.statusCode = pj.PJSIP_SC_OK
                 call.answer(call_prm)
 
-                self.call_list.append(call)
-
             else:
                 call.hangup(call_prm)
 
@@ -63,5 +93,33 @@ class Account(pj.Account):
             logger.info(f"着信を確認")
 
 
+class Buddy(pj.Buddy):
+    """通話相手を操作
+
+    通話相手のプレゼンス状態の変化を配る。
+    """
+
+    def __init__(self, dispatcher: Dispatcher):
+        super().__init__()
+
+        # コールバックからUIスレッドへの処理の受け渡し
+        self.dispatcher = dispatcher
+
+    def onBuddyState(self):
+        """プレゼンス状態の変更を通知"""
+
+        try:
+            info = self.getInfo()
+            self.dispatcher.publish(
+                BuddyState(info.uri, info.presStatus.status, info.presStatus.statusText)
+            )
+
+        except pj.Error as message:
+            pass
+
+        else:
+            logger.info(f"通話相手: {info.uri} {info.presStatus.statusText}")
+
+
 if __name__ == "__main__":
     print(__file__)
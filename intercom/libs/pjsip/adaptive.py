@@ -0,0 +1,165 @@
+"""adaptive"""
+
+from dataclasses import dataclass, replace
+
+from .codec import OpusSettings
+
+
+@dataclass(frozen=True)
+class AdaptivePolicy:
+    """RTCP の統計から Opus の設定を選ぶ規則
+
+    パケットロスが増えたら、帯域内FEC と想定するパケットロス率を上げ、
+    ビットレートを1段下げる(混んだ Wi-Fi では、送る量を減らすことがロスを減らす)。
+    ロスの少ない状態が hold 回続いたら、ビットレートを1段上げ、FEC を戻す。
+    """
+
+    # ビットレートの段(bps): 高い順
+    bitrates: tuple[int, ...] = (32000, 24000, 16000, 12000)
+    # 想定するパケットロス率(%)の段
+    loss_steps: tuple[int, ...] = (0, 5, 10, 20, 30)
+    # これを超えたら悪化とみなすパケットロス率(%)
+    degrade_loss: float = 2.0
+    # これを下回ったら回復とみなすパケットロス率(%)
+    recover_loss: float = 0.5
+    # これを超えたら悪化とみなすジッター(ミリ秒)
+    degrade_jitter_ms: float = 40.0
+    # 回復とみなすまでに続けて必要な回数
+    hold: int = 3
+    # 判断に必要な1回あたりのパケット数(少なければ判断しない)
+    min_packets: int = 50
+
+
+class AdaptiveOpus:
+    """通話ごとの Opus の設定の適応
+
+    一定の間隔で update() に RTCP の累積値を渡す。累積値の差から、その間の
+    パケットロス率を求める。受信(相手 -> 自分)と、相手の受信報告(自分 -> 相手)の
+    悪い方を使う。設定を変える必要がある時だけ、新しい OpusSettings を返す。
+    """
+
+    def __init__(self, settings: OpusSettings, policy: AdaptivePolicy | None = None):
+        """
+        :param OpusSettings settings: 最初の Opus の設定
+        :param AdaptivePolicy policy: 適応の規則
+        """
+
+        self.policy = policy if policy is not None else AdaptivePolicy()
+        self.settings = settings
+        # 最後に計算した区間のパケットロス率(%)
+        self.loss = 0.0
+
+        self._level = self._nearest_level(settings.bitrate)
+        self._good = 0
+        self._last: tuple[int, int, int, int] | None = None
+
+    def _nearest_level(self, bitrate: int) -> int:
+        """ビットレートに最も近い段
+
+        :param int bitrate: ビットレート(bps)
+        :return int: policy.bitrates の位置
+        """
+
+        bitrates = self.policy.bitrates
+        return min(
+            range(len(bitrates)), key=lambda level: abs(bitrates[level] - bitrate)
+        )
+
+    def _loss_step(self, loss: float) -> int:
+        """パケットロス率を覆う、想定するパケットロス率の段
+
+        :param float loss: パケットロス率(%)
+        :return int: 想定するパケットロス率(%)
+        """
+
+        for step in self.policy.loss_steps:
+            if step >= loss:
+                return step
+        return self.policy.loss_steps[-1]
+
+    @staticmethod
+    def _interval_loss(packets: int, lost: int) -> float:
+        """区間のパケットロス率(%)
+
+        :param int packets: 届いたパケット数
+        :param int lost: 失われたパケット数
+        :return float: パケットロス率(%)
+        """
+
+        expected = packets + lost
+        return lost * 100.0 / expected if expected > 0 else 0.0
+
+    def update(
+        self,
+        rx_packets: int,
+        rx_lost: int,
+        tx_packets: int,
+        tx_lost: int,
+        jitter_ms: float,
+    ) -> OpusSettings | None:
+        """RTCP の統計の累積値から、Opus の設定を見直す
+
+        :param int rx_packets: 受信したパケット数(RtcpStreamStat.pkt)
+        :param int rx_lost: 受信で失われたパケット数(RtcpStreamStat.loss)
+        :param int tx_packets: 送信したパケット数
+        :param int tx_lost: 相手の受信報告で失われたパケット数
+        :param float jitter_ms: 受信のジッター(ミリ秒)
+        :return OpusSettings: 新しい設定、変えない場合は None
+        """
+
+        current = (rx_packets, rx_lost, tx_packets, tx_lost)
+        last, self._last = self._last, current
+
+        # 最初の回、あるいは re-INVITE でストリームが作り直されて累積値が戻った
+        if last is None or any(now < before for now, before in zip(current, last)):
+            return None
+
+        rx_packets, rx_lost, tx_packets, tx_lost = (
+            now - before for now, before in zip(current, last)
+        )
+        if max(rx_packets + rx_lost, tx_packets) < self.policy.min_packets:
+            return None
+
+        self.loss = max(
+            self._interval_loss(rx_packets, rx_lost),
+            self._interval_loss(tx_packets - tx_lost, tx_lost),
+        )
+
+        policy = self.policy
+        level = self._level
+        packet_loss = self.settings.packet_loss
+
+        if self.loss > policy.degrade_loss or jitter_ms > policy.degrade_jitter_ms:
+            self._good = 0
+            level = min(level + 1, len(policy.bitrates) - 1)
+            packet_loss = max(packet_loss, self._loss_step(self.loss))
+
+        elif (
+            self.loss < policy.recover_loss and jitter_ms < policy.degrade_jitter_ms / 2
+        ):
+            self._good += 1
+            if self._good >= policy.hold:
+                self._good = 0
+                level = max(level - 1, 0)
+                packet_loss = self._loss_step(self.loss)
+
+        else:
+            self._good = 0
+            packet_loss = max(packet_loss, self._loss_step(self.loss))
+
+        settings = replace(
+            self.settings,
+            bitrate=policy.bitrates[level],
+            packet_loss=packet_loss,
+            fec=packet_loss > 0,
+        )
+        if settings == self.settings:
+            return None
+
+        self._level = level
+        self.settings = settings
+        return settings
+
+
+if __name__ == "__main__":
+    print(__file__)
@@ -3,6 +3,11 @@
 import pjsua2 as pj
 
 from .error import PJError, PJLogging, logger
+from .events import CallState
+from .adaptive import AdaptiveOpus
+from .codec import apply_opus
+from .direct import MEDIA_ANCHORED, media_path
+from .uri import normalize_uri
 
 
 class Call(pj.Call):
@@ -13,11 +18,177 @@ class Call(pj.Call):
       [capture device -> conference bridge]
       [conference bridge -> playback device]
     VideoMedia は、取り扱わない。
+    通話状態の変化は、アカウントの dispatcher で配る。
+    切断(DISCONNECTED)されたら、アカウントの通話の登録簿(calls)から自身を除く。
+    アカウントに適応の規則(adaptive)があれば、adaptCodec() で Opus の設定を見直す。
+    音声(RTP)の経路は、SDP の相手のアドレスから media_path に記録する。
     """
 
     def __init__(self, account, call_id=pj.PJSUA_INVALID_ID):
         super().__init__(account, call_id)
 
+        # コールバックからUIスレッドへの処理の受け渡し
+        self.dispatcher = account.dispatcher
+        # 通話の登録簿
+        self.calls = account.calls
+        # 切断されたかどうか
+        self.ended = False
+        # Opus の設定の適応(アカウントに規則と最初の設定がある場合)
+        self.opus = account.opus
+        self.adaptive = None
+        if account.adaptive is not None and account.opus is not None:
+            self.adaptive = AdaptiveOpus(account.opus, account.adaptive)
+        # SIPサーバーの IP アドレスと、音声の経路("direct" か "anchored"、不明なら None)
+        self.servers = account.servers
+        self.media_path: str | None = None
+        # 直接の経路を求めて re-INVITE したかどうか
+        self.path_reinvited = False
+
+    def onCallState(self, prm):
+        """通話状態の変更を通知
+
+        :param OnCallStateParam prm: コールバック変数
+        """
+
+        try:
+            info = self.getInfo()
+            self.dispatcher.publish(
+                CallState(info.id, info.state, info.stateText, info.lastStatusCode)
+            )
+
+            # 登録簿が最後の参照なので、このコールバックから戻ると解放される
+            if info.state == pj.PJSIP_INV_STATE_DISCONNECTED:
+                self.calls.discard(self)
+
+        except pj.Error as message:
+            pass
+
+        else:
+            logger.info(f"通話状態: {info.stateText}")
+
+    def adaptCodec(self) -> bool:
+        """RTCP の統計から Opus の設定を見直す
+
+        UIスレッドから一定の間隔(数秒)で呼び出す。設定を変える時は、Endpoint の
+        Opus の設定を変えてから re-INVITE し、ストリームを新しい設定で作り直す。
+        Opus の設定は Endpoint 全体のものなので、適応するのは通話が1つの時だけ。
+        通話が2つ以上になったら、Endpoint を最初の設定に戻して適応をやり直す
+        (他の通話の設定を、この通話の回線の状態で変えない)。
+
+        :return bool: 設定を変えたかどうか
+        """
+
+        if self.adaptive is None or self.ended:
+            return False
+
+        if len(self.calls) > 1:
+            if self.adaptive.settings != self.opus:
+                try:
+                    apply_opus(pj.Endpoint.instance(), self.opus)
+                except pj.Error as message:
+                    return False
+                self.adaptive = AdaptiveOpus(self.opus, self.adaptive.policy)
+                logger.info("Opus: 通話が複数なので、最初の設定に戻した")
+            return False
+
+        try:
+            info = self.getStreamInfo(0)
+            if not info.codecName.lower().startswith("opus"):
+                return False
+
+            rtcp = self.getStreamStat(0).rtcp
+            settings = self.adaptive.update(
+                rtcp.rxStat.pkt,
+                rtcp.rxStat.loss,
+                rtcp.txStat.pkt,
+                rtcp.txStat.loss,
+                rtcp.rxStat.jitterUsec.last / 1000,
+            )
+            if settings is None:
+                return False
+
+            apply_opus(pj.Endpoint.instance(), settings)
+
+            prm = pj.CallOpParam(True)
+            prm.opt.audioCount = 1
+            prm.opt.videoCount = 0
+            self.reinvite(prm)
+
+        except pj.Error as message:
+            return False
+
+        logger.info(
+            f"Opus: ロス {self.adaptive.loss:.1f} % -> {settings.bitrate} bps, "
+            f"packet_loss {settings.packet_loss} %, FEC {settings.fec}"
+        )
+        return True
+
+    def checkMediaPath(self) -> bool:
+        """音声が SIPサーバーで中継されていたら、1回だけ re-INVITE する
+
+        Asterisk(direct_media = yes)は、ブリッジした後に双方へ re-INVITE して、
+        相手の RTP のアドレスを SDP で知らせる。それが行われなかった通話では、
+        こちらから re-INVITE して、SIPサーバーに経路を選び直させる。
+        UIスレッドから一定の間隔(数秒)で呼び出す。
+
+        :return bool: re-INVITE したかどうか
+        """
+
+        if self.ended or self.path_reinvited or self.media_path != MEDIA_ANCHORED:
+            return False
+
+        try:
+            if self.getInfo().state != pj.PJSIP_INV_STATE_CONFIRMED:
+                return False
+
+            prm = pj.CallOpParam(True)
+            prm.opt.audioCount = 1
+            prm.opt.videoCount = 0
+            self.reinvite(prm)
+
+        except pj.Error as message:
+            return False
+
+        self.path_reinvited = True
+        logger.info("音声が SIPサーバーで中継されている: re-INVITE")
+        return True
+
+    def sampleTelemetry(self, telemetry) -> bool:
+        """RTCP の統計から音声品質の標本を記録する
+
+        UIスレッドから一定の間隔(数秒)で呼び出す。統計の取得だけなので、通話には影響しない。
+
+        :param Telemetry telemetry: 記録先
+        :return bool: 記録したかどうか(音声のストリームが無ければ False)
+        """
+
+        if self.ended:
+            return False
+
+        try:
+            info = self.getStreamInfo(0)
+            stat = self.getStreamStat(0)
+            remote = normalize_uri(self.getInfo().remoteUri)
+
+        except pj.Error as message:
+            return False
+
+        rtcp = stat.rtcp
+        telemetry.update(
+            self.getId(),
+            remote,
+            info.codecName,
+            path=self.media_path,
+            rx_packets=rtcp.rxStat.pkt,
+            rx_lost=rtcp.rxStat.loss,
+            tx_packets=rtcp.txStat.pkt,
+            tx_lost=rtcp.txStat.loss,
+            jitter_ms=rtcp.rxStat.jitterUsec.last / 1000,
+            rtt_ms=rtcp.rttUsec.last / 1000,
+            buffer_ms=stat.jbuf.avgDelayMsec,
+        )
+        return True
+
     def onCallMediaState(self, prm):
         """通話のメディア状態の変更を通知：必ず実装
 
@@ -46,6 +217,15 @@ class Call(pj.Call):
                         audio_device_manager.getPlaybackDevMedia()
                     )
 
+                    # 音声の経路: SDP の相手が SIPサーバーなら中継されている
+                    path = media_path(
+                        self.getStreamInfo(call_media_info.index).remoteRtpAddress,
+                        self.servers,
+                    )
+                    if path != self.media_path:
+                        logger.info(f"音声の経路: {path}")
+                        self.media_path = path
+
         except pj.Error as message:
             pass
 
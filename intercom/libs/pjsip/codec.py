@@ -0,0 +1,154 @@
+"""codec"""
+
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+# 設定ファイルでのコーデックの名前 -> pjsua2 の codec id の接頭辞
+CODEC_NAMES = {
+    "opus": "opus/48000",
+    "g722": "G722/16000",
+    "pcmu": "PCMU/8000",
+    "pcma": "PCMA/8000",
+    "speex": "speex/16000",
+    "l16": "L16/16000",
+}
+
+# 優先度: 最も高い値と、無効(SDPに載せない)
+PRIORITY_MAX = 255
+PRIORITY_DISABLED = 0
+
+
+@dataclass(frozen=True)
+class OpusSettings:
+    """Opus の設定(Endpoint.setCodecOpusConfig)"""
+
+    # 目標のビットレート(bps)
+    bitrate: int = 24000
+    # 符号化の計算量(0 - 10): 小さいほどCPU使用率が低い
+    complexity: int = 5
+    # 固定ビットレートにするかどうか
+    cbr: bool = False
+    # 想定するパケットロス率(%): 符号化の冗長度(FEC)
+    packet_loss: int = 0
+    # 帯域内FEC(前のフレームを次のパケットに低ビットレートで載せる)を使うかどうか
+    fec: bool = False
+    # 標本化周波数(Hz)
+    sample_rate: int = 16000
+
+
+def parse_codecs(text: str) -> list[str]:
+    """優先度の高い順に並べたコーデックの名前を読む
+
+      "opus, g722, pcmu" -> ["opus/48000", "G722/16000", "PCMU/8000"]
+
+    :param str text: カンマ区切りの名前(CODEC_NAMES のキー、あるいは codec id)
+    :return list[str]: codec id の接頭辞
+    :raise ValueError: 知らない名前
+    """
+
+    prefixes = []
+    for name in text.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name.lower() in CODEC_NAMES:
+            prefixes.append(CODEC_NAMES[name.lower()])
+        elif "/" in name:
+            prefixes.append(name)
+        else:
+            raise ValueError(f"コーデック {name} は使えない")
+
+    return prefixes
+
+
+def codec_priorities(order: Iterable[str], codec_ids: Iterable[str]) -> dict[str, int]:
+    """コーデックごとの優先度を決める
+
+    order の順に PRIORITY_MAX から1ずつ下げ、order に無いコーデックは無効にする。
+
+    :param Iterable order: 優先度の高い順の codec id の接頭辞(parse_codecs)
+    :param Iterable codec_ids: 使えるコーデックの codec id(Endpoint.codecEnum2)
+    :return dict: codec id -> 優先度
+    """
+
+    order = [prefix.lower() for prefix in order]
+    priorities = {}
+    for codec_id in codec_ids:
+        priority = PRIORITY_DISABLED
+        for rank, prefix in enumerate(order):
+            if codec_id.lower().startswith(prefix):
+                priority = PRIORITY_MAX - rank
+                break
+        priorities[codec_id] = priority
+
+    return priorities
+
+
+def apply_codecs(
+    endpoint: Any, order: Iterable[str], opus: OpusSettings | None = None
+) -> list[str]:
+    """コーデックの優先度と Opus の設定を Endpoint に反映する
+
+    libInit() の後に呼び出す。pjsua2 の例外(pj.Error)はそのまま送出する。
+
+    :param Endpoint endpoint: pjsua2 の Endpoint
+    :param Iterable order: 優先度の高い順の codec id の接頭辞(parse_codecs)
+    :param OpusSettings opus: Opus の設定(省略時は変えない)
+    :return list[str]: 有効にしたコーデックの codec id(優先度の高い順)
+    """
+
+    codec_ids = [info.codecId for info in endpoint.codecEnum2()]
+    priorities = codec_priorities(order, codec_ids)
+    for codec_id, priority in priorities.items():
+        endpoint.codecSetPriority(codec_id, priority)
+
+    enabled = sorted(
+        (codec_id for codec_id, priority in priorities.items() if priority),
+        key=lambda codec_id: -priorities[codec_id],
+    )
+
+    for codec_id in enabled:
+        if not codec_id.startswith("opus/"):
+            continue
+
+        # Opus は無音の間もパケットを送り続ける(DTXで止めると、相手側の音量の
+        # 立ち上がりが遅れる)。他のコーデックの VAD は pjmedia の既定のまま
+        param = endpoint.codecGetParam(codec_id)
+        param.setting.vad = False
+        endpoint.codecSetParam(codec_id, param)
+
+        if opus is not None:
+            apply_opus(endpoint, opus, codec_id)
+
+    return enabled
+
+
+def apply_opus(
+    endpoint: Any, opus: OpusSettings, codec_id: str = "opus/48000/2"
+) -> None:
+    """Opus の設定を Endpoint に反映する
+
+    これから開始するストリームの符号化と、SDPの fmtp(maxaveragebitrate, useinbandfec, cbr)
+    に反映される。通話中のストリームに反映するには、re-INVITE する。
+    pjmedia の Opus では、帯域内FEC は codec param の setting.plc で指定する。
+
+    :param Endpoint endpoint: pjsua2 の Endpoint
+    :param OpusSettings opus: Opus の設定
+    :param str codec_id: Opus の codec id
+    """
+
+    param = endpoint.codecGetParam(codec_id)
+    param.setting.plc = opus.fec
+    endpoint.codecSetParam(codec_id, param)
+
+    config = endpoint.getCodecOpusConfig()
+    config.sample_rate = opus.sample_rate
+    config.bit_rate = opus.bitrate
+    config.complexity = opus.complexity
+    config.cbr = opus.cbr
+    config.packet_loss = opus.packet_loss
+    endpoint.setCodecOpusConfig(config)
+
+
+if __name__ == "__main__":
+    print(__file__)
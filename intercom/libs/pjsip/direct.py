@@ -0,0 +1,181 @@
+"""direct
+
+SIPサーバー(Asterisk)を経由しない、部屋への直接の発信と音声(RTP)の経路。
+
+部屋ごとに "sip:user@ip:port" の直接の URI を持ち、発信はまず直接の URI へ送る。
+相手が一定の時間内に応答(180 Ringing など)しないか、届かない応答で終わったら、
+SIPサーバーの URI で発信し直す(fallback)。
+
+SIPサーバーを経由した通話でも、Asterisk が direct_media で相手の RTP のアドレスを
+SDP に載せれば、音声は部屋どうしで直接流れる。SDP の相手が SIPサーバーのアドレスなら、
+音声は SIPサーバーで中継されている(anchored)。
+
+pjsua2 に依存しない。時刻は呼び出し側が time.monotonic() で渡す。
+"""
+
+import socket
+from typing import Iterable
+
+from .events import CallState
+from .uri import normalize_uri
+
+# pjsip_inv_state: EARLY(180 など)以降なら、相手に届いている
+PJSIP_INV_STATE_EARLY = 3
+
+# 相手に届かなかったとみなす SIP の応答コード
+#   0: 応答が無い(トランスポートのエラー)
+#   408: Request Timeout, 480: Temporarily Unavailable, 487: 時間切れで取り消した
+#   5xx: 相手の障害(503 は pjsip がトランスポートのエラーにも使う)
+FALLBACK_CODES = frozenset({0, 408, 480, 487, 500, 502, 503, 504})
+
+# 音声(RTP)の経路
+MEDIA_DIRECT = "direct"
+MEDIA_ANCHORED = "anchored"
+
+
+def resolve_hosts(uri: str) -> frozenset[str]:
+    """SIP URI のホストの IP アドレス
+
+    名前解決できなければ、ホストの文字列だけを返す。
+
+    :param str uri: "sip:sipserver" や "sip:name@sipserver:5060"
+    :return frozenset[str]: IP アドレス
+    """
+
+    host = normalize_uri(uri).partition(":")[2].rpartition("@")[2].strip("[]")
+    if not host:
+        return frozenset()
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        addresses = set()
+    return frozenset(addresses | {host})
+
+
+def media_path(remote_rtp: str, servers: Iterable[str]) -> str:
+    """相手の RTP のアドレスから、音声の経路を判定する
+
+    :param str remote_rtp: StreamInfo.remoteRtpAddress "ip:port" や "[ipv6]:port"
+    :param Iterable servers: SIPサーバーの IP アドレス(resolve_hosts)
+    :return str: MEDIA_ANCHORED(SIPサーバーで中継) か MEDIA_DIRECT
+    """
+
+    if remote_rtp.startswith("["):
+        host = remote_rtp[1 : remote_rtp.find("]")]
+    else:
+        host = remote_rtp.rsplit(":", 1)[0]
+
+    return MEDIA_ANCHORED if host.lower() in servers else MEDIA_DIRECT
+
+
+class DirectDial:
+    """直接の発信と、SIPサーバーを経由した発信への切り替え
+
+    UIスレッドから使う。発信した直接の通話は call id で覚えておき、
+    通話状態の変化(CallState)を update() に渡すと、発信し直す URI を返す。
+    """
+
+    def __init__(
+        self, routes: dict[str, str], fallback: bool = True, timeout: float = 2.0
+    ):
+        """
+        :param dict routes: 部屋の URI -> 直接の URI "sip:user@ip:port"
+        :param bool fallback: 届かなければ SIPサーバーを経由して発信し直すかどうか
+        :param float timeout: 直接の発信の応答を待つ時間(秒)
+        """
+
+        self.routes = {normalize_uri(uri): direct for uri, direct in routes.items()}
+        self.fallback = fallback
+        self.timeout = timeout
+
+        # 応答を待っている直接の通話: call id -> (部屋の URI, 期限)
+        self._pending: dict[int, tuple[str, float]] = {}
+        # 期限を過ぎて取り消した直接の通話の call id
+        self._expired: set[int] = set()
+
+        # 直接の発信と、SIPサーバーへの切り替えの回数
+        self.direct_calls = 0
+        self.fallbacks = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def target(self, uri: str) -> str:
+        """発信先: 直接の URI があればそれ、無ければ部屋の URI のまま
+
+        :param str uri: 部屋の URI
+        :return str: 発信先の URI
+        """
+
+        return self.routes.get(normalize_uri(uri), uri)
+
+    def targets(self, uris: Iterable[str]) -> list[str]:
+        """複数の部屋の発信先(一斉呼出)
+
+        :param Iterable uris: 部屋の URI
+        :return list[str]: 発信先の URI
+        """
+
+        return [self.target(uri) for uri in uris]
+
+    def started(self, call_id: int, uri: str, now: float) -> None:
+        """直接の通話を発信した
+
+        :param int call_id: call id
+        :param str uri: 部屋の URI(fallback の発信先)
+        :param float now: time.monotonic()
+        """
+
+        self.direct_calls += 1
+        self._pending[call_id] = (uri, now + self.timeout)
+
+    def expired(self, now: float) -> list[int]:
+        """応答を待つ時間を過ぎた直接の通話(呼び出し側が切断する)
+
+        :param float now: time.monotonic()
+        :return list[int]: call id
+        """
+
+        call_ids = [
+            call_id
+            for call_id, (_, deadline) in self._pending.items()
+            if deadline <= now and call_id not in self._expired
+        ]
+        self._expired.update(call_ids)
+        return call_ids
+
+    def update(self, event: CallState) -> str | None:
+        """通話状態の変化から、SIPサーバーを経由して発信し直すかどうかを決める
+
+        :param CallState event: 通話状態の変化
+        :return str: 発信し直す部屋の URI、発信し直さなければ None
+        """
+
+        pending = self._pending.get(event.call_id)
+        if pending is None:
+            return None
+
+        if not event.disconnected:
+            # 相手に届いた: 以後は通常の通話
+            if event.state >= PJSIP_INV_STATE_EARLY:
+                del self._pending[event.call_id]
+                self._expired.discard(event.call_id)
+            return None
+
+        del self._pending[event.call_id]
+        expired = event.call_id in self._expired
+        self._expired.discard(event.call_id)
+
+        if not self.fallback:
+            return None
+        if not expired and event.code not in FALLBACK_CODES:
+            # 相手が話し中(486)や拒否(603)など: 届いているので発信し直さない
+            return None
+
+        self.fallbacks += 1
+        return pending[0]
+
+
+if __name__ == "__main__":
+    print(__file__)
@@ -0,0 +1,105 @@
+"""dispatcher"""
+
+import logging as LPJ
+import queue
+import time
+from typing import Any, Callable
+
+# pjsua2 を読み込まないので、error.logger は使わない
+logger = LPJ.getLogger(__name__)
+
+
+class Dispatcher:
+    """pjsua2のスレッドからUIスレッドへの処理の受け渡し
+
+    pjsua2のcallback関数(イベント処理のスレッド)で post() し、
+    UIスレッドで drain() して実行する。
+    キューは queue.SimpleQueue で、post() はロックを待たずに戻る。
+    UIスレッドは drain() でキューにある分だけを実行し、待たない。
+
+    状態の変化(RegState, CallState, BuddyState など)は publish() で配る。
+    subscribe() で登録した関数が、イベントの型ごとに UIスレッドで呼び出される。
+    """
+
+    def __init__(self):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._handlers: dict[type, list[Callable]] = {}
+
+        # 受け渡しの遅延(post() から実行まで)
+        self.count = 0
+        self.max_latency_ns = 0
+
+    def post(self, func: Callable, *args: Any) -> None:
+        """UIスレッドで実行する処理を登録する
+
+        どのスレッドから呼び出してもよい。
+
+        :param Callable func: UIスレッドで実行する関数
+        :param Any args: 関数の引数
+        """
+
+        self._queue.put((time.perf_counter_ns(), func, args))
+
+    def subscribe(self, event_type: type, handler: Callable) -> None:
+        """イベントを受け取る関数を登録する
+
+        UIスレッドで呼び出すこと。
+
+        :param type event_type: イベントの型(RegState など)
+        :param Callable handler: イベントを受け取る関数
+        """
+
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def publish(self, event: Any) -> None:
+        """イベントを UIスレッドで配る
+
+        どのスレッドから呼び出してもよい。
+
+        :param Any event: イベント(RegState など)
+        """
+
+        self.post(self._deliver, event)
+
+    def _deliver(self, event: Any) -> None:
+        """UIスレッド: 登録された関数にイベントを渡す
+
+        :param Any event: イベント
+        """
+
+        for handler in self._handlers.get(type(event), ()):
+            handler(event)
+
+    def drain(self, limit: int = 100) -> int:
+        """登録された処理を、登録順に実行する
+
+        UIスレッドで、フレームごとに呼び出す。
+
+        :param int limit: 1回で実行する処理の上限
+        :return int: 実行した処理の数
+        """
+
+        count = 0
+        while count < limit:
+            try:
+                posted, func, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            latency = time.perf_counter_ns() - posted
+            if latency > self.max_latency_ns:
+                self.max_latency_ns = latency
+
+            try:
+                func(*args)
+            except Exception as message:
+                logger.error(f"Dispatcher - drain: {message}")
+
+            count += 1
+
+        self.count += count
+        return count
+
+
+if __name__ == "__main__":
+    print(__file__)
@@ -0,0 +1,90 @@
+"""events"""
+
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class RegState:
+    """アカウントの登録状態の変化
+
+    Account.onRegState で作り、Dispatcher で UIスレッドへ配る。
+    """
+
+    # 登録が有効かどうか
+    active: bool
+    # SIPの応答コード
+    code: int
+    # SIPの応答の理由
+    reason: str
+
+
+@dataclass(frozen=True)
+class CallState:
+    """通話状態の変化
+
+    Call.onCallState で作り、Dispatcher で UIスレッドへ配る。
+    """
+
+    # 通話のID
+    call_id: int
+    # pjsip_inv_state
+    state: int
+    # 状態の文字列(CallInfo.stateText)
+    text: str
+    # 最後のSIPの応答コード
+    code: int
+
+    @property
+    def confirmed(self) -> bool:
+        """通話中かどうか
+
+        :return bool: 通話中ならTrue
+        """
+
+        return self.state == 5  # PJSIP_INV_STATE_CONFIRMED
+
+    @property
+    def disconnected(self) -> bool:
+        """切断されたかどうか
+
+        :return bool: 切断されたならTrue
+        """
+
+        return self.state == 6  # PJSIP_INV_STATE_DISCONNECTED
+
+
+@dataclass(frozen=True)
+class BuddyState:
+    """通話相手のプレゼンス状態の変化
+
+    Buddy.onBuddyState で作り、Dispatcher で UIスレッドへ配る。
+    """
+
+    # 通話相手のURI
+    uri: str
+    # pjsua_buddy_status
+    status: int
+    # 状態の文字列(PresenceStatus.statusText)
+    text: str
+
+    @property
+    def online(self) -> bool:
+        """在席かどうか
+
+        :return bool: 在席ならTrue
+        """
+
+        return self.status == 1  # PJSUA_BUDDY_STATUS_ONLINE
+
+    @property
+    def offline(self) -> bool:
+        """不在かどうか(不明の場合は False)
+
+        :return bool: 不在ならTrue
+        """
+
+        return self.status == 2  # PJSUA_BUDDY_STATUS_OFFLINE
+
+
+if __name__ == "__main__":
+    print(__file__)
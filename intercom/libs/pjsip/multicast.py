@@ -0,0 +1,249 @@
+"""multicast"""
+
+import pjsua2 as pj
+
+from .error import PJError, logger
+from .rtp import (
+    CLOCK_RATE,
+    DEFAULT_GROUP,
+    DEFAULT_PORT,
+    SAMPLES_PER_PACKET,
+    RtpReceiver,
+    RtpSender,
+)
+
+
+def _audio_format() -> pj.MediaFormatAudio:
+    """会議ブリッジのポートの形式: 8kHz, モノラル, 16ビット, 20ミリ秒
+
+    :return MediaFormatAudio: 形式
+    """
+
+    fmt = pj.MediaFormatAudio()
+    fmt.type = pj.PJMEDIA_TYPE_AUDIO
+    fmt.clockRate = CLOCK_RATE
+    fmt.channelCount = 1
+    fmt.bitsPerSample = 16
+    fmt.frameTimeUsec = SAMPLES_PER_PACKET * 1000000 // CLOCK_RATE
+    return fmt
+
+
+class _CapturePort(pj.AudioMediaPort):
+    """会議ブリッジから受け取った音声を、RTPマルチキャストで送るポート
+
+    onFrameReceived は会議ブリッジのクロック(サウンドデバイス)のスレッドで呼び出される。
+    """
+
+    def __init__(self, sender: RtpSender):
+        super().__init__()
+        self.sender = sender
+
+    def onFrameReceived(self, frame):
+        """callback: 会議ブリッジからの20ミリ秒の音声
+
+        :param MediaFrame frame: 音声
+        """
+
+        if frame.type == pj.PJMEDIA_FRAME_TYPE_AUDIO and frame.size:
+            self.sender.send(bytes(frame.buf))
+
+
+class _PlaybackPort(pj.AudioMediaPort):
+    """RTPマルチキャストで受け取った音声を、会議ブリッジへ渡すポート
+
+    onFrameRequested は会議ブリッジのクロック(サウンドデバイス)のスレッドで呼び出される。
+    受信が間に合わない時は、無音(フレーム無し)を返す。
+    """
+
+    def __init__(self, receiver: RtpReceiver):
+        super().__init__()
+        self.receiver = receiver
+
+    def onFrameRequested(self, frame):
+        """callback: 会議ブリッジへの20ミリ秒の音声
+
+        :param MediaFrame frame: 音声を書き込むフレーム
+        """
+
+        pcm = self.receiver.read()
+        if pcm is None:
+            frame.type = pj.PJMEDIA_FRAME_TYPE_NONE
+            frame.size = 0
+            return
+
+        frame.type = pj.PJMEDIA_FRAME_TYPE_AUDIO
+        frame.buf = pj.ByteVector(pcm)
+        frame.size = len(pcm)
+
+
+class MulticastPage:
+    """RTPマルチキャストによる一斉放送(送信側)
+
+    マイク(capture device)の音声を、会議ブリッジのポートから1つのRTPストリームにして
+    マルチキャストアドレスへ送る。SIPの通話は使わないので、受信する部屋がいくつあっても
+    送信の帯域とCPU使用率は変わらない(GroupPage は部屋ごとに通話とRTPストリームを作る)。
+      [capture device -> conference bridge -> _CapturePort -> RtpSender]
+    """
+
+    def __init__(
+        self,
+        group: str = DEFAULT_GROUP,
+        port: int = DEFAULT_PORT,
+        ttl: int = 1,
+        loop: bool = False,
+        interface: str = "0.0.0.0",
+    ):
+        """
+        :param str group: マルチキャストアドレス
+        :param int port: ポート
+        :param int ttl: 超えてよいルーターの数
+        :param bool loop: 同じホストの受信にも届けるかどうか(試験用)
+        :param str interface: 送信するインターフェースのアドレス
+        """
+
+        self.group = group
+        self.port = port
+        self.ttl = ttl
+        self.loop = loop
+        self.interface = interface
+
+        self.sender: RtpSender | None = None
+        self._media_port: _CapturePort | None = None
+
+    @property
+    def active(self) -> bool:
+        """放送中かどうか
+
+        :return bool: 放送中ならTrue
+        """
+
+        return self.sender is not None
+
+    def start(self) -> None:
+        """放送を開始する"""
+
+        if self.active:
+            return
+
+        self.sender = RtpSender(
+            self.group, self.port, self.ttl, self.loop, self.interface
+        )
+        try:
+            self._media_port = _CapturePort(self.sender)
+            self._media_port.createPort("multicast-page", _audio_format())
+            capture = pj.Endpoint.instance().audDevManager().getCaptureDevMedia()
+            capture.startTransmit(self._media_port)
+
+        except pj.Error as message:
+            self.sender.close()
+            self.sender = None
+            self._media_port = None
+            raise PJError(f"一斉放送を開始できない: {message.info()}")
+
+        logger.info(f"一斉放送: {self.group}:{self.port} へ送信")
+
+    def stop(self) -> None:
+        """放送を終える"""
+
+        if not self.active:
+            return
+
+        try:
+            capture = pj.Endpoint.instance().audDevManager().getCaptureDevMedia()
+            capture.stopTransmit(self._media_port)
+        except pj.Error as message:
+            pass
+
+        # ポートを破棄すると、会議ブリッジから外される
+        self._media_port = None
+        logger.info(f"一斉放送: {self.sender.packets} パケット送信")
+        self.sender.close()
+        self.sender = None
+
+
+class MulticastListener:
+    """RTPマルチキャストによる一斉放送(受信側)
+
+    マルチキャストアドレスに参加し、受け取った音声をスピーカー(playback device)で鳴らす。
+    放送が無い間は、会議ブリッジに無音を渡すだけ。
+      [RtpReceiver -> _PlaybackPort -> conference bridge -> playback device]
+    """
+
+    def __init__(
+        self,
+        group: str = DEFAULT_GROUP,
+        port: int = DEFAULT_PORT,
+        interface: str = "0.0.0.0",
+        depth: int = 5,
+    ):
+        """
+        :param str group: マルチキャストアドレス
+        :param int port: ポート
+        :param str interface: 受信するインターフェースのアドレス
+        :param int depth: 再生を待つパケットの上限(20ミリ秒単位)
+        """
+
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.depth = depth
+
+        self.receiver: RtpReceiver | None = None
+        self._media_port: _PlaybackPort | None = None
+
+    @property
+    def receiving(self) -> bool:
+        """放送を受信しているかどうか
+
+        :return bool: 受信していればTrue
+        """
+
+        return self.receiver is not None and self.receiver.active
+
+    def start(self) -> None:
+        """受信を開始する"""
+
+        if self.receiver is not None:
+            return
+
+        try:
+            self.receiver = RtpReceiver(
+                self.group, self.port, self.interface, self.depth
+            )
+        except OSError as message:
+            raise PJError(f"一斉放送に参加できない: {message}")
+
+        try:
+            self._media_port = _PlaybackPort(self.receiver)
+            self._media_port.createPort("multicast-listener", _audio_format())
+            playback = pj.Endpoint.instance().audDevManager().getPlaybackDevMedia()
+            self._media_port.startTransmit(playback)
+
+        except pj.Error as message:
+            self.receiver.close()
+            self.receiver = None
+            self._media_port = None
+            raise PJError(f"一斉放送を再生できない: {message.info()}")
+
+        self.receiver.start()
+        logger.info(f"一斉放送: {self.group}:{self.port} を受信")
+
+    def stop(self) -> None:
+        """受信を終える"""
+
+        if self.receiver is None:
+            return
+
+        try:
+            playback = pj.Endpoint.instance().audDevManager().getPlaybackDevMedia()
+            self._media_port.stopTransmit(playback)
+        except pj.Error as message:
+            pass
+
+        self._media_port = None
+        self.receiver.close()
+        self.receiver = None
+
+
+if __name__ == "__main__":
+    print(__file__)
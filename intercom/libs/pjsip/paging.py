@@ -0,0 +1,82 @@
+"""paging"""
+
+from typing import Iterable
+
+import pjsua2 as pj
+
+from .error import logger
+from .call import Call as CALL
+
+
+class GroupPage:
+    """一斉呼出
+
+    複数の部屋に同時に発信する。各通話の音声は Call.onCallMediaState で
+    会議ブリッジ(conference bridge)に接続されるので、マイクの音声はすべての部屋へ送られ、
+    すべての部屋の音声はミックスされてスピーカーから出る。
+    通話は Account の登録簿(calls)で保持し、ここでは call id だけを覚えておく。
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.call_ids: list[int] = []
+
+    @property
+    def active(self) -> int:
+        """切断されていない通話の数
+
+        :return int: 通話の数
+        """
+
+        return sum(1 for call_id in self.call_ids if call_id in self.account.calls)
+
+    def start(self, uris: Iterable[str]) -> int:
+        """すべての部屋に発信する
+
+        発信できなかった部屋は飛ばす。
+
+        :param Iterable uris: 部屋(通話相手)の URI
+        :return int: この呼出で発信した通話の数
+        """
+
+        prm = pj.CallOpParam(True)
+        prm.opt.audioCount = 1
+        prm.opt.videoCount = 0
+
+        started = 0
+        for uri in uris:
+            try:
+                call = CALL(self.account)
+                call.makeCall(uri, prm)
+
+            except pj.Error as message:
+                logger.warning(f"一斉呼出: {uri} に発信できない")
+                continue
+
+            # 切断されたら、Call.onCallState で登録簿から除かれる
+            if self.account.calls.add(call):
+                self.call_ids.append(call.getId())
+                started += 1
+
+        logger.info(f"一斉呼出: {started} 部屋に発信")
+        return started
+
+    def hangup(self) -> None:
+        """一斉呼出のすべての通話を切断する"""
+
+        prm = pj.CallOpParam()
+        for call_id in self.call_ids:
+            call = self.account.calls.get(call_id)
+            if call is None:
+                continue
+
+            try:
+                call.hangup(prm)
+            except pj.Error as message:
+                pass
+
+        self.call_ids.clear()
+
+
+if __name__ == "__main__":
+    print(__file__)
@@ -0,0 +1,129 @@
+"""profile"""
+
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass(frozen=True)
+class AudioProfile:
+    """口から耳までの遅延に関わる設定の組
+
+    ジッターバッファとサウンドデバイスのバッファは、小さいほど遅延は短いが、
+    Wi-Fi の揺らぎや CPU の負荷で音が途切れやすくなる。
+    時間はすべてミリ秒。
+    """
+
+    # RTPパケットの音声の長さ(MediaConfig.ptime)
+    ptime: int
+    # 会議ブリッジの1フレームの長さ(MediaConfig.audioFramePtime)
+    frame_ptime: int
+    # ジッターバッファの最初の溜め(MediaConfig.jbInit)
+    jb_init: int
+    # ジッターバッファの溜めの最小と最大(MediaConfig.jbMinPre, jbMaxPre)
+    jb_min_pre: int
+    jb_max_pre: int
+    # ジッターバッファの最大(MediaConfig.jbMax)
+    jb_max: int
+    # サウンドデバイスの録音と再生のバッファ(MediaConfig.sndRecLatency, sndPlayLatency)
+    snd_rec_latency: int
+    snd_play_latency: int
+
+    @property
+    def nominal_ms(self) -> int:
+        """設定から見積もった一方向の遅延(ネットワークの遅延は含まない)
+
+        録音のバッファ + パケット化 + ジッターバッファの最初の溜め + 再生のバッファ
+
+        :return int: 遅延(ミリ秒)
+        """
+
+        return self.snd_rec_latency + self.ptime + self.jb_init + self.snd_play_latency
+
+
+PROFILES = {
+    # 有線LANや空いた Wi-Fi 向け: 10ミリ秒のパケットと、浅いバッファ
+    "lowlatency": AudioProfile(
+        ptime=10,
+        frame_ptime=10,
+        jb_init=20,
+        jb_min_pre=10,
+        jb_max_pre=60,
+        jb_max=200,
+        snd_rec_latency=20,
+        snd_play_latency=40,
+    ),
+    # 家庭の Wi-Fi 向け(既定)
+    "balanced": AudioProfile(
+        ptime=20,
+        frame_ptime=20,
+        jb_init=40,
+        jb_min_pre=20,
+        jb_max_pre=120,
+        jb_max=360,
+        snd_rec_latency=60,
+        snd_play_latency=80,
+    ),
+    # 混んだ Wi-Fi や負荷の高い Raspberry Pi 向け: pjsua2 の既定に近い深いバッファ
+    "robust": AudioProfile(
+        ptime=20,
+        frame_ptime=20,
+        jb_init=80,
+        jb_min_pre=40,
+        jb_max_pre=300,
+        jb_max=1000,
+        snd_rec_latency=100,
+        snd_play_latency=140,
+    ),
+}
+
+
+def get_profile(name: str) -> AudioProfile:
+    """名前からプロファイルを得る
+
+    :param str name: "lowlatency", "balanced", "robust"
+    :return AudioProfile: プロファイル
+    :raise ValueError: 知らない名前
+    """
+
+    try:
+        return PROFILES[name.strip().lower()]
+    except KeyError:
+        raise ValueError(f"音声のプロファイル {name} は無い: {', '.join(PROFILES)}")
+
+
+def apply_media_config(media_config: Any, profile: AudioProfile) -> None:
+    """プロファイルを MediaConfig に反映する
+
+    libInit() の前に EpConfig.medConfig に対して呼び出す。
+
+    :param MediaConfig media_config: pjsua2 の MediaConfig
+    :param AudioProfile profile: プロファイル
+    """
+
+    media_config.ptime = profile.ptime
+    media_config.audioFramePtime = profile.frame_ptime
+    media_config.jbInit = profile.jb_init
+    media_config.jbMinPre = profile.jb_min_pre
+    media_config.jbMaxPre = profile.jb_max_pre
+    media_config.jbMax = profile.jb_max
+    media_config.sndRecLatency = profile.snd_rec_latency
+    media_config.sndPlayLatency = profile.snd_play_latency
+
+
+def apply_device_latency(audio_device_manager: Any, profile: AudioProfile) -> None:
+    """プロファイルをサウンドデバイスに反映する
+
+    libInit() の後、開いているサウンドデバイスに対して呼び出す。
+    デバイスが対応していなければ、pjsua2 の例外(pj.Error)を送出する。
+
+    :param AudDevManager audio_device_manager: pjsua2 の AudDevManager
+    :param AudioProfile profile: プロファイル
+    """
+
+    # keep=True: 次に開くサウンドデバイスにも使う
+    audio_device_manager.setInputLatency(profile.snd_rec_latency, True)
+    audio_device_manager.setOutputLatency(profile.snd_play_latency, True)
+
+
+if __name__ == "__main__":
+    print(__file__)
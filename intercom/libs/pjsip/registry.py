@@ -0,0 +1,88 @@
+"""registry"""
+
+import logging as LPJ
+import threading
+from typing import Any, Iterator
+
+# pjsua2 を読み込まないので、error.logger は使わない
+logger = LPJ.getLogger(__name__)
+logger.setLevel(LPJ.INFO)
+
+
+class CallRegistry:
+    """通話の登録簿
+
+    通話(Call インスタンス)を call id をキーにして保持する。
+    通話が切断(DISCONNECTED)されたら、Call.onCallState から discard() され、
+    登録簿が最後の参照なので、Call インスタンスとpjsua2の資源は解放される。
+
+    コールバック(イベント処理のスレッド)とUIスレッドの両方から操作するので、
+    変更はロックの中で行う。参照(get, current)はロックを待たない。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._calls.values()))
+
+    def __contains__(self, call_id: int) -> bool:
+        return call_id in self._calls
+
+    @property
+    def current(self) -> Any:
+        """最も新しい通話(通話中あるいは呼び出し中)
+
+        :return Call: 通話、無ければ None
+        """
+
+        return next(reversed(self._calls.values()), None)
+
+    def get(self, call_id: int) -> Any:
+        """call id から通話を得る
+
+        :param int call_id: call id
+        :return Call: 通話、無ければ None
+        """
+
+        return self._calls.get(call_id)
+
+    def add(self, call: Any) -> bool:
+        """通話を登録する
+
+        makeCall() の完了より先に切断されていた場合は、登録しない。
+
+        :param Call call: 通話(makeCall() あるいは着信で call id が決まっていること)
+        :return bool: 登録したかどうか
+        """
+
+        with self._lock:
+            if call.ended:
+                return False
+            self._calls[call.getId()] = call
+
+        return True
+
+    def discard(self, call: Any) -> None:
+        """切断された通話を登録簿から除く
+
+        Call.onCallState から、DISCONNECTED の時に呼び出される。
+
+        :param Call call: 切断された通話
+        """
+
+        with self._lock:
+            call.ended = True
+            call_id = call.getId()
+            if self._calls.get(call_id) is call:
+                del self._calls[call_id]
+
+        logger.info(f"通話 {call_id} を登録簿から除いた (残り {len(self._calls)})")
+
+
+if __name__ == "__main__":
+    print(__file__)
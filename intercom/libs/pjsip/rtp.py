@@ -0,0 +1,382 @@
+"""rtp
+
+RTP(RFC 3550)のマルチキャストによる一斉放送
+
+pjsua2 に依存しない部分: G.711 μ-law の変換、RTPパケットの組み立てと解析、
+UDPマルチキャストの送信と受信。
+"""
+
+import logging as LPJ
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+# pjsua2 を読み込まないので、error.logger は使わない
+logger = LPJ.getLogger(__name__)
+
+# G.711 μ-law (RFC 3551 の静的ペイロードタイプ 0)
+PT_PCMU = 0
+CLOCK_RATE = 8000
+# 1パケットのサンプル数(20ミリ秒)
+SAMPLES_PER_PACKET = 160
+
+RTP_VERSION = 2
+_HEADER = struct.Struct("!BBHII")
+
+# 管理スコープ(RFC 2365)のマルチキャストアドレス: 構内のネットワークだけに届く
+DEFAULT_GROUP = "239.255.0.1"
+DEFAULT_PORT = 5004
+
+_ULAW_BIAS = 0x84
+_ULAW_CLIP = 32635
+
+
+def _ulaw_from_linear(sample: int) -> int:
+    """16ビットのサンプルを μ-law の1バイトにする
+
+    :param int sample: -32768 - 32767
+    :return int: μ-law
+    """
+
+    sign = 0x80 if sample < 0 else 0
+    magnitude = min(-sample if sign else sample, _ULAW_CLIP) + _ULAW_BIAS
+    exponent = max(magnitude.bit_length() - 8, 0)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+
+def _linear_from_ulaw(code: int) -> int:
+    """μ-law の1バイトを16ビットのサンプルにする
+
+    :param int code: μ-law
+    :return int: -32124 - 32124
+    """
+
+    code = ~code & 0xFF
+    exponent = (code >> 4) & 0x07
+    magnitude = ((((code & 0x0F) << 3) + _ULAW_BIAS) << exponent) - _ULAW_BIAS
+    return -magnitude if code & 0x80 else magnitude
+
+
+# 変換表: サンプルごとの計算をせず、表を引くだけにする
+# 符号化は符号なし16ビットの値で引く(負の値は 65536 を足した位置)
+_ULAW_ENCODE = bytes(
+    _ulaw_from_linear(value - 0x10000 if value & 0x8000 else value)
+    for value in range(0x10000)
+)
+_ULAW_DECODE = tuple(
+    _linear_from_ulaw(code).to_bytes(2, sys.byteorder, signed=True)
+    for code in range(0x100)
+)
+
+
+def ulaw_encode(pcm: bytes) -> bytes:
+    """16ビットのPCM(ネイティブのバイト順)を μ-law にする
+
+    :param bytes pcm: 16ビットのPCM
+    :return bytes: μ-law(サンプル数と同じバイト数)
+    """
+
+    return bytes(map(_ULAW_ENCODE.__getitem__, memoryview(pcm).cast("B").cast("H")))
+
+
+def ulaw_decode(payload: bytes) -> bytes:
+    """μ-law を16ビットのPCM(ネイティブのバイト順)にする
+
+    :param bytes payload: μ-law
+    :return bytes: 16ビットのPCM
+    """
+
+    return b"".join(map(_ULAW_DECODE.__getitem__, payload))
+
+
+@dataclass(frozen=True)
+class RtpPacket:
+    """RTPパケット"""
+
+    # ペイロードタイプ
+    payload_type: int
+    # シーケンス番号(16ビット)
+    sequence: int
+    # タイムスタンプ(32ビット、サンプル単位)
+    timestamp: int
+    # 送信元の識別子
+    ssrc: int
+    # マーカービット(放送の始まり)
+    marker: bool
+    # ペイロード
+    payload: bytes
+
+    def pack(self) -> bytes:
+        """パケットをバイト列にする(CSRC、拡張ヘッダ、パディングは無し)
+
+        :return bytes: RTPパケット
+        """
+
+        return (
+            _HEADER.pack(
+                RTP_VERSION << 6,
+                (0x80 if self.marker else 0) | self.payload_type,
+                self.sequence,
+                self.timestamp,
+                self.ssrc,
+            )
+            + self.payload
+        )
+
+    @classmethod
+    def parse(cls, data: bytes) -> "RtpPacket":
+        """バイト列からパケットを得る
+
+        :param bytes data: 受信したUDPのデータ
+        :return RtpPacket: RTPパケット
+        :raise ValueError: RTPパケットではない
+        """
+
+        if len(data) < _HEADER.size:
+            raise ValueError("RTPヘッダより短い")
+
+        first, second, sequence, timestamp, ssrc = _HEADER.unpack_from(data)
+        if first >> 6 != RTP_VERSION:
+            raise ValueError(f"RTPのバージョンが違う: {first >> 6}")
+
+        start = _HEADER.size + (first & 0x0F) * 4
+        if first & 0x10:
+            # 拡張ヘッダ: 識別子(16ビット)と長さ(32ビット単位)
+            if len(data) < start + 4:
+                raise ValueError("拡張ヘッダが途切れている")
+            start += 4 + struct.unpack_from("!H", data, start + 2)[0] * 4
+
+        end = len(data)
+        if first & 0x20:
+            end -= data[-1]
+
+        if start > end:
+            raise ValueError("ペイロードの長さが合わない")
+
+        return cls(
+            payload_type=second & 0x7F,
+            sequence=sequence,
+            timestamp=timestamp,
+            ssrc=ssrc,
+            marker=bool(second & 0x80),
+            payload=bytes(data[start:end]),
+        )
+
+
+class RtpSender:
+    """RTPマルチキャストの送信
+
+    1つのストリームをマルチキャストアドレスに送るだけなので、
+    受信する部屋がいくつあっても、送信の帯域とCPU使用率は変わらない。
+    """
+
+    def __init__(
+        self,
+        group: str = DEFAULT_GROUP,
+        port: int = DEFAULT_PORT,
+        ttl: int = 1,
+        loop: bool = False,
+        interface: str = "0.0.0.0",
+    ):
+        """
+        :param str group: マルチキャストアドレス
+        :param int port: ポート
+        :param int ttl: 超えてよいルーターの数(1: 同じネットワークだけ)
+        :param bool loop: 同じホストの受信にも届けるかどうか(試験用)
+        :param str interface: 送信するインターフェースのアドレス
+        """
+
+        self.address = (group, port)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loop))
+        if interface != "0.0.0.0":
+            self.sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface)
+            )
+
+        self.ssrc = int.from_bytes(os.urandom(4), "big")
+        self._sequence = int.from_bytes(os.urandom(2), "big")
+        self._timestamp = int.from_bytes(os.urandom(4), "big")
+        self._marker = True
+
+        # 送信したパケット数とバイト数(UDPのペイロード)
+        self.packets = 0
+        self.octets = 0
+
+    def send(self, pcm: bytes) -> None:
+        """16ビットのPCMを μ-law の1パケットにして送る
+
+        :param bytes pcm: 16ビットのPCM(ネイティブのバイト順)
+        """
+
+        payload = ulaw_encode(pcm)
+        data = RtpPacket(
+            PT_PCMU, self._sequence, self._timestamp, self.ssrc, self._marker, payload
+        ).pack()
+
+        try:
+            self.sock.sendto(data, self.address)
+        except OSError as message:
+            logger.warning(f"RtpSender - send: {message}")
+        else:
+            self.packets += 1
+            self.octets += len(data)
+
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        self._timestamp = (self._timestamp + len(payload)) & 0xFFFFFFFF
+        self._marker = False
+
+    def close(self) -> None:
+        """送信を終える"""
+
+        self.sock.close()
+
+
+class RtpReceiver:
+    """RTPマルチキャストの受信
+
+    専用のスレッドで受信し、μ-law を16ビットのPCMにして、再生を待つ列に入れる。
+    再生側(会議ブリッジのクロック)は read() で20ミリ秒ずつ取り出す。
+    順番の遅れたパケットと重複したパケットは捨てる(並べ替えはしない)。
+    列が depth を超えたら古いものから捨てて、遅延が増えないようにする。
+    """
+
+    # 受信を待つ時間(秒): close() を確かめる間隔
+    RECV_TIMEOUT = 0.1
+
+    def __init__(
+        self,
+        group: str = DEFAULT_GROUP,
+        port: int = DEFAULT_PORT,
+        interface: str = "0.0.0.0",
+        depth: int = 5,
+    ):
+        """
+        :param str group: マルチキャストアドレス
+        :param int port: ポート
+        :param str interface: 受信するインターフェースのアドレス
+        :param int depth: 再生を待つパケットの上限(20ミリ秒単位)
+        """
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 同じポートの別のグループは受けない
+        self.sock.bind((group, port))
+        self.sock.setsockopt(
+            socket.IPPROTO_IP,
+            socket.IP_ADD_MEMBERSHIP,
+            struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface)),
+        )
+        self.sock.settimeout(self.RECV_TIMEOUT)
+
+        self._frames: deque[bytes] = deque(maxlen=depth)
+        self._ssrc: int | None = None
+        self._sequence = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # 受信したパケット数、失われたパケット数、捨てたパケット数
+        self.received = 0
+        self.lost = 0
+        self.discarded = 0
+        # 最後に受信した時刻(time.monotonic)
+        self.last_received = 0.0
+
+    @property
+    def active(self) -> bool:
+        """放送を受信しているかどうか(最後の受信から 0.5秒以内)
+
+        :return bool: 受信していればTrue
+        """
+
+        return time.monotonic() - self.last_received < 0.5
+
+    def start(self) -> None:
+        """受信のスレッドを開始する"""
+
+        self._thread = threading.Thread(
+            target=self._run, name="rtp-receiver", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """受信のスレッドを終え、グループから抜ける"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sock.close()
+
+    def read(self) -> bytes | None:
+        """再生する16ビットのPCMを1パケット分取り出す
+
+        どのスレッドから呼び出してもよい。
+
+        :return bytes: 16ビットのPCM、無ければ None
+        """
+
+        try:
+            return self._frames.popleft()
+        except IndexError:
+            return None
+
+    def _run(self) -> None:
+        """受信のスレッド"""
+
+        while not self._stop.is_set():
+            try:
+                data = self.sock.recv(2048)
+            except socket.timeout:
+                continue
+            except OSError as message:
+                logger.warning(f"RtpReceiver - recv: {message}")
+                break
+
+            self.receive(data)
+
+    def receive(self, data: bytes) -> None:
+        """受信したUDPのデータを処理する
+
+        :param bytes data: 受信したUDPのデータ
+        """
+
+        try:
+            packet = RtpPacket.parse(data)
+        except ValueError as message:
+            self.discarded += 1
+            logger.debug(f"RtpReceiver - receive: {message}")
+            return
+
+        if packet.payload_type != PT_PCMU:
+            self.discarded += 1
+            return
+
+        # 送信元が変わった(別の部屋からの放送、送信側の再開)
+        if packet.ssrc != self._ssrc:
+            self._ssrc = packet.ssrc
+            self._frames.clear()
+        else:
+            gap = (packet.sequence - self._sequence) & 0xFFFF
+            if gap == 0 or gap >= 0x8000:
+                # 重複、あるいは順番が遅れた
+                self.discarded += 1
+                return
+            self.lost += gap - 1
+
+        self._sequence = packet.sequence
+        self.received += 1
+        self.last_received = time.monotonic()
+        self._frames.append(ulaw_decode(packet.payload))
+
+
+if __name__ == "__main__":
+    print(__file__)
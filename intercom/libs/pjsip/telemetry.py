@@ -0,0 +1,414 @@
+"""telemetry
+
+通話ごとの音声品質(ジッター、パケットロス、RTT、E-model による MOS の推定)の記録と、
+Prometheus のテキスト形式での出力(テキストファイル、あるいはHTTP)。
+
+pjsua2 に依存しない。値は Call.sampleTelemetry() が getStreamStat() から渡す。
+"""
+
+import array
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# E-model(ITU-T G.107)のコーデックごとの機器劣化係数 Ie と、パケットロス耐性 Bpl
+# G.711 は G.113 Appendix I の値(PLCあり)。G.722 と Opus は狭帯域の尺度での概算。
+CODEC_IMPAIRMENTS = {
+    "pcmu": (0.0, 25.1),
+    "pcma": (0.0, 25.1),
+    "g722": (0.0, 25.1),
+    "opus": (0.0, 30.0),
+    "speex": (11.0, 20.0),
+    "gsm": (20.0, 10.0),
+    "ilbc": (10.0, 20.0),
+}
+# 表に無いコーデック
+DEFAULT_IMPAIRMENT = (10.0, 20.0)
+
+# 1パケットの音声の長さ(ミリ秒): 一方向の遅延に加える
+PACKET_MS = 20.0
+
+# 記録する値: 名前 -> (Prometheus のメトリック名, 説明)
+FIELDS = {
+    "jitter": ("intercom_call_jitter_milliseconds", "受信のジッター"),
+    "loss": ("intercom_call_loss_ratio", "区間の受信のパケットロス率"),
+    "remote_loss": (
+        "intercom_call_remote_loss_ratio",
+        "相手の受信報告の区間のパケットロス率",
+    ),
+    "rtt": ("intercom_call_rtt_milliseconds", "RTCPで測った往復の遅延"),
+    "delay": ("intercom_call_delay_milliseconds", "推定した一方向の遅延"),
+    "mos": ("intercom_call_mos", "E-model で推定した MOS"),
+}
+
+
+def e_model_mos(
+    delay_ms: float, loss: float, codec: str = "pcmu", burst: float = 1.0
+) -> float:
+    """E-model(ITU-T G.107)の簡略化した計算で、MOS を推定する
+
+    R = 93.2 - Id - Ie_eff(他の劣化要因は既定値のまま)
+
+    :param float delay_ms: 一方向の遅延(ミリ秒)
+    :param float loss: パケットロス率(0.0 - 1.0)
+    :param str codec: コーデックの名前(CODEC_IMPAIRMENTS のキー、大文字小文字は問わない)
+    :param float burst: BurstR(ランダムなロスなら 1.0)
+    :return float: MOS(1.0 - 4.5)
+    """
+
+    ie, bpl = CODEC_IMPAIRMENTS.get(codec.lower(), DEFAULT_IMPAIRMENT)
+
+    # 遅延による劣化
+    i_d = 0.024 * delay_ms
+    if delay_ms > 177.3:
+        i_d += 0.11 * (delay_ms - 177.3)
+
+    # パケットロスによる劣化
+    ppl = loss * 100.0
+    ie_eff = ie + (95.0 - ie) * ppl / (ppl / burst + bpl)
+
+    r = 93.2 - i_d - ie_eff
+    if r <= 0.0:
+        return 1.0
+    if r >= 100.0:
+        return 4.5
+    return 1.0 + 0.035 * r + r * (r - 60.0) * (100.0 - r) * 7e-6
+
+
+class SampleRing:
+    """固定長のリングバッファ(値ごとの array)
+
+    append() は配列を伸ばさず、一番古い標本を上書きする。
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param int capacity: 保持する標本の数
+        """
+
+        self.capacity = capacity
+        self._times = array.array("d", bytes(8 * capacity))
+        self._columns = {name: array.array("d", bytes(8 * capacity)) for name in FIELDS}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, **values: float) -> None:
+        """標本を加える
+
+        :param float timestamp: 時刻(time.time)
+        :param float values: FIELDS の名前ごとの値
+        """
+
+        position = self._next
+        self._times[position] = timestamp
+        for name, column in self._columns.items():
+            column[position] = values[name]
+
+        self._next = (position + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _positions(self) -> Iterator[int]:
+        start = (self._next - self._count) % self.capacity
+        for offset in range(self._count):
+            yield (start + offset) % self.capacity
+
+    def values(self, name: str) -> list[float]:
+        """古い順の値
+
+        :param str name: FIELDS の名前
+        :return list[float]: 値
+        """
+
+        column = self._columns[name]
+        return [column[position] for position in self._positions()]
+
+    def latest(self) -> dict[str, float] | None:
+        """最新の標本
+
+        :return dict: 時刻(time)と FIELDS の名前ごとの値、無ければ None
+        """
+
+        if not self._count:
+            return None
+
+        position = (self._next - 1) % self.capacity
+        sample = {name: column[position] for name, column in self._columns.items()}
+        sample["time"] = self._times[position]
+        return sample
+
+
+class CallTelemetry:
+    """1つの通話の音声品質の記録
+
+    RTCP の統計は累積値なので、前回との差から区間のパケットロス率を求める。
+    """
+
+    def __init__(self, call_id: int, remote: str, codec: str, capacity: int):
+        """
+        :param int call_id: call id
+        :param str remote: 相手の URI
+        :param str codec: コーデックの名前
+        :param int capacity: 保持する標本の数
+        """
+
+        self.call_id = call_id
+        self.remote = remote
+        self.codec = codec
+        # 音声の経路: "direct"(部屋どうし) か "anchored"(SIPサーバーで中継)、不明なら None
+        self.path: str | None = None
+        self.samples = SampleRing(capacity)
+        self._last: tuple[int, int, int, int] | None = None
+
+    @staticmethod
+    def _loss(packets: int, lost: int) -> float:
+        expected = packets + lost
+        return lost / expected if expected > 0 else 0.0
+
+    def update(
+        self,
+        rx_packets: int,
+        rx_lost: int,
+        tx_packets: int,
+        tx_lost: int,
+        jitter_ms: float,
+        rtt_ms: float,
+        buffer_ms: float,
+        timestamp: float,
+    ) -> None:
+        """RTCP の統計から標本を1つ加える
+
+        :param int rx_packets: 受信したパケット数(累積)
+        :param int rx_lost: 受信で失われたパケット数(累積)
+        :param int tx_packets: 送信したパケット数(累積)
+        :param int tx_lost: 相手の受信報告で失われたパケット数(累積)
+        :param float jitter_ms: 受信のジッター(ミリ秒)
+        :param float rtt_ms: 往復の遅延(ミリ秒)
+        :param float buffer_ms: ジッターバッファの平均の遅延(ミリ秒)
+        :param float timestamp: 時刻(time.time)
+        """
+
+        current = (rx_packets, rx_lost, tx_packets, tx_lost)
+        last, self._last = self._last, current
+        # 最初の回、あるいは re-INVITE でストリームが作り直されたら、累積値をそのまま使う
+        if last is None or any(now < before for now, before in zip(current, last)):
+            last = (0, 0, 0, 0)
+
+        rx_packets, rx_lost, tx_packets, tx_lost = (
+            now - before for now, before in zip(current, last)
+        )
+        loss = self._loss(rx_packets, rx_lost)
+        delay = rtt_ms / 2 + buffer_ms + PACKET_MS
+
+        self.samples.append(
+            timestamp,
+            jitter=jitter_ms,
+            loss=loss,
+            remote_loss=self._loss(tx_packets - tx_lost, tx_lost),
+            rtt=rtt_ms,
+            delay=delay,
+            mos=e_model_mos(delay, loss, self.codec),
+        )
+
+
+class Telemetry:
+    """すべての通話の音声品質の記録と、Prometheus のテキスト形式での出力
+
+    UIスレッドで update() し、HTTPのスレッドで render() するので、ロックの中で扱う。
+    """
+
+    def __init__(self, capacity: int = 120):
+        """
+        :param int capacity: 通話ごとに保持する標本の数
+        """
+
+        self.capacity = capacity
+        self._calls: dict[int, CallTelemetry] = {}
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+        # 終わった通話の数
+        self.finished = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def get(self, call_id: int) -> CallTelemetry | None:
+        """通話の記録
+
+        :param int call_id: call id
+        :return CallTelemetry: 記録、無ければ None
+        """
+
+        return self._calls.get(call_id)
+
+    def update(
+        self,
+        call_id: int,
+        remote: str,
+        codec: str,
+        path: str | None = None,
+        **stats: float,
+    ) -> None:
+        """通話の標本を加える(通話の記録が無ければ作る)
+
+        :param int call_id: call id
+        :param str remote: 相手の URI
+        :param str codec: コーデックの名前
+        :param str path: 音声の経路 "direct" か "anchored"(不明なら None)
+        :param stats: CallTelemetry.update() の引数(timestamp は省略できる)
+        """
+
+        stats.setdefault("timestamp", time.time())
+        with self._lock:
+            telemetry = self._calls.get(call_id)
+            if telemetry is None or telemetry.codec != codec:
+                telemetry = CallTelemetry(call_id, remote, codec, self.capacity)
+                self._calls[call_id] = telemetry
+            telemetry.path = path
+            telemetry.update(**stats)
+
+    def remove(self, call_id: int) -> None:
+        """終わった通話の記録を除く
+
+        :param int call_id: call id
+        """
+
+        with self._lock:
+            if self._calls.pop(call_id, None) is not None:
+                self.finished += 1
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self) -> str:
+        """Prometheus のテキスト形式(text/plain; version=0.0.4)
+
+        通話ごとの最新の値と、保持している区間の最低の MOS、音声の経路を出力する。
+
+        :return str: メトリック
+        """
+
+        with self._lock:
+            calls = [
+                (telemetry, telemetry.samples.latest(), telemetry.samples.values("mos"))
+                for telemetry in self._calls.values()
+            ]
+            finished = self.finished
+
+        lines = [
+            "# HELP intercom_calls_active 通話中の数",
+            "# TYPE intercom_calls_active gauge",
+            f"intercom_calls_active {len(calls)}",
+            "# HELP intercom_calls_finished_total 終わった通話の数",
+            "# TYPE intercom_calls_finished_total counter",
+            f"intercom_calls_finished_total {finished}",
+        ]
+
+        fields = dict(
+            FIELDS, mos_min=("intercom_call_mos_min", "保持している区間の最低の MOS")
+        )
+        for name, (metric, text) in fields.items():
+            lines.append(f"# HELP {metric} {text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for telemetry, latest, mos in calls:
+                if latest is None:
+                    continue
+                value = min(mos) if name == "mos_min" else latest[name]
+                lines.append(f"{metric}{{{self._labels(telemetry)}}} {value:.6g}")
+
+        # 音声の経路: 経路をラベルにして 1 を出力する
+        lines.append(
+            "# HELP intercom_call_media_path "
+            "音声の経路(direct: 部屋どうし、anchored: SIPサーバーで中継)"
+        )
+        lines.append("# TYPE intercom_call_media_path gauge")
+        for telemetry, latest, mos in calls:
+            if latest is None or telemetry.path is None:
+                continue
+            labels = f'{self._labels(telemetry)},path="{self._escape(telemetry.path)}"'
+            lines.append(f"intercom_call_media_path{{{labels}}} 1")
+
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, telemetry: CallTelemetry) -> str:
+        return (
+            f'call="{telemetry.call_id}",'
+            f'remote="{self._escape(telemetry.remote)}",'
+            f'codec="{self._escape(telemetry.codec)}"'
+        )
+
+    def write_textfile(self, path: str) -> None:
+        """node_exporter の textfile collector 用に、ファイルへ書き出す
+
+        読み出し中のファイルを壊さないように、一時ファイルに書いてから置き換える。
+
+        :param str path: 書き出すファイル(*.prom)
+        """
+
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+    def serve(self, address: str = "127.0.0.1", port: int = 9464) -> int:
+        """HTTPで /metrics を公開する(専用のスレッド)
+
+        :param str address: 待ち受けるアドレス
+        :param int port: ポート(0 なら空いているポート)
+        :return int: 待ち受けたポート、待ち受けられなければ 0(公開しない)
+        """
+
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = telemetry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((address, port), Handler)
+        except OSError as message:
+            # ポートが使用中など: 通話には影響しないので、公開せずに続ける
+            logger.warning(f"/metrics を {address}:{port} で公開できない: {message}")
+            return 0
+
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="telemetry-http", daemon=True
+        ).start()
+
+        return self._server.server_address[1]
+
+    def shutdown(self) -> None:
+        """HTTPの公開を終える"""
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == "__main__":
+    print(__file__)
@@ -0,0 +1,82 @@
+"""uri"""
+
+from typing import Iterable
+
+
+def normalize_uri(uri: str) -> str:
+    """SIP URI を比較用に正規化する
+
+    表示名、山括弧、パスワード、ポート、URIパラメータ、ヘッダを除き、
+    "scheme:user@host" を小文字にして返す。
+      '"Intercom 2" <SIP:Intercom2@Intercom1:5060;transport=udp>'
+        -> "sip:intercom2@intercom1"
+
+    :param str uri: SIP URI(CallInfo.remoteUri や BuddyInfo.uri の書式)
+    :return str: 正規化した URI
+    """
+
+    uri = uri.strip()
+
+    # 表示名と山括弧: "name" <uri>;tag=...
+    start = uri.find("<")
+    if start >= 0:
+        end = uri.find(">", start)
+        uri = uri[start + 1 : end if end >= 0 else None]
+
+    # ヘッダ(?...)とURIパラメータ(;...)
+    uri = uri.split("?", 1)[0].split(";", 1)[0]
+
+    scheme, _, rest = uri.partition(":")
+    if not rest:
+        scheme, rest = "sip", scheme
+
+    user, _, host = rest.rpartition("@")
+    user = user.split(":", 1)[0]
+
+    # ポート(IPv6 の [addr]:port にも対応)
+    if host.startswith("["):
+        host = host[: host.find("]") + 1]
+    else:
+        host = host.split(":", 1)[0]
+
+    if user:
+        return f"{scheme}:{user}@{host}".lower()
+
+    return f"{scheme}:{host}".lower()
+
+
+class BuddyIndex:
+    """通話相手の URI の索引
+
+    通話相手を登録する時に正規化した URI を集合に加え、
+    着信の受け入れは集合の検索(定数時間)で判定する。
+    """
+
+    def __init__(self, uris: Iterable[str] = ()):
+        self._uris: set[str] = {normalize_uri(uri) for uri in uris}
+
+    def __len__(self) -> int:
+        return len(self._uris)
+
+    def __contains__(self, uri: str) -> bool:
+        return normalize_uri(uri) in self._uris
+
+    def add(self, uri: str) -> None:
+        """通話相手の URI を加える
+
+        :param str uri: 通話相手の URI
+        """
+
+        self._uris.add(normalize_uri(uri))
+
+    def discard(self, uri: str) -> None:
+        """通話相手の URI を除く
+
+        :param str uri: 通話相手の URI
+        """
+
+        self._uris.discard(normalize_uri(uri))
+
+
+if __name__ == "__main__":
+    print(__file__)
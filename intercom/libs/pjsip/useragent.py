@@ -1,9 +1,21 @@
 """UserAgent"""
 
+import threading
+from typing import Literal
+
 import pjsua2 as pj
 
 from .error import PJError, PJLogging, logger
 from .account import Account as ACC
+from .account import Buddy as BUDDY
+from .codec import OpusSettings, apply_codecs, parse_codecs
+from .direct import resolve_hosts
+from .dispatcher import Dispatcher
+from .profile import apply_device_latency, apply_media_config, get_profile
+from .uri import normalize_uri
+
+# pjsua2 の通話相手(Buddy)の数の上限(PJSUA_MAX_BUDDIES)
+PJSUA_MAX_BUDDIES = 256
 
 """enum pj_log_decoration
 {
@@ -33,21 +45,60 @@ class UserAgent:
 
     トランスポートタイプはUDPのみとする。
     UserAgentのインスタンスは、登録後のAccountインスタンスを保持する。
-    そのAccountに関連付けられたBuddyインスタンスも保持する。
-    また、そのAccountインスタンスは、Callインスタンスのリストを保持する。
+    そのAccountに関連付けられたBuddyインスタンス(部屋ごと)も保持する。
+    また、そのAccountインスタンスは、Callインスタンスの登録簿(CallRegistry)を保持する。
 
     アプリケーション側の制限
       UserAgent のインスタンスを１個だけとする。
-      libHandleEvents 関数を実装し、pjsua2 のライブラリィ実行を polling する。
-      一対一通話の為、SIP サーバに登録するアカウントを１個だけとする。
-      一対一通話の為、アカウントと関連付けるバディを１個だけとする。
+      SIP サーバに登録するアカウントを１個だけとする。
+      アカウントと関連付けるバディは部屋の数だけ登録できる。
+      buddy は最初に登録したバディ(通話ボタンの通話相手)とする。
+
+    pjsua2 のライブラリィ実行(libHandleEvents)の方法
+      "polling": アプリケーションが UIスレッドから libHandleEvents を呼び出す。
+      "thread": libRegisterThread で登録した専用のスレッドが libHandleEvents を呼び出す。
+                コールバックは専用のスレッドで実行されるので、UIの操作は
+                dispatcher に登録し、UIスレッドで drain() して実行する。
+    pjsua2 自身のワーカースレッド(threadCnt > 0)は、Python のコールバックを
+    登録していないスレッドから呼び出すので使わない。
+    "thread" では、UserAgent を起動用のスレッドで作ってもよい。その場合は、
+    UIスレッドで registerThread() してから操作する。
     """
 
     # Endpoint のインスタンスをシングルトンとして扱うためにクラス変数とした。
-    endpoint = pj.Endpoint()
+    # import だけでは作らず、最初の UserAgent を作る時に作る。
+    endpoint: "pj.Endpoint | None" = None
+
+    # 専用のスレッドで libHandleEvents に渡す最大待機時間(ミリ秒)
+    EVENT_TIMEOUT_MS = 50
+
+    def __init__(
+        self,
+        event_mode: Literal["polling", "thread"] = "polling",
+        max_calls: int = 4,
+        profile: str = "balanced",
+    ):
+        """
+        :param str event_mode: "polling" か "thread"
+        :param int max_calls: 同時に扱える通話の数(一斉呼出では部屋の数以上)
+        :param str profile: 音声の遅延のプロファイル "lowlatency", "balanced", "robust"
+        """
 
-    def __init__(self):
         try:
+            if event_mode not in ("polling", "thread"):
+                raise PJError(f"event_mode {event_mode} は使えない")
+            self.event_mode = event_mode
+            self.profile = get_profile(profile)
+
+            # コールバックからUIスレッドへの処理の受け渡し
+            self.dispatcher = Dispatcher()
+            # 部屋ごとの通話相手(正規化したURI -> Buddy)
+            self.buddies: dict = {}
+            self._event_thread: threading.Thread | None = None
+            self._stopping = threading.Event()
+
+            if UserAgent.endpoint is None:
+                UserAgent.endpoint = pj.Endpoint()
             self.endpoint.libCreate()
 
             # self.endpoint_config = pj.EpConfig()
@@ -56,10 +107,12 @@ class UserAgent:
             # Python 環境用: アプリケーション側でコールバックを処理
             #   設定しなくても動作するけど、処理の取りこぼしが起こる。
             endpoint_config.uaConfig.threadCnt = 0
-            endpoint_config.uaConfig.mainThreadOnly = True
+            # "thread" の場合は、libCreate したスレッド以外で libHandleEvents する
+            endpoint_config.uaConfig.mainThreadOnly = event_mode == "polling"
+            endpoint_config.uaConfig.maxCalls = max_calls
 
-            # 通話品質の設定
-            endpoint_config.medConfig.ptime = 20
+            # 通話品質の設定: ptime, ジッターバッファ, サウンドデバイスのバッファ
+            apply_media_config(endpoint_config.medConfig, self.profile)
 
             # loggingの設定
             # 出力するレベルは、loggerで制御
@@ -75,29 +128,95 @@ class UserAgent:
             self.endpoint.libInit(endpoint_config)
 
             transport_config = pj.TransportConfig()
-            self.endpoint.transportCreate(pj.PJSIP_TRANSPORT_UDP, transport_config)
+            self.transport_id = self.endpoint.transportCreate(
+                pj.PJSIP_TRANSPORT_UDP, transport_config
+            )
             self.endpoint.transportCreate(pj.PJSIP_TRANSPORT_TCP, transport_config)
 
             self.endpoint.libStart()
+            self._applyDeviceLatency()
+
+            if event_mode == "thread":
+                self._event_thread = threading.Thread(
+                    target=self._run_events, name="pjsip-events", daemon=True
+                )
+                self._event_thread.start()
 
         except pj.Error as message:
             raise PJError(message)
 
-        except PJError as message:
+        except (PJError, ValueError) as message:
             raise PJError(f"UserAgent - constructor: {message}")
 
         else:
-            logger.info(f"UserAgentを開始")
+            logger.info(f"UserAgentを開始 ({event_mode}, {profile})")
 
     def __del__(self):
+        self.stop()
         if "self.buddy" in locals():
             del self.buddy
         if "self.account" in locals():
             del self.account
-        self.endpoint.libDestroy()
+        if self.endpoint is not None:
+            self.endpoint.libDestroy()
 
         logger.info(f"UserAgentを破棄")
 
+    def _run_events(self):
+        """専用のスレッド: pjsua2 のライブラリィ実行
+
+        libHandleEvents は待機中に GIL を解放するので、UIスレッドを止めない。
+        """
+
+        self.endpoint.libRegisterThread("pjsip-events")
+        logger.info(f"pjsua2 のイベント処理スレッドを開始")
+
+        while not self._stopping.is_set():
+            self.endpoint.libHandleEvents(self.EVENT_TIMEOUT_MS)
+
+        logger.info(f"pjsua2 のイベント処理スレッドを終了")
+
+    def stop(self):
+        """専用のスレッドを終了する
+
+        "polling" の場合は何もしない。
+        """
+
+        if getattr(self, "_event_thread", None) is None:
+            return
+
+        self._stopping.set()
+        self._event_thread.join()
+        self._event_thread = None
+
+    def registerThread(self, name: str) -> None:
+        """呼び出したスレッドを pjsua2 に登録する
+
+        UserAgent を作ったスレッドと専用のスレッド以外から pjsua2 を操作する前に、
+        そのスレッドで1回呼び出す(登録済みなら何もしない)。
+
+        :param str name: スレッドの名前
+        """
+
+        try:
+            if not self.endpoint.libIsThreadRegistered():
+                self.endpoint.libRegisterThread(name)
+
+        except pj.Error as message:
+            raise PJError(f"UserAgent - registerThread: {message.info()}")
+
+    def _applyDeviceLatency(self) -> None:
+        """サウンドデバイスのバッファをプロファイルに合わせる
+
+        null device や、遅延を変えられないデバイスでは MediaConfig の値のままとする。
+        """
+
+        try:
+            apply_device_latency(self.endpoint.audDevManager(), self.profile)
+
+        except pj.Error as message:
+            logger.warning(f"サウンドデバイスの遅延を変えられない: {message.info()}")
+
     def _validateUri(self, uri: str) -> bool:
         """説明
 
@@ -118,6 +237,34 @@ class UserAgent:
 
         return self.endpoint.utilVerifySipUri(uri) == pj.PJ_SUCCESS
 
+    def configureCodecs(
+        self, codecs: str = "pcmu", opus: OpusSettings | None = None
+    ) -> list[str]:
+        """コーデックの優先度と Opus の設定
+
+        codecs に無いコーデックは無効にする(SDPに載せない)。
+        アカウントの登録より前に呼び出す。
+
+        :param str codecs: 優先度の高い順のコーデックの名前 "opus, g722, pcmu"
+        :param OpusSettings opus: Opus の設定(省略時は変えない)
+        :return list[str]: 有効にしたコーデックの codec id(優先度の高い順)
+        """
+
+        try:
+            enabled = apply_codecs(self.endpoint, parse_codecs(codecs), opus)
+            if not enabled:
+                raise PJError(f"コーデック {codecs} はどれも使えない")
+
+        except pj.Error as message:
+            raise PJError(f"UserAgent - configureCodecs: {message.info()}")
+
+        except (PJError, ValueError) as message:
+            raise PJError(f"UserAgent - configureCodecs: {message}")
+
+        else:
+            logger.info(f"コーデック: {', '.join(enabled)}")
+            return enabled
+
     def registryAccount(
         self,
         idUri: str = "sip:name@sipserver",
@@ -147,7 +294,8 @@ class UserAgent:
             config.sipConfig.authCreds.append(cred)
 
             # Account サブクラスのインスタンスを生成、SIP サーバに登録
-            self.account = ACC()
+            self.account = ACC(self.dispatcher)
+            self.account.servers = resolve_hosts(registrarUri)
             self.account.create(config, True)
 
         except pj.Error as message:
@@ -160,29 +308,89 @@ class UserAgent:
             logger.info(f"アカウントを登録した")
             return self.account.isValid()
 
-    def registryBuddy(self, idUri: str = "sip:name@sipserver") -> bool:
+    def registryLocalAccount(
+        self, idUri: str = "sip:name@sipserver", name: str = "", data: str = ""
+    ) -> bool:
+        """SIP サーバに登録しないアカウント(直接の発信と着信だけ)
+
+        部屋どうしは "sip:user@ip:port" で直接発信する。相手の通話相手(buddy)と一致するよう、
+        idUri は SIP サーバに登録する場合と同じにする。
+        name と data があれば、SIP サーバを経由して発信する場合の認証に使う。
+
+        :param str idUri: "sip:name@sipserver"
+        :param str name: "name"
+        :param str data: "password"
+        :return bool: アカウントが有効かどうか
+        """
+
+        try:
+            config = pj.AccountConfig()
+            config.idUri = idUri
+
+            if name:
+                cred = pj.AuthCredInfo("digest", "asterisk", name, 0, data)
+                config.sipConfig.authCreds.append(cred)
+
+            self.account = ACC(self.dispatcher)
+            self.account.create(config, True)
+
+        except pj.Error as message:
+            raise PJError(f"UserAgent - registryLocalAccount: {message.info()}")
+
+        else:
+            logger.info(f"登録しないアカウントを作成した")
+            return self.account.isValid()
+
+    def registryBuddy(
+        self, idUri: str = "sip:name@sipserver", subscribe: bool = False
+    ) -> bool:
         """インターホンの通話相手をアカウントに登録
 
+        部屋の数だけ呼び出せる。最初に登録した通話相手を buddy とする。
+        着信を受け入れる通話相手の索引(account.buddies)には、Buddy を作れるかどうかに
+        関わらず加える。Buddy は PJSUA_MAX_BUDDIES まで作り、それを超える部屋は
+        プレゼンスを表示しない。
+
         :param str idUri: "sip:name@sipserver"
+        :param bool subscribe: プレゼンスを購読するかどうか
+        :return bool: Buddy を作れたかどうか
         """
 
+        self.account.buddies.add(idUri)
+
+        uri = normalize_uri(idUri)
+        if uri in self.buddies:
+            return self.buddies[uri].isValid()
+        if len(self.buddies) >= PJSUA_MAX_BUDDIES:
+            logger.warning(
+                f"通話相手 {idUri} の Buddy は作らない"
+                f"(上限 {PJSUA_MAX_BUDDIES}、着信は受け入れる)"
+            )
+            return False
+
         try:
             config = pj.BuddyConfig()
             config.uri = idUri
+            config.subscribe = subscribe
 
             # Buddyをサブクラス化するのが推奨されている
-            self.buddy = pj.Buddy()
-            self.buddy.create(self.account, config)
+            buddy = BUDDY(self.dispatcher)
+            buddy.create(self.account, config)
+
+            self.buddies[uri] = buddy
+            if not hasattr(self, "buddy"):
+                self.buddy = buddy
 
         except pj.Error as message:
-            pass
+            logger.warning(f"通話相手 {idUri} の Buddy を作れない: {message.info()}")
+            return False
 
         except PJError as message:
             raise PJError(f"UserAgent - registryBuddy: {message}")
 
         else:
             logger.info(f"通話相手を登録した")
-            return self.buddy.isValid()
+            return buddy.isValid()
 
 
 if __name__ == "__main__":
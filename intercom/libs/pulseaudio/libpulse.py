@@ -1,6 +1,7 @@
 """libpulse
 
-マイク(source)とスピーカー(sink)の音量コントロール
+マイク(source)とスピーカー(sink)の音量コントロールとレベルメーター、
+音量値のランプ(フェード、ダッキング)
 
 これは、PulseAudionの共有ライブラリィlibpulseをPython言語から利用するためのモジュール。
 libpulseAPIにPython言語のctypesモジュール経由でアクセスする。
@@ -11,10 +12,24 @@ from enum import IntEnum, IntFlag, auto
 from ctypes.util import find_library
 import ctypes as CPA
 import logging as LPA
+import itertools
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from contextlib import contextmanager
+import weakref
+
+# NumPy はレベルメーター(LevelMeterPulseaudio)だけが使う。
+# NumPy が無くても、音量コントロールとランプは使える。
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 #### libpulseAPI Macros
 
 PA_CHANNELS_MAX = 32  # 本来は、32U
+PA_INVALID_INDEX = 0xFFFFFFFF  # 本来は、((uint32_t) -1)
 
 
 #### libpulseAPI用のロギング
@@ -54,6 +69,23 @@ def _errcheck(result: Any, libpulseapi: Callable, args: tuple) -> Any:
     return result
 
 
+# サーバーの応答を待つ時間の上限(秒): サーバーが止まっても、呼び出し元を止めない
+PA_TIMEOUT = 5.0
+
+
+def _wait(future: Future) -> Any:
+    """Futureの完了を PA_TIMEOUT 秒まで待つ
+
+    :param Future future: 完了を待つFuture
+    :return Any: Futureの結果
+    """
+
+    try:
+        return future.result(PA_TIMEOUT)
+    except TimeoutError:
+        raise PAError(f"PulseAudio Server が {PA_TIMEOUT} 秒応答しない")
+
+
 #### libpulseAPI
 # libpulse
 _libpulse = CPA.CDLL(name=find_library(name="pulse"), use_errno=True)
@@ -110,6 +142,24 @@ class PA_OPERATION_STATE(IntEnum):
     CANCELLED = auto()
 
 
+# pa_sample_format_t (必要なものだけ)
+class PA_SAMPLE_FORMAT(IntEnum):
+    U8 = 0
+    ALAW = auto()
+    ULAW = auto()
+    S16LE = auto()
+    S16BE = auto()
+    FLOAT32LE = auto()
+
+
+# pa_stream_flags_t (必要なものだけ)
+class PA_STREAM_FLAGS(IntFlag):
+    NOFLAGS = 0x0000
+    DONT_MOVE = 0x0200
+    PEAK_DETECT = 0x0800
+    ADJUST_LATENCY = 0x2000
+
+
 # pa_subscription_event_type_t
 class PA_SUBSCRIPTION_EVENT(IntFlag):
     SINK = 0x0000
@@ -191,6 +241,25 @@ class PA_CVOLUME(CPA.Structure):
     _fields_ = [("channels", CPA.c_uint8), ("values", PA_VOLUME_TS)]
 
 
+# pa_buffer_attr
+class PA_BUFFER_ATTR(CPA.Structure):
+    _fields_ = [
+        ("maxlength", CPA.c_uint32),
+        ("tlength", CPA.c_uint32),
+        ("prebuf", CPA.c_uint32),
+        ("minreq", CPA.c_uint32),
+        ("fragsize", CPA.c_uint32),
+    ]
+
+
+# struct timeval
+class PA_TIMEVAL(CPA.Structure):
+    _fields_ = [
+        ("tv_sec", CPA.c_long),  # c_long <- time_t
+        ("tv_usec", CPA.c_long),  # c_long <- suseconds_t
+    ]
+
+
 # pa_sink_port_info
 class PA_SINK_PORT_INFO(CPA.Structure):
     _fields_ = [
@@ -306,6 +375,133 @@ pa_mainloop_iterate = _prototype(
 )
 pa_mainloop_iterate.errcheck = _errcheck
 
+#### libpulseAPI threaded mainloop
+# 専用のスレッドでmainloopを実行する。
+# contextなどの操作は、lock/unlockの間で行う。callback関数は専用のスレッドで実行される。
+
+# 新しいthreaded mainloopオブジェクトを割り当て
+pa_threaded_mainloop_new = _prototype(CPA.c_void_p, "pa_threaded_mainloop_new")
+pa_threaded_mainloop_new.errcheck = _errcheck
+
+# threaded mainloopオブジェクトを解放
+pa_threaded_mainloop_free = _prototype(
+    None, "pa_threaded_mainloop_free", (CPA.c_void_p, 1, "mainloop")
+)
+
+# 専用のスレッドを開始
+pa_threaded_mainloop_start = _prototype(
+    CPA.c_int, "pa_threaded_mainloop_start", (CPA.c_void_p, 1, "mainloop")
+)
+pa_threaded_mainloop_start.errcheck = _errcheck
+
+# 専用のスレッドを終了(ロックを保持したまま呼び出さないこと)
+pa_threaded_mainloop_stop = _prototype(
+    None, "pa_threaded_mainloop_stop", (CPA.c_void_p, 1, "mainloop")
+)
+
+# mainloopをロック(再帰ロック可)
+pa_threaded_mainloop_lock = _prototype(
+    None, "pa_threaded_mainloop_lock", (CPA.c_void_p, 1, "mainloop")
+)
+
+# mainloopのロックを解除
+pa_threaded_mainloop_unlock = _prototype(
+    None, "pa_threaded_mainloop_unlock", (CPA.c_void_p, 1, "mainloop")
+)
+
+# pa_threaded_mainloop_signal() まで、ロックを解除して待つ
+pa_threaded_mainloop_wait = _prototype(
+    None, "pa_threaded_mainloop_wait", (CPA.c_void_p, 1, "mainloop")
+)
+
+# pa_threaded_mainloop_wait() で待っているスレッドを起こす
+pa_threaded_mainloop_signal = _prototype(
+    None,
+    "pa_threaded_mainloop_signal",
+    (CPA.c_void_p, 1, "mainloop"),
+    (CPA.c_int, 1, "wait_for_accept"),
+)
+
+# mainloopの抽象化レイヤーのvtableを返す
+pa_threaded_mainloop_get_api = _prototype(
+    CPA.c_void_p, "pa_threaded_mainloop_get_api", (CPA.c_void_p, 1, "mainloop")
+)
+pa_threaded_mainloop_get_api.errcheck = _errcheck
+
+# 呼び出し元が専用のスレッドかどうか
+pa_threaded_mainloop_in_thread = _prototype(
+    CPA.c_int, "pa_threaded_mainloop_in_thread", (CPA.c_void_p, 1, "mainloop")
+)
+
+#### libpulseAPI mainloop api
+# mainloopの抽象化レイヤー(pa_mainloop_api)のvtable。
+# タイマーイベント(time_new/time_restart/time_free)だけを使う。
+
+# callback関数: タイマーイベントの期限が来た
+PA_TIME_EVENT_CB_T = CPA.CFUNCTYPE(
+    None, CPA.c_void_p, CPA.c_void_p, CPA.POINTER(PA_TIMEVAL), CPA.c_void_p
+)
+"""PA_TIME_EVENT_CB_T
+
+pa_mainloop_api.time_new関数での利用を想定
+:param pa_mainloop_api *a: mainloopのvtable
+:param pa_time_event *e: タイマーイベント
+:param struct timeval *tv: 期限の時刻
+:param void *userdata: ユーザーデータ
+"""
+
+# 新しいタイマーイベントを作る(tvがNULLなら無効の状態で作る)
+PA_TIME_NEW_T = CPA.CFUNCTYPE(
+    CPA.c_void_p,
+    CPA.c_void_p,
+    CPA.POINTER(PA_TIMEVAL),
+    PA_TIME_EVENT_CB_T,
+    CPA.c_void_p,
+)
+
+# タイマーイベントの期限を変更する(tvがNULLなら無効にする)
+PA_TIME_RESTART_T = CPA.CFUNCTYPE(None, CPA.c_void_p, CPA.POINTER(PA_TIMEVAL))
+
+# タイマーイベントを解放する
+PA_TIME_FREE_T = CPA.CFUNCTYPE(None, CPA.c_void_p)
+
+
+# pa_mainloop_api
+class PA_MAINLOOP_API(CPA.Structure):
+    _fields_ = [
+        ("userdata", CPA.c_void_p),
+        ("io_new", CPA.c_void_p),
+        ("io_enable", CPA.c_void_p),
+        ("io_free", CPA.c_void_p),
+        ("io_set_destroy", CPA.c_void_p),
+        ("time_new", PA_TIME_NEW_T),
+        ("time_restart", PA_TIME_RESTART_T),
+        ("time_free", PA_TIME_FREE_T),
+        ("time_set_destroy", CPA.c_void_p),
+        ("defer_new", CPA.c_void_p),
+        ("defer_enable", CPA.c_void_p),
+        ("defer_free", CPA.c_void_p),
+        ("defer_set_destroy", CPA.c_void_p),
+        ("quit", CPA.c_void_p),
+    ]
+
+
+#### libpulseAPI timeval
+
+# 現在の時刻を得る
+pa_gettimeofday = _prototype(
+    CPA.POINTER(PA_TIMEVAL), "pa_gettimeofday", (CPA.POINTER(PA_TIMEVAL), 1, "tv")
+)
+pa_gettimeofday.errcheck = _errcheck
+
+# 時刻にマイクロ秒を加える
+pa_timeval_add = _prototype(
+    CPA.POINTER(PA_TIMEVAL),
+    "pa_timeval_add",
+    (CPA.POINTER(PA_TIMEVAL), 1, "tv"),
+    (PA_USEC_T, 1, "v"),
+)
+
 #### libpulseAPI context
 # context(PulseAudioサーバーと接続できる基本オブジェクト)を経由して非同期処理を実行する。
 
@@ -377,6 +573,41 @@ pa_context_get_state = _prototype(
 )
 pa_context_get_state.errcheck = _errcheck
 
+#### libpulseAPI subscribe
+# サーバー側の変化(sink, sourceの追加・変更・削除など)を通知してもらう。
+
+# pa_context_subscribe() で登録した通知のcallbackプロトタイプ
+PA_CONTEXT_SUBSCRIBE_CB_T = CPA.CFUNCTYPE(
+    None, CPA.c_void_p, CPA.c_int, CPA.c_uint32, CPA.c_void_p
+)
+"""pa_context_set_subscribe_callback() のcallbackプロトタイプ
+
+:param pa_context *context: 対象のcontext
+:param pa_subscription_event_type_t t: FACILITYと変化の種類(PA_SUBSCRIPTION_EVENT)
+:param uint32_t idx: 変化したFACILITYのインデックス
+:param void *userdata: ****
+"""
+
+# 通知を受け取るFACILITYをマスク(PA_SUBSCRIPTION_MASK)で指定
+pa_context_subscribe = _prototype(
+    CPA.c_void_p,
+    "pa_context_subscribe",
+    (CPA.c_void_p, 1, "context"),
+    (CPA.c_int, 1, "mask"),
+    (PA_CONTEXT_SUCCESS_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_subscribe.errcheck = _errcheck
+
+# 通知を受け取るcallback関数を登録
+pa_context_set_subscribe_callback = _prototype(
+    None,
+    "pa_context_set_subscribe_callback",
+    (CPA.c_void_p, 1, "context"),
+    (PA_CONTEXT_SUBSCRIBE_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+
 #### libpulseAPI operation
 # 操作。非同期処理なので終了まではmainloopを反復(pa_mainloop_iterate関数)
 
@@ -455,6 +686,39 @@ pa_context_set_sink_volume_by_name = _prototype(
 )
 pa_context_set_sink_volume_by_name.errcheck = _errcheck
 
+# すべてのsinkのpa_sink_infoを取得
+pa_context_get_sink_info_list = _prototype(
+    CPA.c_void_p,
+    "pa_context_get_sink_info_list",
+    (CPA.c_void_p, 1, "context"),
+    (PA_SINK_INFO_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_get_sink_info_list.errcheck = _errcheck
+
+# インデックスからsinkのpa_sink_infoを取得
+pa_context_get_sink_info_by_index = _prototype(
+    CPA.c_void_p,
+    "pa_context_get_sink_info_by_index",
+    (CPA.c_void_p, 1, "context"),
+    (CPA.c_uint32, 1, "idx"),
+    (PA_SINK_INFO_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_get_sink_info_by_index.errcheck = _errcheck
+
+# インデックスからsinkのvolumeを設定
+pa_context_set_sink_volume_by_index = _prototype(
+    CPA.c_void_p,
+    "pa_context_set_sink_volume_by_index",
+    (CPA.c_void_p, 1, "context"),
+    (CPA.c_uint32, 1, "idx"),
+    (CPA.POINTER(PA_CVOLUME), 1, "volume"),
+    (PA_CONTEXT_SUCCESS_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_set_sink_volume_by_index.errcheck = _errcheck
+
 #### libpulseAPI instrospect - sources
 # source処理
 
@@ -491,7 +755,106 @@ pa_context_set_source_volume_by_name = _prototype(
     (PA_CONTEXT_SUCCESS_CB_T, 1, "callback"),
     (CPA.c_void_p, 1, "userdata"),
 )
-pa_context_get_source_info_by_name.errcheck = _errcheck
+pa_context_set_source_volume_by_name.errcheck = _errcheck
+
+# すべてのsourceの情報を取得
+pa_context_get_source_info_list = _prototype(
+    CPA.c_void_p,
+    "pa_context_get_source_info_list",
+    (CPA.c_void_p, 1, "context"),
+    (PA_SOURCE_INFO_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_get_source_info_list.errcheck = _errcheck
+
+# インデックスからsourceの情報を取得
+pa_context_get_source_info_by_index = _prototype(
+    CPA.c_void_p,
+    "pa_context_get_source_info_by_index",
+    (CPA.c_void_p, 1, "context"),
+    (CPA.c_uint32, 1, "idx"),
+    (PA_SOURCE_INFO_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_get_source_info_by_index.errcheck = _errcheck
+
+# インデックスからsourceのpa_cvolumeを設定
+pa_context_set_source_volume_by_index = _prototype(
+    CPA.c_void_p,
+    "pa_context_set_source_volume_by_index",
+    (CPA.c_void_p, 1, "context"),
+    (CPA.c_uint32, 1, "idx"),
+    (CPA.POINTER(PA_CVOLUME), 1, "volume"),
+    (PA_CONTEXT_SUCCESS_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+pa_context_set_source_volume_by_index.errcheck = _errcheck
+
+#### libpulseAPI stream
+# 音声データの再生・録音のストリーム
+
+# ストリームを作成
+pa_stream_new = _prototype(
+    CPA.c_void_p,
+    "pa_stream_new",
+    (CPA.c_void_p, 1, "context"),
+    (CPA.c_char_p, 1, "name"),
+    (CPA.POINTER(PA_SAMPLE_SPEC), 1, "ss"),
+    (CPA.POINTER(PA_CHANNEL_MAP), 1, "map"),
+)
+pa_stream_new.errcheck = _errcheck
+
+# ストリームの参照カウンタを1つ減らす
+pa_stream_unref = _prototype(None, "pa_stream_unref", (CPA.c_void_p, 1, "stream"))
+
+# pa_stream_set_read_callback() などのcallbackプロトタイプ
+PA_STREAM_REQUEST_CB_T = CPA.CFUNCTYPE(None, CPA.c_void_p, CPA.c_size_t, CPA.c_void_p)
+"""pa_stream_set_read_callback() などのcallbackプロトタイプ
+
+:param pa_stream *stream: 対象のストリーム
+:param size_t nbytes: 読み出せるバイト数
+:param void *userdata: ****
+"""
+
+# 新しいデータを読み出せるようになった時に呼び出すcallback関数を登録
+pa_stream_set_read_callback = _prototype(
+    None,
+    "pa_stream_set_read_callback",
+    (CPA.c_void_p, 1, "stream"),
+    (PA_STREAM_REQUEST_CB_T, 1, "callback"),
+    (CPA.c_void_p, 1, "userdata"),
+)
+
+# ストリームを録音用にsourceへ接続
+pa_stream_connect_record = _prototype(
+    CPA.c_int,
+    "pa_stream_connect_record",
+    (CPA.c_void_p, 1, "stream"),
+    (CPA.c_char_p, 1, "dev"),
+    (CPA.POINTER(PA_BUFFER_ATTR), 1, "attr"),
+    (CPA.c_int, 1, "flags"),
+)
+pa_stream_connect_record.errcheck = _errcheck
+
+# ストリームを切断
+pa_stream_disconnect = _prototype(
+    CPA.c_int, "pa_stream_disconnect", (CPA.c_void_p, 1, "stream")
+)
+pa_stream_disconnect.errcheck = _errcheck
+
+# 録音バッファの先頭のデータを参照(コピーしない)
+pa_stream_peek = _prototype(
+    CPA.c_int,
+    "pa_stream_peek",
+    (CPA.c_void_p, 1, "stream"),
+    (CPA.POINTER(CPA.c_void_p), 1, "data"),
+    (CPA.POINTER(CPA.c_size_t), 1, "nbytes"),
+)
+pa_stream_peek.errcheck = _errcheck
+
+# 録音バッファの先頭のデータを捨てる
+pa_stream_drop = _prototype(CPA.c_int, "pa_stream_drop", (CPA.c_void_p, 1, "stream"))
+pa_stream_drop.errcheck = _errcheck
 
 #### libpulseAPI volume
 # 音量処理
@@ -520,330 +883,1665 @@ pa_cvolume_set.errcheck = _errcheck
 def _connect_state(context, userdata):
     """callback関数
 
-    PA_CONTEXT_STATE列挙型の値(contextのサーバー接続状態)をuserdataに渡す
+    contextのサーバー接続状態が変化したら、接続待ちのスレッドを起こす
     | pa_context_set_state_callback()
 
     :param pa_context *context: context
-    :param void *userdata: PA_CONTEXT_STATEを収受
+    :param void *userdata: pa_threaded_mainloop
     """
 
-    cast_userdata = CPA.cast(userdata, CPA.POINTER(CPA.c_int)).contents
-    cast_userdata.value = pa_context_get_state(context)
+    pa_threaded_mainloop_signal(userdata, 0)
 
 
-# ローカルスコープで操作(operation)完了しないcallback関数
+#### PulseAudioサーバーとの接続
 
 
-@PA_CONTEXT_SUCCESS_CB_T
-def _success_state(context, success, userdata):
-    """callback関数
-
-    操作完了の成否を得る
-    | pa_context_set_sink_volume_by_nam()
-    | pa_context_set_source_volume_by_name()
-
-    :param pa_context *context: 対象のcontext
-    :param int success: 0 - 正常に操作完了、1 - 異常な操作完了
-    :param void *userdata: ****
-    """
-
-    cast_userdata = CPA.cast(userdata, CPA.POINTER(CPA.c_int)).contents
-    cast_userdata.value = success
-
+class PulseaudioConnection:
+    """PulseAudioサーバーとの接続
 
-#### 基本のPulseAudioクラス
+    プロセス全体で1つのmainloopとcontextを共有するための接続管理クラス。
+    acquire() で接続を得て、release() で返す。最初の acquire() だけが
+    サーバーへの接続(connect/authorize)を行い、最後の release() で切断する。
+    マイク、スピーカー、その他の音量コントロールは、同じ接続上で操作を多重化する。
 
+    mainloopは pa_threaded_mainloop で、PulseAudioの処理はすべて専用のスレッドで行う。
+    呼び出し元は locked() の中で操作を要求するだけで、完了は待たない。
+    完了はFutureか、専用のスレッドで呼び出されるcallback関数で受け取る。
 
-class BasePulseaudio:
-    """基本のPulseAudioクラス
+    サーバーからの変化の通知は、contextに1つしか登録できないので、
+    この接続が受け取り、購読しているすべてのリスナーに配る。
 
-    コンストラクタ: mainloopの作成、contextのPulseAudioサーバーへの接続
-    デストラクタ: contextのPulseAudioサーバーへの切断、mainloopの開放
+    デフォルトのsink/sourceは、接続ごとに1つの DeviceRegistry (devices) が追跡する。
     """
 
+    _instance: "PulseaudioConnection | None" = None
+
     def __init__(self, name: str):
         try:
+            self._refcount = 0
+            self._mask = PA_SUBSCRIPTION_MASK.NULL
+            self._listeners: weakref.WeakSet = weakref.WeakSet()
+            self._subscribes: deque[Future] = deque()
 
-            self._mainloop = pa_mainloop_new()
+            self.mainloop = pa_threaded_mainloop_new()
 
-            self._context = pa_context_new(
-                pa_mainloop_get_api(self._mainloop), name.encode("utf-8")
+            self.context = pa_context_new(
+                pa_threaded_mainloop_get_api(self.mainloop), name.encode("utf-8")
             )
-            pa_context_connect(self._context, None, 0, None)
+            pa_context_set_state_callback(self.context, _connect_state, self.mainloop)
 
-            connect = CPA.c_int(PA_CONTEXT_STATE.UNCONNECTED)
-            pa_context_set_state_callback(
-                self._context, _connect_state, CPA.pointer(connect)
+            # callback関数のインスタンスは、接続中に解放されないように保持する
+            self._subscribe_callback = PA_CONTEXT_SUBSCRIBE_CB_T(self._on_event)
+            self._subscribed_callback = PA_CONTEXT_SUCCESS_CB_T(self._on_subscribed)
+            pa_context_set_subscribe_callback(
+                self.context, self._subscribe_callback, None
             )
 
-            # サーバー接続の準備完了まで待つ
-            while connect.value in list(PA_CONTEXT_STATE):
-                match connect.value:
-                    # サーバー接続の準備中
-                    case (
-                        PA_CONTEXT_STATE.UNCONNECTED
-                        | PA_CONTEXT_STATE.CONNECTING
-                        | PA_CONTEXT_STATE.AUTHORIZING
-                        | PA_CONTEXT_STATE.SETTING_NAME
-                    ):
-                        pass
-                    # サーバー接続の準備OK
-                    case PA_CONTEXT_STATE.READY:
-                        break
-                    # サーバー接続の失敗
-                    case PA_CONTEXT_STATE.FAILED | PA_CONTEXT_STATE.TERMINATED:
-                        raise
-                pa_mainloop_iterate(self._mainloop, 1, None)
+            try:
+                with self.locked():
+                    pa_context_connect(self.context, None, 0, None)
+                    pa_threaded_mainloop_start(self.mainloop)
+
+                    # サーバー接続の準備完了まで待つ
+                    while True:
+                        match pa_context_get_state(self.context):
+                            # サーバー接続の準備OK
+                            case PA_CONTEXT_STATE.READY:
+                                break
+                            # サーバー接続の失敗
+                            case PA_CONTEXT_STATE.FAILED | PA_CONTEXT_STATE.TERMINATED:
+                                raise PAError(pa_context_get_state(self.context))
+                            # サーバー接続の準備中
+                            case _:
+                                pa_threaded_mainloop_wait(self.mainloop)
+
+            except PAError:
+                # 接続できなかった: mainloopのスレッドとcontextを残さない
+                self._free()
+                raise
+
+            # デフォルトのsink/sourceの名前とインデックスを追跡する
+            self.devices = DeviceRegistry(self)
 
         except PAError as message:
-            raise PAError(f"BasePulseaudio - constructor: {message}")
+            raise PAError(f"PulseaudioConnection - constructor: {message}")
 
         else:
             logger.info("PulseAudio Server に接続")
 
-    def __del__(self):
-        pa_context_disconnect(self._context)
-        pa_context_unref(self._context)
+    def _free(self) -> None:
+        """mainloopを止めて、contextとmainloopを解放する
 
-        pa_mainloop_free(self._mainloop)
+        ロックの外で呼び出す。mainloopを開始する前でもよい。
+        """
 
-        logger.info("PulseAudio Server 接続を解除")
+        pa_threaded_mainloop_stop(self.mainloop)
+        pa_context_disconnect(self.context)
+        pa_context_unref(self.context)
+        pa_threaded_mainloop_free(self.mainloop)
 
+    @classmethod
+    def acquire(cls, name: str = "intercom") -> "PulseaudioConnection":
+        """共有の接続を得る
 
-#### Volumeのクラス
+        :param str name: 最初に接続する際のcontextの名前
+        :return PulseaudioConnection: 共有の接続
+        """
 
+        if cls._instance is None:
+            cls._instance = cls(name)
 
-class VolumePulseaudio(BasePulseaudio):
-    """Volume - Pulseaudio
+        cls._instance._refcount += 1
 
-    sink あるいは source の音量コントロールクラス
+        return cls._instance
 
-    property
-    facility_name(取得のみ): Facilityの名前
-    facility_type(取得のみ): Facilityのタイプ ["SINK", "SOURCE"]
-    value: 音量値
-    """
+    def release(self) -> None:
+        """共有の接続を返す
 
-    def __init__(self, type: Literal["SINK", "SOURCE"], name: str = "VPA"):
-        super().__init__(name)
+        最後の利用者が返した時に、サーバーとの接続を解除する。
+        """
 
-        try:
-            self._type = type
-            self._default_name = self._get_default_name()
+        self._refcount -= 1
+        if self._refcount > 0:
+            return
 
-            self._cvolume = PA_CVOLUME()
-            self._get_cvolume()
+        with self.locked():
+            pa_context_disconnect(self.context)
+            pa_context_unref(self.context)
 
-        except KeyError as message:
-            # typeに"SINK"か"SOURCE"以外を指定した際の例外処理(KeyError)を想定
-            raise KeyError
+        pa_threaded_mainloop_stop(self.mainloop)
+        pa_threaded_mainloop_free(self.mainloop)
 
-        except PAError as message:
-            raise PAError(f"VolumePulseaudio - contructor : {message}")
+        if PulseaudioConnection._instance is self:
+            PulseaudioConnection._instance = None
 
-        else:
-            logger.info(f"{self._type} {self._default_name} 音量コントールを開始")
+        logger.info("PulseAudio Server 接続を解除")
 
-    @property
-    def facility_name(self) -> str:
-        """名前を得る
+    @contextmanager
+    def locked(self):
+        """mainloopをロックする
 
-        :return str: facilityの名前
+        contextの操作は、このロックの中で行う。
+        専用のスレッドで実行されるcallback関数の中では、既にロックされているので
+        何もしない(専用のスレッドでのロックは、libpulseが禁止している)。
         """
 
-        return self._default_name
+        if pa_threaded_mainloop_in_thread(self.mainloop):
+            yield
+            return
 
-    @property
-    def facility_type(self) -> str:
-        """タイプを得る
+        pa_threaded_mainloop_lock(self.mainloop)
+        try:
+            yield
+        finally:
+            pa_threaded_mainloop_unlock(self.mainloop)
 
-        :return str: facilityのタイプ
-        """
+    def subscribe(
+        self, listener: "BasePulseaudio", mask: PA_SUBSCRIPTION_MASK
+    ) -> Future:
+        """リスナーを登録し、サーバーからの変化の通知を購読する
 
-        return self._type
+        購読するFACILITYは、すべてのリスナーのマスクを合わせたものになる。
 
-    @property
-    def value(self) -> int:
-        """音量値を得る
+        :param BasePulseaudio listener: 通知を受け取るリスナー
+        :param PA_SUBSCRIPTION_MASK mask: 通知を受け取るFACILITYのマスク
+        :return Future: 購読の完了
+        """
 
-        PulseAudioの生の音量値( 0 - 65535)を返す
-        多チャンネルでも単一の音量値に纏める
+        future: Future = Future()
 
-        :retrun int: 音量値(0 - 65535)
-        """
+        try:
+            with self.locked():
+                self._listeners.add(listener)
+
+                if (self._mask | mask) == self._mask:
+                    future.set_result(True)
+                    return future
+                self._mask |= mask
+
+                self._subscribes.append(future)
+                pa_operation_unref(
+                    pa_context_subscribe(
+                        self.context, self._mask, self._subscribed_callback, None
+                    )
+                )
 
-        self._get_cvolume()
+        except PAError as message:
+            raise PAError(f"subscribe: {message}")
 
-        return pa_cvolume_avg(CPA.pointer(self._cvolume))
+        else:
+            logger.info(f"PulseAudio Server の通知を購読 {self._mask!r}")
 
-    @value.setter
-    def value(self, value: int) -> None:
-        """音量値を設定する
+        return future
 
-        PulseAudioの生の音量値(0 - 65536)を設定する
-        多チャンネルの場合、すべてのチャンネルに設定する
+    def _on_subscribed(self, context, success, userdata) -> None:
+        """callback関数
 
-        :param int value: 音量値(0 - 65535)
+        購読の完了を通知する
+        | pa_context_subscribe()
         """
 
-        self._set_cvolume(value)
+        future = self._subscribes.popleft()
+        if success:
+            future.set_result(True)
+        else:
+            future.set_exception(PAError("pa_context_subscribe"))
 
-    def _get_cvolume(self) -> None:
-        """現在のPA_CVOLUME構造体オブジェクトを得る
+    def _on_event(self, context, event, index, userdata) -> None:
+        """callback関数
 
-        まずsink情報/source情報構造体オブジェクトを得た後、
-        PA_CVOLUME構造体オブジェクトを抽出しコピーする
+        サーバーからの変化の通知を、すべてのリスナーに配る
+        | pa_context_set_subscribe_callback()
         """
 
-        @PA_SINK_INFO_CB_T
-        def sink_info(context, info, eol, userdata) -> None:
-            """callback関数
+        facility = PA_SUBSCRIPTION_EVENT(event & PA_SUBSCRIPTION_EVENT.FACILITY_MASK)
+        event_type = PA_SUBSCRIPTION_EVENT(event & PA_SUBSCRIPTION_EVENT.TYPE_MASK)
 
-            sink情報から現在のPA_CVOLUME構造体オブジェクトを得る
-            | pa_context_get_sink_info_by_name()
+        for listener in list(self._listeners):
+            listener._on_event(facility, event_type, index)
 
-            :param pa_context *context: 対象のcontext
-            :param pa_sink_info *info: sink情報
-            :param int eol: リスト終端判定値、0ならリスト内か単一のオブジェクトを取得
-            :param void *userdata: ****
-            """
 
-            if eol == 0:
-                cast_info = CPA.cast(info, CPA.POINTER(PA_SINK_INFO)).contents
-                cast_userdata = CPA.cast(userdata, CPA.POINTER(PA_CVOLUME)).contents
+#### 基本のPulseAudioクラス
 
-                cast_userdata.channels = cast_info.volume.channels
-                for ci in range(cast_info.volume.channels):
-                    cast_userdata.values[ci] = cast_info.volume.values[ci]
 
-        @PA_SOURCE_INFO_CB_T
-        def source_info(context, info, eol, userdata) -> None:
-            """callback関数
+class BasePulseaudio:
+    """基本のPulseAudioクラス
 
-            source情報から現在のPA_CVOLUME構造体オブジェクトを得る
-            | pa_context_get_source_info_by_name()
+    コンストラクタ: 共有のPulseAudioサーバーとの接続を得る
+    デストラクタ: 共有のPulseAudioサーバーとの接続を返す
+    """
 
-            :param pa_context *context: 対象のcontext
-            :param pa_source_info *info: source情報
-            :param int eol: リスト終端判定値、0ならリスト内か単一のオブジェクトを取得
-            :param void *userdata: ****
-            """
+    def __init__(self, name: str):
+        try:
+            self._connection = PulseaudioConnection.acquire(name)
+            self._context = self._connection.context
 
-            if eol == 0:
-                cast_info = CPA.cast(info, CPA.POINTER(PA_SOURCE_INFO)).contents
-                cast_userdata = CPA.cast(userdata, CPA.POINTER(PA_CVOLUME)).contents
+        except PAError as message:
+            raise PAError(f"BasePulseaudio - constructor: {message}")
 
-                cast_userdata.channels = cast_info.volume.channels
-                for ci in range(cast_info.volume.channels):
-                    cast_userdata.values[ci] = cast_info.volume.values[ci]
+    def __del__(self):
+        if hasattr(self, "_connection"):
+            self._connection.release()
 
-        try:
-            func = {
-                "SINK": pa_context_get_sink_info_by_name,
-                "SOURCE": pa_context_get_source_info_by_name,
-            }
-            callback = {"SINK": sink_info, "SOURCE": source_info}
+    def subscribe(self, mask: PA_SUBSCRIPTION_MASK) -> Future:
+        """サーバーからの変化の通知を購読する
 
-            operation = func[self._type](
-                self._context,
-                self._default_name,
-                callback[self._type],
-                CPA.pointer(self._cvolume),
-            )
+        通知は専用のスレッドで _on_event() へ渡される。
 
-            while pa_operation_get_state(operation) != PA_OPERATION_STATE.DONE:
-                pa_mainloop_iterate(self._mainloop, 1, None)
+        :param PA_SUBSCRIPTION_MASK mask: 通知を受け取るFACILITYのマスク
+        :return Future: 購読の完了
+        """
 
-            pa_operation_unref(operation)
+        return self._connection.subscribe(self, mask)
 
-        except PAError as message:
-            raise PAError(f"_get_cvolume: {message}")
+    def _on_event(
+        self,
+        facility: PA_SUBSCRIPTION_EVENT,
+        event_type: PA_SUBSCRIPTION_EVENT,
+        index: int,
+    ) -> None:
+        """サーバーからの変化の通知：サブクラスで実装
 
-    def _set_cvolume(self, value: int) -> None:
-        """現在のPA_CVOLUME構造体オブジェクトを設定する"""
+        専用のスレッドで、mainloopをロックした状態で呼び出される。
 
-        try:
-            func = {
-                "SINK": pa_context_set_sink_volume_by_name,
-                "SOURCE": pa_context_set_source_volume_by_name,
-            }
-            success = CPA.c_int(-1)
+        :param PA_SUBSCRIPTION_EVENT facility: 変化したFACILITY
+        :param PA_SUBSCRIPTION_EVENT event_type: NEW, CHANGE, REMOVE のいずれか
+        :param int index: 変化したFACILITYのインデックス
+        """
 
-            operation = func[self._type](
-                self._context,
-                self._default_name,
-                pa_cvolume_set(
-                    CPA.pointer(self._cvolume),
-                    self._cvolume.channels,
-                    PA_VOLUME_T(value),
-                ),
-                _success_state,
-                CPA.pointer(success),
+        pass
+
+
+#### デバイスの登録簿
+
+
+class DeviceRegistry:
+    """デフォルトのsink/sourceの登録簿
+
+    デフォルトのsink/sourceの名前とインデックスを保持し、
+    SERVER, SINK, SOURCE の変化の通知を受けて追跡する。
+    USBスピーカーフォンの抜き差しやデフォルトの変更があれば、
+    名前とインデックスを取得し直し、登録しているウォッチャーに新しい
+    名前とインデックスを渡す。変化が無い間は、サーバー情報を問い合わせない。
+
+    ウォッチャーは、_type 属性("SINK" か "SOURCE")と
+    _on_device(name, index) メソッドを持つこと。
+    _on_device() は、PulseAudioの専用のスレッドで、mainloopをロックした状態で呼び出される。
+    """
+
+    def __init__(self, connection: PulseaudioConnection):
+        try:
+            self._connection = connection
+            self._context = connection.context
+
+            self._names: dict[str, bytes | None] = {"SINK": None, "SOURCE": None}
+            self._indexes = {"SINK": PA_INVALID_INDEX, "SOURCE": PA_INVALID_INDEX}
+            self._watchers: weakref.WeakSet = weakref.WeakSet()
+
+            # 取得し直しの1回分ごとに [残りの取得数, Future] を先入れ先出しで扱う
+            self._rounds: deque[list] = deque()
+            self._candidates: dict[str, tuple[bytes | None, int]] = {}
+
+            # callback関数のインスタンスは、登録簿が解放されるまで保持する
+            self._sink_info_callback = PA_SINK_INFO_CB_T(
+                lambda context, info, eol, userdata: self._on_info(
+                    "SINK", PA_SINK_INFO, info, eol
+                )
+            )
+            self._source_info_callback = PA_SOURCE_INFO_CB_T(
+                lambda context, info, eol, userdata: self._on_info(
+                    "SOURCE", PA_SOURCE_INFO, info, eol
+                )
             )
-            while pa_operation_get_state(operation) != PA_OPERATION_STATE.DONE:
-                pa_mainloop_iterate(self._mainloop, 1, None)
 
-            pa_operation_unref(operation)
+            subscribed = connection.subscribe(
+                self,
+                PA_SUBSCRIPTION_MASK.SERVER
+                | PA_SUBSCRIPTION_MASK.SINK
+                | PA_SUBSCRIPTION_MASK.SOURCE,
+            )
+            _wait(subscribed)
+            _wait(self.refresh())
 
         except PAError as message:
-            raise PAError(f"_set_cvolume: {message}")
+            raise PAError(f"DeviceRegistry - constructor: {message}")
+
+    def default(self, type: Literal["SINK", "SOURCE"]) -> tuple[bytes | None, int]:
+        """デフォルトのsink/sourceを得る
 
-    def _get_default_name(self) -> str:
-        """default_nameを得る
+        :param str type: "SINK" か "SOURCE"
+        :return tuple: 名前とインデックス(無ければ PA_INVALID_INDEX)
+        """
+
+        return self._names[type], self._indexes[type]
 
-        server情報からsinkあるいはsourceのデフォルトの名前を得る
+    def watch(self, watcher: Any) -> None:
+        """デフォルトのsink/sourceの変化を受け取るウォッチャーを登録する
 
-        :return str: "SINK": default_sink_name, "SOURCE": default_source_name
+        :param Any watcher: ウォッチャー(VolumePulseaudioなど)
         """
 
-        @PA_SERVER_INFO_CB_T
-        def server_info(context, info, userdata) -> None:
-            """callback関数
+        self._watchers.add(watcher)
+
+    def refresh(self) -> Future:
+        """デフォルトのsink/sourceの名前とインデックスを取得し直す
+
+        サーバー情報は問い合わせず、特別な名前 "@DEFAULT_SINK@", "@DEFAULT_SOURCE@" で
+        デフォルトのsink情報/source情報を直接取得する。
 
-            pa_context_get_server_info()で登録
-            PA_SERVER_INFO構造体オブジェクト(server情報)からdefault_sinke_nameをuserdataに渡す
+        :return Future: 取得し直しの完了
+        """
 
-            :param pa_context *context: 対象のcontext
-            :param pa_server_info *info: server情報
-            :param void *userdata: ****
-            """
-            cast_info = CPA.cast(info, CPA.POINTER(PA_SERVER_INFO)).contents
-            cast_userdata = CPA.cast(userdata, CPA.c_char_p)
+        future: Future = Future()
 
-            type = cast_userdata.value
-            match type:
-                case b"sink":
-                    CPA.memmove(
-                        cast_userdata,
-                        cast_info.default_sink_name,
-                        len(cast_info.default_sink_name),
+        try:
+            with self._connection.locked():
+                self._rounds.append([2, future])
+                pa_operation_unref(
+                    pa_context_get_sink_info_by_name(
+                        self._context, b"@DEFAULT_SINK@", self._sink_info_callback, None
                     )
-                case b"source":
-                    CPA.memmove(
-                        cast_userdata,
-                        cast_info.default_source_name,
-                        len(cast_info.default_source_name),
+                )
+                pa_operation_unref(
+                    pa_context_get_source_info_by_name(
+                        self._context,
+                        b"@DEFAULT_SOURCE@",
+                        self._source_info_callback,
+                        None,
                     )
+                )
 
-        try:
-            default_name_type = {"SINK": b"sink", "SOURCE": b"source"}
+        except PAError as message:
+            raise PAError(f"DeviceRegistry - refresh: {message}")
 
-            # サイズ不明の文字列データは、余裕を持った大きめのバッファを確保
-            default_name = CPA.create_string_buffer(default_name_type[self._type], 512)
+        return future
 
-            operation = pa_context_get_server_info(
-                self._context, server_info, default_name
-            )
+    def _on_event(
+        self,
+        facility: PA_SUBSCRIPTION_EVENT,
+        event_type: PA_SUBSCRIPTION_EVENT,
+        index: int,
+    ) -> None:
+        """サーバーからの変化の通知
 
-            while pa_operation_get_state(operation) != PA_OPERATION_STATE.DONE:
-                pa_mainloop_iterate(self._mainloop, 1, None)
+        デフォルトの変更(SERVER)と、sink/sourceの追加・削除の時だけ取得し直す。
+        音量などの変更(SINK/SOURCE の CHANGE)では何もしない。
+        """
 
-            pa_operation_unref(operation)
+        match facility, event_type:
+            case PA_SUBSCRIPTION_EVENT.SERVER, _:
+                self.refresh()
+            case (
+                PA_SUBSCRIPTION_EVENT.SINK | PA_SUBSCRIPTION_EVENT.SOURCE,
+                PA_SUBSCRIPTION_EVENT.NEW | PA_SUBSCRIPTION_EVENT.REMOVE,
+            ):
+                self.refresh()
+            case _:
+                pass
+
+    def _on_info(self, type: str, info_type: Any, info: int, eol: int) -> None:
+        """sink情報/source情報から名前とインデックスを得る
+
+        デフォルトが無い(抜かれた)場合は、eolが負数で呼び出される。
+
+        :param str type: "SINK" か "SOURCE"
+        :param Any info_type: PA_SINK_INFO か PA_SOURCE_INFO
+        :param int info: 情報の構造体のアドレス
+        :param int eol: リスト終端判定値、0ならリスト内か単一のオブジェクトを取得
+        """
 
-            return default_name.value
+        if eol == 0:
+            cast_info = CPA.cast(info, CPA.POINTER(info_type)).contents
+            self._candidates[type] = (cast_info.name, cast_info.index)
+            return
 
-        except PAError as message:
-            raise PAError(f"_get_default_name: {message}")
+        name, index = self._candidates.pop(type, (None, PA_INVALID_INDEX))
+        self._update(type, name, index)
+
+    def _update(self, type: str, name: bytes | None, index: int) -> None:
+        """名前とインデックスを更新し、変化していればウォッチャーに渡す
+
+        :param str type: "SINK" か "SOURCE"
+        :param bytes name: 名前
+        :param int index: インデックス(見つからなければ PA_INVALID_INDEX)
+        """
+
+        if (self._names[type], self._indexes[type]) != (name, index):
+            self._names[type] = name
+            self._indexes[type] = index
+            logger.info(f"{type} {name} (index {index}) をデフォルトとして追跡")
+
+            for watcher in list(self._watchers):
+                if watcher._type == type:
+                    watcher._on_device(name, index)
+
+        round = self._rounds[0]
+        round[0] -= 1
+        if round[0] == 0:
+            self._rounds.popleft()
+            round[1].set_result(True)
+
+
+#### Volumeのクラス
+
+# 音量値の変化の発生元
+VolumeOrigin = Literal["SERVER", "LOCAL"]
+
+# 音量値の読み書きのたびにctypesのcallback関数や構造体を作らないように、
+# callback関数はモジュールで1つずつだけ作り、userdataのハンドルでインスタンスを識別する。
+_volumes: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_volume_handles = itertools.count(1)
+
+_CVOLUME_SIZE = CPA.sizeof(PA_CVOLUME)
+
+
+@PA_SINK_INFO_CB_T
+def _sink_volume_info(context, info, eol, userdata):
+    """callback関数
+
+    sink情報をuserdataのハンドルが示すVolumePulseaudioに渡す
+    | pa_context_get_sink_info_by_index()
+
+    :param pa_context *context: 対象のcontext
+    :param pa_sink_info *info: sink情報
+    :param int eol: リスト終端判定値、0ならリスト内か単一のオブジェクトを取得
+    :param void *userdata: VolumePulseaudioのハンドル
+    """
+
+    volume = _volumes.get(userdata)
+    if volume is not None:
+        volume._on_info(info, eol)
+
+
+@PA_SOURCE_INFO_CB_T
+def _source_volume_info(context, info, eol, userdata):
+    """callback関数
+
+    source情報をuserdataのハンドルが示すVolumePulseaudioに渡す
+    | pa_context_get_source_info_by_index()
+
+    :param pa_context *context: 対象のcontext
+    :param pa_source_info *info: source情報
+    :param int eol: リスト終端判定値、0ならリスト内か単一のオブジェクトを取得
+    :param void *userdata: VolumePulseaudioのハンドル
+    """
+
+    volume = _volumes.get(userdata)
+    if volume is not None:
+        volume._on_info(info, eol)
+
+
+@PA_CONTEXT_SUCCESS_CB_T
+def _volume_success(context, success, userdata):
+    """callback関数
+
+    音量値の設定の完了をuserdataのハンドルが示すVolumePulseaudioに渡す
+    | pa_context_set_sink_volume_by_index()
+    | pa_context_set_source_volume_by_index()
+
+    :param pa_context *context: 対象のcontext
+    :param int success: 1の時に正常終了、0なら異常終了
+    :param void *userdata: VolumePulseaudioのハンドル
+    """
+
+    volume = _volumes.get(userdata)
+    if volume is not None:
+        volume._on_success(success)
+
+
+class VolumePulseaudio(BasePulseaudio):
+    """Volume - Pulseaudio
+
+    sink あるいは source の音量コントロールクラス
+
+    property
+    facility_name(取得のみ): Facilityの名前
+    facility_type(取得のみ): Facilityのタイプ ["SINK", "SOURCE"]
+    value: 音量値
+
+    音量値の取得 get_value() と設定 set_value() は、完了を待たずにFutureを返す。
+    subscribe() で購読モードにすると、サーバーからの変化の通知があった時だけ
+    音量値を取得し直し、登録したcallback関数に新しい音量値を渡す。
+    購読モードでの value の取得は、サーバーとの往復通信を伴わない。
+    callback関数とFutureの完了は、PulseAudioの専用のスレッドで実行される。
+
+    読み書きの処理は、コンストラクタで選んだsink用あるいはsource用のAPIと、
+    確保済みの構造体だけを使う。value の取得(購読モード)と設定では、
+    ctypesのオブジェクトもFutureも作らない。
+
+    操作対象は、DeviceRegistry が追跡するデフォルトのsink/sourceで、
+    名前ではなくインデックスで操作する。USBスピーカーフォンを抜き差ししたり
+    デフォルトを変更したりすると、自動的に新しいデフォルトを操作対象にする。
+    操作対象が無い間に設定した音量値は、操作対象が見つかった時に設定する。
+    """
+
+    def __init__(self, type: Literal["SINK", "SOURCE"], name: str = "VPA"):
+        super().__init__(name)
+
+        try:
+            self._type = type
+
+            # sink用あるいはsource用のAPIを選ぶ
+            info_type = {"SINK": PA_SINK_INFO, "SOURCE": PA_SOURCE_INFO}[type]
+            self._get_info_by_index = {
+                "SINK": pa_context_get_sink_info_by_index,
+                "SOURCE": pa_context_get_source_info_by_index,
+            }[type]
+            self._set_volume_by_index = {
+                "SINK": pa_context_set_sink_volume_by_index,
+                "SOURCE": pa_context_set_source_volume_by_index,
+            }[type]
+            self._info_callback = {
+                "SINK": _sink_volume_info,
+                "SOURCE": _source_volume_info,
+            }[type]
+            self._volume_offset = info_type.volume.offset
+
+            # 読み書きで使う構造体とポインターは、ここで確保しておく
+            self._cvolume = PA_CVOLUME()
+            self._cvolume_pointer = CPA.pointer(self._cvolume)
+            self._cvolume_address = CPA.addressof(self._cvolume)
+            self._mainloop = self._connection.mainloop
+
+            # 操作対象のデフォルトのsink/source
+            name, index = self._connection.devices.default(type)
+            self._default_name = name
+            self._index = CPA.c_uint32(index)
+
+            self._value = 0
+            # 最後にサーバーで確認した音量値(callback関数は、これと違う時だけ呼び出す)
+            self._applied = 0
+            self._callback: Callable[[int, VolumeOrigin], None] | None = None
+
+            # 要求した順に完了するので、完了待ちのFutureは先入れ先出しで扱う
+            self._gets: deque[Future | None] = deque()
+
+            # 書き込みキュー: 未送信の音量値は最新の1つだけ残し、送信中は1つまで
+            self._pending: int | None = None
+            self._written = 0
+            self._inflight = False
+            self._writes: list[Future] = []
+            self._write_count = 0
+            # 操作対象を変えた時の取得: 完了してチャンネル数が分かるまで書き込まない
+            self._device_get: Future | None = None
+
+            # モジュールのcallback関数からインスタンスを識別するハンドル
+            self._handle = next(_volume_handles)
+            _volumes[self._handle] = self
+
+            self._connection.devices.watch(self)
+            _wait(self.get_value())
+
+        except KeyError as message:
+            # typeに"SINK"か"SOURCE"以外を指定した際の例外処理(KeyError)を想定
+            raise KeyError
+
+        except PAError as message:
+            raise PAError(f"VolumePulseaudio - contructor : {message}")
+
+        else:
+            logger.info(f"{self._type} {self._default_name} 音量コントールを開始")
+
+    @property
+    def facility_name(self) -> bytes | None:
+        """名前を得る
+
+        :return bytes: facilityの名前(VolumeBatch のキーと同じ)、無ければ None
+        """
+
+        return self._default_name
+
+    @property
+    def facility_type(self) -> str:
+        """タイプを得る
+
+        :return str: facilityのタイプ
+        """
+
+        return self._type
+
+    @property
+    def value(self) -> int:
+        """音量値を得る
+
+        PulseAudioの生の音量値( 0 - 65535)を返す
+        多チャンネルでも単一の音量値に纏める
+
+        購読モードでは、通知のたびに更新している音量値をそのまま返す。
+        購読モードでなければ、取得の完了まで待つ(PA_TIMEOUT 秒で PAError)。
+        ただし、PulseAudioの専用のスレッド(callback関数)では完了を待てない
+        (デッドロックする)ので、最後に得た音量値を返す。
+
+        :retrun int: 音量値(0 - 65535)
+        """
+
+        if self._callback is None:
+            if pa_threaded_mainloop_in_thread(self._mainloop):
+                return self._value
+            return _wait(self.get_value())
+
+        return self._value
+
+    @value.setter
+    def value(self, value: int) -> None:
+        """音量値を設定する
+
+        PulseAudioの生の音量値(0 - 65536)を設定する
+        多チャンネルの場合、すべてのチャンネルに設定する
+        設定の完了は待たない。
+
+        :param int value: 音量値(0 - 65535)
+        """
+
+        self._enqueue(int(value), None)
+
+    def get_value(self) -> Future:
+        """音量値の取得を要求する
+
+        :return Future: 音量値(0 - 65535)
+        """
+
+        future: Future = Future()
+        self._request_cvolume(future)
+
+        return future
+
+    def set_value(self, value: int) -> Future:
+        """音量値の設定を要求する
+
+        書き込みは遅延して纏める(write-behind)。送信中の書き込みがあれば、
+        未送信の音量値を最新のものに置き換えるだけで、サーバーへの送信は
+        送信中の書き込みが完了してから行う。
+        スライダーのドラッグのように連続して呼び出しても、送信するのは数回で済む。
+
+        :param int value: 音量値(0 - 65535)
+        :return Future: 書き込みキューが空になった時点で、最終的に設定された音量値
+        """
+
+        future: Future = Future()
+        self._enqueue(int(value), future)
+
+        return future
+
+    def subscribe(self, callback: Callable[[int, VolumeOrigin], None]) -> Future:
+        """購読モードを開始する
+
+        sink あるいは source の変化の通知があった時だけ音量値を取得し直し、
+        callback関数に新しい音量値と変化の発生元を渡す。
+          "SERVER": 他のアプリケーションなど、サーバー側で変化した
+          "LOCAL": set_value() で設定した音量値が、サーバーに反映された
+        音量値が変化していなければ、callback関数は呼び出さない。
+        callback関数はPulseAudioの専用のスレッドで呼び出されるので、
+        UIを操作する場合はUIスレッドに処理を渡すこと。
+
+        :param Callable callback: 新しい音量値(0 - 65535)と発生元を受け取る関数
+        :return Future: 購読の完了
+        """
+
+        mask = {
+            "SINK": PA_SUBSCRIPTION_MASK.SINK,
+            "SOURCE": PA_SUBSCRIPTION_MASK.SOURCE,
+        }
+
+        self._callback = callback
+        return super().subscribe(mask[self._type])
+
+    def _enqueue(self, value: int, future: Future | None) -> None:
+        """書き込みキューに音量値を入れる
+
+        :param int value: 音量値(0 - 65535)
+        :param Future future: 書き込みキューが空になった時に完了を通知するFuture
+        """
+
+        # 専用のスレッド(callback関数やタイマー)からの呼び出しでは、既にロックされている
+        in_thread = pa_threaded_mainloop_in_thread(self._mainloop)
+        if not in_thread:
+            pa_threaded_mainloop_lock(self._mainloop)
+        try:
+            if future is not None:
+                self._writes.append(future)
+            self._value = value
+            self._pending = value
+            if not self._inflight:
+                self._write_pending()
+
+        except PAError as message:
+            raise PAError(f"set_value: {message}")
+
+        finally:
+            if not in_thread:
+                pa_threaded_mainloop_unlock(self._mainloop)
+
+    def _write_pending(self) -> None:
+        """未送信の音量値をサーバーへ送信する
+
+        mainloopをロックした状態で呼び出すこと。
+        操作対象が無い間と、新しい操作対象のチャンネル数が分かるまでは、
+        未送信のまま残す。
+        """
+
+        if self._index.value == PA_INVALID_INDEX or self._device_get is not None:
+            return
+
+        self._written, self._pending = self._pending, None
+        self._inflight = True
+        self._write_count += 1
+
+        pa_operation_unref(
+            self._set_volume_by_index(
+                self._context,
+                self._index,
+                pa_cvolume_set(
+                    self._cvolume_pointer, self._cvolume.channels, self._written
+                ),
+                _volume_success,
+                self._handle,
+            )
+        )
+
+    def _request_cvolume(self, future: Future | None) -> None:
+        """sink情報/source情報の取得を要求する
+
+        操作対象が無い間は、取得できないことをFutureに通知する。
+
+        :param Future future: 取得の完了を通知するFuture
+        """
+
+        in_thread = pa_threaded_mainloop_in_thread(self._mainloop)
+        if not in_thread:
+            pa_threaded_mainloop_lock(self._mainloop)
+        try:
+            if self._index.value == PA_INVALID_INDEX:
+                if future is not None:
+                    future.set_exception(PAError(f"{self._type} が見つからない"))
+                return
+
+            self._gets.append(future)
+            pa_operation_unref(
+                self._get_info_by_index(
+                    self._context,
+                    self._index,
+                    self._info_callback,
+                    self._handle,
+                )
+            )
+
+        except PAError as message:
+            raise PAError(f"get_value: {message}")
+
+        finally:
+            if not in_thread:
+                pa_threaded_mainloop_unlock(self._mainloop)
+
+    def _on_device(self, name: bytes | None, index: int) -> None:
+        """操作対象のデフォルトのsink/sourceの変化
+
+        DeviceRegistry から、PulseAudioの専用のスレッドで呼び出される。
+        新しい操作対象の音量値を取得し直す。未送信の音量値は、取得が完了して
+        新しい操作対象のチャンネル数が分かってから、_on_info() で送信する。
+
+        :param bytes name: 新しい名前
+        :param int index: 新しいインデックス(無ければ PA_INVALID_INDEX)
+        """
+
+        self._default_name = name
+        self._index.value = index
+
+        logger.info(f"{self._type} {name} を操作対象に変更")
+
+        if index == PA_INVALID_INDEX:
+            self._device_get = None
+            return
+
+        self._device_get = Future()
+        self._request_cvolume(self._device_get)
+
+    def _on_event(
+        self,
+        facility: PA_SUBSCRIPTION_EVENT,
+        event_type: PA_SUBSCRIPTION_EVENT,
+        index: int,
+    ) -> None:
+        """サーバーからの変化の通知
+
+        操作対象のFACILITYが変化した時だけ、完了を待たずに音量値の取得を要求する。
+        取得した音量値は、_on_info() でcallback関数に渡される。
+        """
+
+        if index != self._index.value or event_type != PA_SUBSCRIPTION_EVENT.CHANGE:
+            return
+
+        self._request_cvolume(None)
+
+    def _on_info(self, info: int, eol: int) -> None:
+        """sink情報/source情報からPA_CVOLUME構造体オブジェクトを抽出しコピーする
+
+        リスト終端で取得の完了をFutureに通知し、音量値が変化していれば
+        発生元を"SERVER"としてcallback関数に渡す。
+        書き込みキューが空でない間は、設定中の音量値を正とし、
+        自分の書き込みによる途中の音量値を"SERVER"の変化として扱わない。
+
+        :param int info: PA_SINK_INFO あるいは PA_SOURCE_INFO 構造体のアドレス
+        :param int eol: リスト終端判定値、0ならリスト内か単一のオブジェクトを取得
+        """
+
+        if eol == 0:
+            # 構造体オブジェクトを作らずに、確保済みの構造体へ直接コピーする
+            CPA.memmove(
+                self._cvolume_address, info + self._volume_offset, _CVOLUME_SIZE
+            )
+            return
+
+        future = self._gets.popleft()
+        if future is not None and future is self._device_get:
+            # 新しい操作対象のチャンネル数が分かったので、未送信の音量値を送信する
+            self._device_get = None
+            if eol > 0 and self._pending is not None and not self._inflight:
+                self._write_pending()
+
+        if eol < 0:
+            if future is not None:
+                future.set_exception(PAError(f"{self._type} {self._default_name}"))
+            return
+
+        if self._inflight:
+            if future is not None:
+                future.set_result(self._value)
+            return
+
+        previous, self._applied = self._applied, pa_cvolume_avg(self._cvolume_pointer)
+        self._value = self._applied
+        if future is not None:
+            future.set_result(self._value)
+
+        if self._callback is not None and self._value != previous:
+            self._callback(self._value, "SERVER")
+
+    def _on_success(self, success: int) -> None:
+        """音量値の設定の完了
+
+        送信中の書き込みが完了したら、未送信の音量値があれば続けて送信する。
+        書き込みキューが空になったら、最終的に設定された音量値をFutureに通知し、
+        音量値が変化していれば発生元を"LOCAL"としてcallback関数に渡す。
+        """
+
+        self._inflight = False
+
+        if not success:
+            self._pending = None
+            writes, self._writes = self._writes, []
+            for future in writes:
+                future.set_exception(PAError(f"{self._type} {self._default_name}"))
+            return
+
+        if self._pending is not None:
+            self._write_pending()
+            return
+
+        previous, self._applied = self._applied, self._written
+        if self._callback is not None and self._written != previous:
+            self._callback(self._written, "LOCAL")
+
+        if self._writes:
+            writes, self._writes = self._writes, []
+            for future in writes:
+                future.set_result(self._written)
+
+
+#### レベルメーターのクラス
+
+
+class LevelMeterPulseaudio(BasePulseaudio):
+    """Level meter - Pulseaudio
+
+    マイク(source)あるいはスピーカー(sinkのモニター)の音量レベルを測るクラス
+
+    PA_STREAM_PEAK_DETECT を指定した低いサンプルレートの録音ストリームを使い、
+    ピーク検出はサーバーに任せる。届いたピーク値をNumPyでピーク値とRMS値に纏め、
+    callback関数に渡す。
+    CPU負荷を抑えるため、1回の読み出しで fragment 個のサンプルを受け取り、
+    さらに decimation 回分を纏めてから callback関数を呼び出す。
+
+    デフォルトのsink/sourceが変わったり抜かれたりしたら、DeviceRegistry の通知で
+    録音ストリームを新しいデフォルトに開き直す。
+
+    callback関数は、PulseAudioの専用のスレッドで呼び出される。
+    """
+
+    def __init__(
+        self,
+        type: Literal["SINK", "SOURCE"],
+        name: str = "LPA",
+        rate: int = 25,
+        fragment: int = 5,
+        decimation: int = 1,
+    ):
+        """
+        :param str type: "SOURCE" ならデフォルトのsource、"SINK" ならデフォルトのsinkのモニター
+        :param str name: ストリームの名前
+        :param int rate: ピーク値のサンプルレート(Hz)
+        :param int fragment: 1回の読み出しで受け取るサンプル数
+        :param int decimation: callback関数を呼び出すまでに纏める読み出し回数
+        """
+
+        if np is None:
+            raise ImportError("LevelMeterPulseaudio には NumPy が必要")
+
+        super().__init__(name)
+
+        try:
+            self._type = type
+            self._device = {
+                "SINK": b"@DEFAULT_MONITOR@",
+                "SOURCE": b"@DEFAULT_SOURCE@",
+            }[type]
+            self._name = name.encode("utf-8")
+
+            self._sample_spec = PA_SAMPLE_SPEC(PA_SAMPLE_FORMAT.FLOAT32LE, rate, 1)
+            self._buffer_attr = PA_BUFFER_ATTR(
+                maxlength=0xFFFFFFFF,
+                tlength=0xFFFFFFFF,
+                prebuf=0xFFFFFFFF,
+                minreq=0xFFFFFFFF,
+                fragsize=fragment * np.dtype(np.float32).itemsize,
+            )
+            self._decimation = decimation
+
+            # 読み出しで使う変数とバッファは、ここで確保しておく
+            # (1回の読み出しで fragment 個を超えて届いても、バッファの大きさずつ纏める)
+            self._data = CPA.c_void_p()
+            self._nbytes = CPA.c_size_t()
+            self._buffer = np.zeros(fragment * 4, dtype=np.float32)
+            self._buffer_address = self._buffer.ctypes.data
+            self._peak = 0.0
+            self._sum_squares = 0.0
+            self._samples = 0
+            self._reads = 0
+
+            self._stream: int | None = None
+            self._callback: Callable[[float, float], None] | None = None
+
+            # callback関数のインスタンスは、ストリームが解放されるまで保持する
+            self._read_callback = PA_STREAM_REQUEST_CB_T(self._on_read)
+
+            self._connection.devices.watch(self)
+
+        except KeyError as message:
+            # typeに"SINK"か"SOURCE"以外を指定した際の例外処理(KeyError)を想定
+            raise KeyError
+
+    def __del__(self):
+        self.stop()
+        super().__del__()
+
+    @property
+    def active(self) -> bool:
+        """測定中かどうか
+
+        デフォルトのsink/sourceが無い間も、測定中のままで次のデフォルトを待つ。
+
+        :return bool: 測定中ならTrue
+        """
+
+        return self._callback is not None
+
+    def start(self, callback: Callable[[float, float], None]) -> None:
+        """測定を開始する
+
+        :param Callable callback: ピーク値とRMS値(どちらも 0.0 - 1.0)を受け取る関数
+        """
+
+        if self._callback is not None:
+            return
+
+        try:
+            with self._connection.locked():
+                self._callback = callback
+                _, index = self._connection.devices.default(self._type)
+                if index != PA_INVALID_INDEX:
+                    self._open()
+
+        except PAError as message:
+            self._callback = None
+            raise PAError(f"LevelMeterPulseaudio - start: {message}")
+
+        else:
+            logger.info(f"{self._type} のレベル測定を開始")
+
+    def stop(self) -> None:
+        """測定を終了する"""
+
+        if getattr(self, "_callback", None) is None:
+            return
+
+        with self._connection.locked():
+            self._close()
+            self._callback = None
+
+        logger.info(f"{self._type} のレベル測定を終了")
+
+    def _open(self) -> None:
+        """デフォルトのsink/sourceの録音ストリームを開く
+
+        mainloopをロックした状態で呼び出すこと。
+        デフォルトが変われば開き直すので、DONT_MOVE は指定しない。
+        """
+
+        self._stream = pa_stream_new(
+            self._context, self._name, CPA.byref(self._sample_spec), None
+        )
+        pa_stream_set_read_callback(self._stream, self._read_callback, None)
+        pa_stream_connect_record(
+            self._stream,
+            self._device,
+            CPA.byref(self._buffer_attr),
+            PA_STREAM_FLAGS.PEAK_DETECT | PA_STREAM_FLAGS.ADJUST_LATENCY,
+        )
+
+    def _close(self) -> None:
+        """録音ストリームを閉じる
+
+        mainloopをロックした状態で呼び出すこと。
+        """
+
+        if self._stream is None:
+            return
+
+        pa_stream_set_read_callback(self._stream, PA_STREAM_REQUEST_CB_T(), None)
+        try:
+            pa_stream_disconnect(self._stream)
+        except PAError:
+            # 抜かれたsink/sourceのストリームは、既に切断されている
+            pass
+        pa_stream_unref(self._stream)
+        self._stream = None
+
+    def _on_device(self, name: bytes | None, index: int) -> None:
+        """操作対象のデフォルトのsink/sourceの変化
+
+        DeviceRegistry から、PulseAudioの専用のスレッドで呼び出される。
+        測定中なら、録音ストリームを新しいデフォルトに開き直す。
+
+        :param bytes name: 新しい名前
+        :param int index: 新しいインデックス(無ければ PA_INVALID_INDEX)
+        """
+
+        if self._callback is None:
+            return
+
+        self._close()
+        if index == PA_INVALID_INDEX:
+            return
+
+        try:
+            self._open()
+        except PAError as message:
+            logger.warning(f"{self._type} {name} のレベル測定を開始できない: {message}")
+            self._close()
+        else:
+            logger.info(f"{self._type} {name} のレベル測定に変更")
+
+    def _on_read(self, stream, nbytes, userdata) -> None:
+        """callback関数
+
+        録音バッファのピーク値を確保済みのバッファに読み出して纏め、
+        decimation 回ごとにcallback関数にピーク値とRMS値を渡す
+        | pa_stream_set_read_callback()
+        """
+
+        while True:
+            pa_stream_peek(stream, CPA.byref(self._data), CPA.byref(self._nbytes))
+            if self._nbytes.value == 0:
+                break
+
+            # data が NULL の場合は欠落(hole)なので、捨てるだけ
+            address, remaining = self._data.value, self._nbytes.value
+            while address and remaining:
+                size = min(remaining, self._buffer.nbytes)
+                CPA.memmove(self._buffer_address, address, size)
+                samples = self._buffer[: size // self._buffer.itemsize]
+                self._peak = max(
+                    self._peak, float(samples.max()), -float(samples.min())
+                )
+                self._sum_squares += float(np.dot(samples, samples))
+                self._samples += samples.size
+                address += size
+                remaining -= size
+
+            pa_stream_drop(stream)
+
+        self._reads += 1
+        if self._reads < self._decimation or self._samples == 0:
+            return
+
+        peak = min(self._peak, 1.0)
+        rms = min(float(np.sqrt(self._sum_squares / self._samples)), 1.0)
+        self._peak = 0.0
+        self._sum_squares = 0.0
+        self._samples = 0
+        self._reads = 0
+
+        if self._callback is not None:
+            self._callback(peak, rms)
+
+
+#### 音量値のランプ(フェード、ダッキング)のクラス
+
+# タイマーイベントのたびにctypesのcallback関数を作らないように、
+# callback関数はモジュールで1つだけ作り、userdataのハンドルでインスタンスを識別する。
+_ramps: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_ramp_handles = itertools.count(1)
+
+
+@PA_TIME_EVENT_CB_T
+def _ramp_tick(api, event, tv, userdata):
+    """callback関数
+
+    タイマーイベントをuserdataのハンドルが示すVolumeRampに渡す
+    | pa_mainloop_api.time_new()
+
+    :param pa_mainloop_api *api: mainloopのvtable
+    :param pa_time_event *event: タイマーイベント
+    :param struct timeval *tv: 期限の時刻
+    :param void *userdata: VolumeRampのハンドル
+    """
+
+    ramp = _ramps.get(userdata)
+    if ramp is not None:
+        ramp._on_tick()
+
+
+class VolumeRamp:
+    """音量値のランプ
+
+    VolumePulseaudio の音量値を、指定した時間をかけて目標の音量値まで変化させる。
+    途中の音量値は、mainloopのタイマーイベント(pa_mainloop_api.time_new)で
+    interval 秒ごとに設定するので、呼び出し元は完了を待たない。
+    タイマーイベントは1つだけで、期限を変更(time_restart)しながら使い回す。
+
+    ランプ中に ramp() を呼び出すと、前のランプは取り消し(Futureはcancelled)、
+    その時点の音量値から新しい目標へ変化させる(纏めて1つのランプにする)。
+    途中の音量値の設定は VolumePulseaudio の書き込みキューで纏められるので、
+    サーバーの応答が遅くても、送信中の書き込みは1つまでに収まる。
+
+    fade_out() は変化させる前の音量値を覚えておき、fade_in() と restore() で戻す。
+    """
+
+    def __init__(self, volume: VolumePulseaudio, interval: float = 0.02):
+        """
+        :param VolumePulseaudio volume: 音量値を変化させる音量コントロール
+        :param float interval: 途中の音量値を設定する秒間隔
+        """
+
+        try:
+            self._volume = volume
+            self._connection = volume._connection
+            self._interval = int(interval * 1_000_000)
+
+            # タイマーイベントの操作で使う関数と構造体は、ここで確保しておく
+            api = pa_threaded_mainloop_get_api(self._connection.mainloop)
+            vtable = CPA.cast(api, CPA.POINTER(PA_MAINLOOP_API)).contents
+            self._time_restart = vtable.time_restart
+            self._time_free = vtable.time_free
+            self._tv = PA_TIMEVAL()
+            self._tv_pointer = CPA.pointer(self._tv)
+
+            self._start = 0
+            self._target = 0
+            self._started = 0.0
+            self._duration = 0.0
+            self._future: Future | None = None
+
+            # fade_out() する前の音量値
+            self._saved: int | None = None
+            # タイマーイベントで途中の音量値を設定した回数
+            self._tick_count = 0
+
+            # モジュールのcallback関数からインスタンスを識別するハンドル
+            self._handle = next(_ramp_handles)
+            _ramps[self._handle] = self
+
+            with self._connection.locked():
+                # 無効の状態で作っておき、ランプの開始時に期限を設定する
+                self._event = vtable.time_new(api, None, _ramp_tick, self._handle)
+            if not self._event:
+                raise PAError("pa_mainloop_api.time_new")
+
+        except PAError as message:
+            raise PAError(f"VolumeRamp - constructor: {message}")
+
+    def __del__(self):
+        if getattr(self, "_event", None):
+            with self._connection.locked():
+                self._time_free(self._event)
+            self._event = None
+
+    @property
+    def active(self) -> bool:
+        """ランプ中かどうか
+
+        :return bool: ランプ中ならTrue
+        """
+
+        return self._future is not None
+
+    @property
+    def level(self) -> int:
+        """ランプ中なら目標の音量値、それ以外は現在の音量値
+
+        :return int: 音量値(0 - 65535)
+        """
+
+        if self._future is not None:
+            return self._target
+
+        return self._volume._value
+
+    def ramp(self, target: int, duration: float) -> Future:
+        """音量値を target まで duration 秒かけて変化させる
+
+        完了は待たない。返したFutureを cancel() すると、その時点の音量値で止まる。
+
+        :param int target: 目標の音量値(0 - 65535)
+        :param float duration: 変化させる秒数(0 ならすぐに設定する)
+        :return Future: 目標の音量値(取り消された場合は cancelled)
+        """
+
+        future: Future = Future()
+
+        try:
+            with self._connection.locked():
+                if self._future is not None:
+                    self._future.cancel()
+
+                self._start = self._volume._value
+                self._target = int(target)
+                self._started = time.monotonic()
+                self._duration = max(float(duration), 0.0)
+                self._future = future
+
+                if self._duration == 0.0 or self._start == self._target:
+                    self._finish()
+                else:
+                    self._schedule()
+
+        except PAError as message:
+            raise PAError(f"ramp: {message}")
+
+        return future
+
+    def cancel(self) -> None:
+        """ランプを取り消し、その時点の音量値で止める"""
+
+        with self._connection.locked():
+            if self._future is None:
+                return
+
+            future, self._future = self._future, None
+            self._time_restart(self._event, None)
+            future.cancel()
+
+    def fade_out(self, duration: float = 0.3) -> Future:
+        """現在の音量値を覚えておき、0 まで下げる
+
+        :param float duration: 変化させる秒数
+        :return Future: 目標の音量値(0)
+        """
+
+        with self._connection.locked():
+            if self._saved is None:
+                self._saved = self.level
+
+            return self.ramp(0, duration)
+
+    def fade_in(self, duration: float = 0.3) -> Future:
+        """fade_out() で覚えた音量値まで上げる
+
+        覚えた音量値が無ければ、0 から現在の音量値まで上げる。
+
+        :param float duration: 変化させる秒数
+        :return Future: 目標の音量値
+        """
+
+        with self._connection.locked():
+            level, self._saved = self._saved, None
+            if level is None:
+                level = self.level
+                self._volume._enqueue(0, None)
+
+            return self.ramp(level, duration)
+
+    def restore(self) -> Future:
+        """fade_out() で覚えた音量値に、すぐに戻す
+
+        :return Future: 目標の音量値
+        """
+
+        with self._connection.locked():
+            level, self._saved = self._saved, None
+            if level is None:
+                level = self.level
+
+            return self.ramp(level, 0.0)
+
+    def _schedule(self) -> None:
+        """次のタイマーイベントの期限を interval 秒後にする
+
+        mainloopをロックした状態で呼び出すこと。
+        """
+
+        pa_gettimeofday(self._tv_pointer)
+        pa_timeval_add(self._tv_pointer, self._interval)
+        self._time_restart(self._event, self._tv_pointer)
+
+    def _finish(self) -> None:
+        """目標の音量値を設定して、ランプを終える
+
+        mainloopをロックした状態で呼び出すこと。
+        """
+
+        future, self._future = self._future, None
+        self._time_restart(self._event, None)
+        self._volume._enqueue(self._target, None)
+
+        # 呼び出し元のスレッドで取り消されている場合がある
+        try:
+            future.set_result(self._target)
+        except InvalidStateError:
+            pass
+
+    def _on_tick(self) -> None:
+        """タイマーイベント
+
+        専用のスレッドで、mainloopをロックした状態で呼び出される。
+        経過時間から途中の音量値を求めて設定し、次のタイマーイベントを設定する。
+        """
+
+        future = self._future
+        if future is None:
+            return
+
+        if future.cancelled():
+            self._future = None
+            return
+
+        elapsed = time.monotonic() - self._started
+        if elapsed >= self._duration:
+            self._finish()
+            return
+
+        self._tick_count += 1
+        self._volume._enqueue(
+            self._start + int((self._target - self._start) * elapsed / self._duration),
+            None,
+        )
+        self._schedule()
+
+
+class VolumeDucking:
+    """ダッキング
+
+    マイクの音量レベルに合わせて、スピーカーの音量値を一時的に下げる。
+    LevelMeterPulseaudio のcallback関数から on_level() を呼び出すこと。
+
+    active の間、ピーク値が threshold 以上になったら attack 秒で depth 倍まで下げ、
+    threshold 未満が hold 秒続いたら release 秒で元の音量値に戻す。
+    音量値の変化は VolumeRamp に任せるので、on_level() は待たない。
+    """
+
+    def __init__(
+        self,
+        ramp: VolumeRamp,
+        threshold: float = 0.05,
+        depth: float = 0.3,
+        attack: float = 0.05,
+        hold: float = 0.5,
+        release: float = 0.5,
+    ):
+        """
+        :param VolumeRamp ramp: スピーカーの音量値のランプ
+        :param float threshold: マイクがアクティブと見なすピーク値(0.0 - 1.0)
+        :param float depth: 下げた時の音量値の倍率
+        :param float attack: 下げる秒数
+        :param float hold: 元に戻すまでに、threshold 未満が続く秒数
+        :param float release: 元に戻す秒数
+        """
+
+        self._ramp = ramp
+        self._threshold = threshold
+        self._depth = depth
+        self._attack = attack
+        self._hold = hold
+        self._release = release
+
+        self._active = False
+        # 下げる前の音量値(下げていなければ None)
+        self._level: int | None = None
+        self._quiet_since = 0.0
+
+    @property
+    def active(self) -> bool:
+        """ダッキングするかどうか
+
+        :return bool: ダッキングするならTrue
+        """
+
+        return self._active
+
+    @active.setter
+    def active(self, active: bool) -> None:
+        """ダッキングするかどうかを設定する
+
+        False にした時に下げていれば、release 秒で元の音量値に戻す。
+
+        :param bool active: ダッキングするならTrue
+        """
+
+        with self._ramp._connection.locked():
+            self._active = active
+            if not active:
+                self._unduck()
+
+    @property
+    def ducked(self) -> bool:
+        """音量値を下げているかどうか
+
+        :return bool: 下げていればTrue
+        """
+
+        return self._level is not None
+
+    def on_level(self, peak: float, rms: float) -> None:
+        """マイクの音量レベル
+
+        LevelMeterPulseaudio のcallback関数から、PulseAudioの専用のスレッドで呼び出す。
+
+        :param float peak: ピーク値(0.0 - 1.0)
+        :param float rms: RMS値(0.0 - 1.0)
+        """
+
+        if not self._active:
+            return
+
+        now = time.monotonic()
+        if peak >= self._threshold:
+            self._quiet_since = now
+            if self._level is None:
+                self._level = self._ramp.level
+                self._ramp.ramp(int(self._level * self._depth), self._attack)
+            return
+
+        if now - self._quiet_since >= self._hold:
+            self._unduck()
+
+    def _unduck(self) -> None:
+        """下げていれば、元の音量値に戻す"""
+
+        if self._level is None:
+            return
+
+        level, self._level = self._level, None
+        self._ramp.ramp(level, self._release)
+
+
+#### 複数のsink/sourceを纏めて操作するクラス
+
+# 纏めて操作する際のキー: ("SINK" か "SOURCE", 名前)
+VolumeKey = tuple[Literal["SINK", "SOURCE"], bytes]
+
+
+class VolumeBatch(BasePulseaudio):
+    """複数のsink/sourceの音量値を纏めて取得・設定するクラス
+
+    1回のロックの中で複数の操作を続けて要求し(パイプライン)、
+    サーバーとの往復を待つのは纏めて1回分で済ませる。
+    音量値のキーは ("SINK" か "SOURCE", 名前) で、名前には
+    "@DEFAULT_SINK@", "@DEFAULT_SOURCE@" も使える。
+    """
+
+    def __init__(self, name: str = "VolumeBatch"):
+        super().__init__(name)
+
+        # 要求した順に完了するので、1回分ごとに [残りの完了数, Future, 結果] を
+        # 先入れ先出しで扱う
+        self._gets: deque[list] = deque()
+        self._sets: deque[list] = deque()
+
+        # callback関数のインスタンスは、非同期の処理中に解放されないように保持する
+        self._sink_info_callback = PA_SINK_INFO_CB_T(
+            lambda context, info, eol, userdata: self._on_info(
+                "SINK", PA_SINK_INFO, info, eol
+            )
+        )
+        self._source_info_callback = PA_SOURCE_INFO_CB_T(
+            lambda context, info, eol, userdata: self._on_info(
+                "SOURCE", PA_SOURCE_INFO, info, eol
+            )
+        )
+        self._success_callback = PA_CONTEXT_SUCCESS_CB_T(self._on_success)
+
+    def get_all(self) -> Future:
+        """すべてのsink/sourceの音量値を取得する
+
+        sinkの一覧とsourceの一覧の取得を続けて要求し、両方の完了を纏めて待つ。
+
+        :return Future: {("SINK" か "SOURCE", 名前): 音量値(0 - 65535)}
+        """
+
+        future: Future = Future()
+
+        try:
+            with self._connection.locked():
+                self._gets.append([2, future, {}])
+                pa_operation_unref(
+                    pa_context_get_sink_info_list(
+                        self._context, self._sink_info_callback, None
+                    )
+                )
+                pa_operation_unref(
+                    pa_context_get_source_info_list(
+                        self._context, self._source_info_callback, None
+                    )
+                )
+
+        except PAError as message:
+            raise PAError(f"VolumeBatch - get_all: {message}")
+
+        return future
+
+    def set_many(self, volumes: dict[VolumeKey, int]) -> Future:
+        """複数のsink/sourceに音量値を設定する
+
+        すべての設定を続けて要求し、すべての完了を纏めて待つ。
+        多チャンネルの場合、すべてのチャンネルに同じ音量値を設定する。
+
+        :param dict volumes: {("SINK" か "SOURCE", 名前): 音量値(0 - 65535)}
+        :return Future: 設定した音量値(引数 volumes と同じ)
+        """
+
+        func = {
+            "SINK": pa_context_set_sink_volume_by_name,
+            "SOURCE": pa_context_set_source_volume_by_name,
+        }
+        future: Future = Future()
+
+        if not volumes:
+            future.set_result({})
+            return future
+
+        try:
+            with self._connection.locked():
+                self._sets.append([len(volumes), future, dict(volumes)])
+                for (type, name), value in volumes.items():
+                    # 1チャンネルの音量値は、サーバーですべてのチャンネルに適用される
+                    cvolume = PA_CVOLUME()
+                    pa_cvolume_set(CPA.pointer(cvolume), 1, int(value))
+                    pa_operation_unref(
+                        func[type](
+                            self._context,
+                            name,
+                            CPA.pointer(cvolume),
+                            self._success_callback,
+                            None,
+                        )
+                    )
+
+        except PAError as message:
+            raise PAError(f"VolumeBatch - set_many: {message}")
+
+        return future
+
+    def _on_info(self, type: str, info_type: Any, info: int, eol: int) -> None:
+        """sink情報/source情報の一覧から音量値を得る
+
+        :param str type: "SINK" か "SOURCE"
+        :param Any info_type: PA_SINK_INFO か PA_SOURCE_INFO
+        :param int info: 情報の構造体のアドレス
+        :param int eol: リスト終端判定値、0ならリスト内のオブジェクトを取得
+        """
+
+        round = self._gets[0]
+
+        if eol == 0:
+            cast_info = CPA.cast(info, CPA.POINTER(info_type)).contents
+            round[2][(type, cast_info.name)] = pa_cvolume_avg(
+                CPA.byref(cast_info.volume)
+            )
+            return
+
+        self._complete(self._gets, eol > 0, f"{type} の一覧")
+
+    def _on_success(self, context, success, userdata) -> None:
+        """callback関数
+
+        音量値の設定の完了
+        | pa_context_set_sink_volume_by_name()
+        | pa_context_set_source_volume_by_name()
+        """
+
+        self._complete(self._sets, bool(success), "音量値の設定")
+
+    def _complete(self, rounds: deque, success: bool, operation: str) -> None:
+        """1回分の操作の1つが完了した
+
+        すべてが完了したらFutureに結果を通知する。
+        1つでも失敗したら、例外を通知する。
+
+        :param deque rounds: 完了待ちの [残りの完了数, Future, 結果]
+        :param bool success: 成功したかどうか
+        :param str operation: 失敗時のメッセージに含める操作名
+        """
+
+        round = rounds[0]
+        round[0] -= 1
+
+        if not success and not round[1].done():
+            round[1].set_exception(PAError(f"VolumeBatch - {operation}"))
+
+        if round[0] == 0:
+            rounds.popleft()
+            if not round[1].done():
+                round[1].set_result(round[2])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+"""startup
+
+起動の段階(phase)ごとの時間の計測と報告(--profile-startup)。
+
+段階はスレッドをまたいで並行してよい。時刻は StartupProfiler を作った時からの秒数で、
+Linux では OS の起動とプロセスの開始からの時間も報告する(/proc が読めれば)。
+kivy と pjsua2 に依存しないので、アプリケーションの最初に作る。
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+
+@dataclass(frozen=True)
+class Phase:
+    """起動の1段階
+
+    start, end は StartupProfiler を作った時からの秒数。
+    mark() で記録した時点は、start と end が等しい。
+    """
+
+    name: str
+    thread: str
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def _since_boot() -> float | None:
+    """OS の起動からの秒数(Linux 以外では None)"""
+
+    clock = getattr(time, "CLOCK_BOOTTIME", None)
+    if clock is None:
+        return None
+    return time.clock_gettime(clock)
+
+
+def _process_since_boot() -> float | None:
+    """OS の起動からプロセスの開始までの秒数(/proc が無ければ None)"""
+
+    try:
+        with open(f"/proc/{os.getpid()}/stat", encoding="ascii") as file:
+            # comm に空白や括弧があってもよいように、最後の ")" より後を分ける
+            fields = file.read().rpartition(")")[2].split()
+        # 22番目の starttime(state が3番目なので、ここでは20番目)
+        return int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class StartupProfiler:
+    """起動の段階ごとの時間
+
+    どのスレッドからも phase() と mark() を呼び出せる。
+    enabled が False でも記録はする(記録は数マイクロ秒)。report() を出すかどうかは
+    呼び出し側が enabled で決める。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        """
+        :param Callable clock: 単調増加する時刻(秒)
+        """
+
+        self.enabled = False
+        self._clock = clock
+        self._origin = clock()
+        self._lock = threading.Lock()
+        self._phases: list[Phase] = []
+
+        # OS の起動から、この StartupProfiler を作るまでの秒数
+        self.boot_offset = _since_boot()
+        # OS の起動から、プロセスの開始までの秒数
+        self.process_offset = _process_since_boot()
+
+    @property
+    def phases(self) -> list[Phase]:
+        """記録した段階(始まった順)"""
+
+        with self._lock:
+            return sorted(self._phases, key=lambda phase: (phase.start, phase.end))
+
+    def now(self) -> float:
+        """作った時からの秒数"""
+
+        return self._clock() - self._origin
+
+    def _record(self, name: str, start: float, end: float) -> None:
+        phase = Phase(name, threading.current_thread().name, start, end)
+        with self._lock:
+            self._phases.append(phase)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """with の中の時間を段階として記録する(例外で抜けても記録する)
+
+        :param str name: 段階の名前
+        """
+
+        start = self.now()
+        try:
+            yield
+        finally:
+            self._record(name, start, self.now())
+
+    def mark(self, name: str) -> float:
+        """時点を記録する("first frame", "ready" など)
+
+        :param str name: 時点の名前
+        :return float: 作った時からの秒数
+        """
+
+        now = self.now()
+        self._record(name, now, now)
+        return now
+
+    def elapsed(self, name: str) -> float | None:
+        """段階か時点の終わりの時刻(同じ名前が複数あれば最後のもの)
+
+        :param str name: 段階か時点の名前
+        :return float: 作った時からの秒数、無ければ None
+        """
+
+        ends = [phase.end for phase in self.phases if phase.name == name]
+        return ends[-1] if ends else None
+
+    def report(self) -> str:
+        """段階ごとの時間の表
+
+        :return str: 始まった順の段階と、OS の起動からの時間
+        """
+
+        lines = [f"{'start':>9s} {'duration':>9s}  {'thread':16s} phase"]
+        for phase in self.phases:
+            duration = f"{phase.duration * 1000:7.1f}ms" if phase.duration else "-"
+            lines.append(
+                f"{phase.start * 1000:7.1f}ms {duration:>9s}  "
+                f"{phase.thread[:16]:16s} {phase.name}"
+            )
+
+        end = max((phase.end for phase in self.phases), default=0.0)
+        summary = f"total {end * 1000:.1f} ms"
+        if self.process_offset is not None and self.boot_offset is not None:
+            interpreter = self.boot_offset - self.process_offset
+            summary += f" (+ interpreter {interpreter * 1000:.0f} ms"
+            summary += f", boot to end {self.boot_offset + end:.1f} s)"
+        lines.append(summary)
+
+        return "\n".join(lines)
+
+
+# アプリケーション全体で1つの StartupProfiler(最初の import で時刻の原点が決まる)
+PROFILER = StartupProfiler()
+
+
+if __name__ == "__main__":
+    print(__file__)
@@ -0,0 +1,174 @@
+"""lossy_relay
+
+パケットロスのある Wi-Fi の代わりに使う、UDPの中継(tc netem の代わり)
+
+2つの端点 a, b は、SDPで相手に知らせるアドレス(public)と、実際に受信するアドレス(real)を
+別にする。中継は public のアドレスで受信し、反対側の public のアドレスから real へ送るので、
+どちらの端点からも、相手は SDP に書かれたアドレスから送ってくるように見える。
+
+  a(real) -> b(public) [中継: a -> b でロスと帯域の制限] b(real)
+  a(real) <- a(public) [中継: そのまま]                 b(real)
+"""
+
+import random
+import selectors
+import socket
+import threading
+import time
+
+
+class LossyRelay:
+    """a -> b の向きだけパケットを落とすUDPの中継
+
+    ロスは Gilbert-Elliott モデル(良い状態では届き、悪い状態では落ちる)で、
+    平均のロス率 loss と、続けて落ちるパケット数の平均 burst で決める。
+    capacity_bps を指定すると、トークンバケットで帯域を超えた分も落とす(混雑)。
+    """
+
+    def __init__(
+        self,
+        a_public: tuple[str, int],
+        a_real: tuple[str, int],
+        b_public: tuple[str, int],
+        b_real: tuple[str, int],
+        loss: float = 0.0,
+        burst: float = 1.0,
+        capacity_bps: int = 0,
+        seed: int = 0,
+    ):
+        """
+        :param tuple a_public: a が SDP で知らせるアドレス
+        :param tuple a_real: a が実際に受信するアドレス
+        :param tuple b_public: b が SDP で知らせるアドレス
+        :param tuple b_real: b が実際に受信するアドレス
+        :param float loss: a -> b の平均のロス率(0.0 - 1.0)
+        :param float burst: 続けて落ちるパケット数の平均
+        :param int capacity_bps: a -> b の帯域(bps, IPv4とUDPのヘッダを含む)、0 なら制限しない
+        :param int seed: 乱数の種(比較する計測で同じにする)
+        """
+
+        self.a_real = a_real
+        self.b_real = b_real
+
+        # 悪い状態から良い状態へ移る確率と、良い状態から悪い状態へ移る確率
+        self._recover = 1.0 / max(burst, 1.0)
+        self._fail = loss * self._recover / (1.0 - loss) if loss < 1.0 else 1.0
+        self._bad = False
+        self._random = random.Random(seed)
+
+        self.capacity_bps = capacity_bps
+        # バケットの深さ: 100ミリ秒分
+        self._depth = capacity_bps / 8 * 0.1
+        self._tokens = self._depth
+        self._filled = time.monotonic()
+
+        # a -> b の統計
+        self.offered_packets = 0
+        self.offered_bytes = 0
+        self.delivered_packets = 0
+        self.dropped_loss = 0
+        self.dropped_capacity = 0
+
+        self.a_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.a_sock.bind(a_public)
+        self.b_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.b_sock.bind(b_public)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="lossy-relay", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """中継を終える"""
+
+        self._stop.set()
+        self._thread.join()
+        self.a_sock.close()
+        self.b_sock.close()
+
+    def _lost(self) -> bool:
+        """Gilbert-Elliott モデルで、次のパケットを落とすかどうか
+
+        :return bool: 落とすならTrue
+        """
+
+        if self._bad:
+            self._bad = self._random.random() >= self._recover
+        else:
+            self._bad = self._random.random() < self._fail
+        return self._bad
+
+    def _admit(self, size: int, now: float) -> bool:
+        """トークンバケット: 帯域に収まるかどうか
+
+        :param int size: IPv4とUDPのヘッダを含むバイト数
+        :param float now: time.monotonic()
+        :return bool: 収まるならTrue
+        """
+
+        if not self.capacity_bps:
+            return True
+
+        elapsed = max(now - self._filled, 0.0)
+        self._tokens = min(self._depth, self._tokens + elapsed * self.capacity_bps / 8)
+        self._filled = max(now, self._filled)
+        if self._tokens < size:
+            return False
+        self._tokens -= size
+        return True
+
+    def forward(self, data: bytes, now: float) -> bool:
+        """a -> b のパケットを中継するかどうかを決め、統計を数える
+
+        :param bytes data: UDPのデータ
+        :param float now: time.monotonic()
+        :return bool: 中継するならTrue
+        """
+
+        self.offered_packets += 1
+        self.offered_bytes += len(data) + 28
+
+        if self._lost():
+            self.dropped_loss += 1
+            return False
+        if not self._admit(len(data) + 28, now):
+            self.dropped_capacity += 1
+            return False
+
+        self.delivered_packets += 1
+        return True
+
+    def _run(self) -> None:
+        """中継のスレッド"""
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.b_sock, selectors.EVENT_READ, "a->b")
+        selector.register(self.a_sock, selectors.EVENT_READ, "b->a")
+
+        while not self._stop.is_set():
+            for key, _ in selector.select(0.1):
+                try:
+                    data = key.fileobj.recv(4096)
+                    if key.data == "a->b":
+                        if self.forward(data, time.monotonic()):
+                            self.a_sock.sendto(data, self.b_real)
+                    else:
+                        self.b_sock.sendto(data, self.a_real)
+                except OSError:
+                    # 端点の準備ができていない(ICMP port unreachable)
+                    pass
+
+        selector.close()
+
+    @property
+    def loss(self) -> float:
+        """a -> b で落としたパケットの割合
+
+        :return float: 0.0 - 1.0
+        """
+
+        if not self.offered_packets:
+            return 0.0
+        return 1.0 - self.delivered_packets / self.offered_packets
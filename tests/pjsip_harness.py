@@ -0,0 +1,1223 @@
+"""pjsip_harness
+
+pjsua2 の計測用ハーネス
+
+pjsua2 のライブラリィはプロセスに1つだけなので、計測はモードごとに
+別のプロセスで実行し、結果をJSONで標準出力に書き出す。
+
+python -m tests.pjsip_harness latency polling
+python -m tests.pjsip_harness latency thread
+python -m tests.pjsip_harness soak 2000
+python -m tests.pjsip_harness page 8
+python -m tests.pjsip_harness codec opus [reference.wav]
+python -m tests.pjsip_harness adaptive fixed|adaptive 10 2 40
+python -m tests.pjsip_harness profile lowlatency|balanced|robust [device]
+python -m tests.pjsip_harness bench polling|thread pcmu 20 1|2
+python -m tests.pjsip_harness answer polling|thread pcmu
+python -m tests.pjsip_harness direct intercom1 unsecurepassword 20
+
+テストからは run() で実行する。計測結果はテストが logging の INFO で報告する
+(pytest では --log-cli-level=INFO で表示する)。
+"""
+
+import array
+import gc
+import json
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+# UIの1フレームの間隔(秒): Clock.schedule_interval(polling_pjlib, 0.01) と同じ
+TICK = 0.01
+TICKS = 300
+# OPTIONS を送る間隔(秒)
+PROBE_INTERVAL = 0.05
+# 通話の状態の変化を待つ時間(秒)
+CALL_TIMEOUT = 5.0
+# ソークテストで測定を始めるまでの通話の割合(ウォームアップ)
+SOAK_WARMUP = 0.1
+# ソークテストの測定の回数
+SOAK_SAMPLES = 10
+# 一斉呼出の通話を続けて、CPU使用率を測る時間(秒)
+PAGE_HOLD = 2.0
+# 一斉呼出で同時に扱う通話の数(呼出側と応答側の両方を同じプロセスで扱う)
+PAGE_MAX_CALLS = 32
+# コーデックの計測で、音声を流してCPU使用率と送信のバイト数を測る時間(秒)
+CODEC_HOLD = 5.0
+# 1パケットあたりの RTP(12) + UDP(8) + IPv4(20) のヘッダのバイト数(Wi-Fiのヘッダは含まない)
+PACKET_OVERHEAD = 40
+# 適応の計測で、中継を通して通話する時間(秒)と、Opus の設定を見直す間隔(秒)
+ADAPTIVE_SECONDS = 30.0
+ADAPTIVE_INTERVAL = 2.0
+# 途切れの判定に使う区間(秒)
+DROPOUT_FRAME = 0.02
+# 遅延の計測で、クリック音を鳴らす時間(秒)と、クリック音の間隔(秒)、長さ(秒)
+PROFILE_SECONDS = 10.0
+CLICK_PERIOD = 1.0
+CLICK_LENGTH = 0.005
+# クリック音の立ち上がりの判定に使う区間(秒)と、その前に必要な無音の長さ(秒)
+ONSET_FRAME = 0.001
+ONSET_QUIET = 0.01
+# ベンチマークで、片方向の遅延を測る通話を続ける時間(秒)
+BENCH_HOLD = 6.0
+
+
+def run(*args, timeout: float = 120) -> dict:
+    """計測を別のプロセスで実行し、結果を返す
+
+    :param args: ハーネスのコマンドと引数
+    :param float timeout: 計測を待つ時間(秒)
+    :return dict: 計測結果(標準出力の最後の行のJSON)
+    """
+
+    completed = subprocess.run(
+        [sys.executable, "-m", "tests.pjsip_harness", *map(str, args)],
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _options(port: int, local_port: int, number: int) -> bytes:
+    """ダイアログ外の OPTIONS リクエスト
+
+    :param int port: 送り先(UserAgentのUDPトランスポート)のポート
+    :param int local_port: 送り元のポート
+    :param int number: 通し番号
+    :return bytes: SIPメッセージ
+    """
+
+    return (
+        f"OPTIONS sip:probe@127.0.0.1:{port} SIP/2.0\r\n"
+        f"Via: SIP/2.0/UDP 127.0.0.1:{local_port};rport;branch=z9hG4bKprobe{number}\r\n"
+        "Max-Forwards: 70\r\n"
+        f"From: <sip:probe@127.0.0.1>;tag=probe{number}\r\n"
+        "To: <sip:probe@127.0.0.1>\r\n"
+        f"Call-ID: probe{number}@127.0.0.1\r\n"
+        f"CSeq: {number} OPTIONS\r\n"
+        "Content-Length: 0\r\n\r\n"
+    ).encode()
+
+
+def _probe(port: int, stop: threading.Event, latencies: list[float]) -> None:
+    """OPTIONS を送り、応答までの時間を測る
+
+    :param int port: UserAgentのUDPトランスポートのポート
+    :param threading.Event stop: 終了の合図
+    :param list latencies: 応答までの時間(秒)を追加するリスト
+    """
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(1.0)
+        local_port = sock.getsockname()[1]
+
+        number = 0
+        while not stop.is_set():
+            number += 1
+            start = time.perf_counter()
+            sock.sendto(_options(port, local_port, number), ("127.0.0.1", port))
+            try:
+                while True:
+                    response = sock.recv(4096)
+                    if f"CSeq: {number} OPTIONS".encode() in response:
+                        break
+            except socket.timeout:
+                continue
+
+            latencies.append(time.perf_counter() - start)
+            time.sleep(PROBE_INTERVAL)
+
+
+def _percentiles(values: list[float]) -> dict:
+    """中央値、p99、最大値(ミリ秒)
+
+    :param list values: 秒のリスト
+    :return dict: median, p99, max
+    """
+
+    if len(values) < 2:
+        return {"median": None, "p99": None, "max": None}
+
+    return {
+        "median": statistics.median(values) * 1e3,
+        "p99": statistics.quantiles(values, n=100)[98] * 1e3,
+        "max": max(values) * 1e3,
+    }
+
+
+def _port(user_agent) -> int:
+    """UserAgentのUDPトランスポートのポート
+
+    :param UserAgent user_agent: UserAgent
+    :return int: ポート
+    """
+
+    local_name = user_agent.endpoint.transportGetInfo(user_agent.transport_id).localName
+    return int(local_name.rsplit(":", 1)[1])
+
+
+def _rss() -> int:
+    """このプロセスの常駐メモリ(バイト)
+
+    :return int: RSS
+    """
+
+    pages = int(open("/proc/self/statm").read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _reference_wav(path: str, seconds: float = 5.0, rate: int = 16000) -> None:
+    """計測用の音声(WAV, 16ビット, モノラル)を書き出す
+
+    声の帯域(100 - 7000 Hz)を往復する掃引音を、音節の長さ(4 Hz)で振幅変調する。
+
+    :param str path: 書き出すファイル
+    :param float seconds: 長さ(秒)
+    :param int rate: 標本化周波数(Hz)
+    """
+
+    samples = array.array("h")
+    phase = 0.0
+    for number in range(int(seconds * rate)):
+        t = number / rate
+        frequency = 100.0 + 6900.0 * (0.5 - 0.5 * math.cos(2 * math.pi * t / seconds))
+        phase += 2 * math.pi * frequency / rate
+        envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4.0 * t)
+        samples.append(int(12000 * envelope * math.sin(phase)))
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+
+def _envelope(path: str, frame: float = DROPOUT_FRAME) -> list[float]:
+    """WAV の区間ごとのRMS
+
+    :param str path: WAV(16ビット, モノラル)
+    :param float frame: 区間(秒)
+    :return list[float]: RMS
+    """
+
+    with wave.open(path, "rb") as wav:
+        samples = array.array("h", wav.readframes(wav.getnframes()))
+        size = max(int(wav.getframerate() * frame), 1)
+
+    envelope = []
+    for start in range(0, len(samples) - size + 1, size):
+        frame = samples[start : start + size]
+        envelope.append(math.sqrt(sum(sample * sample for sample in frame) / size))
+    return envelope
+
+
+def _dropouts(reference: list[float], recorded: list[float]) -> float:
+    """受信した音声の途切れの割合
+
+    録音は基準の WAV を繰り返し再生したものなので、基準の包絡線を繰り返して、
+    相関が最も大きくなるずれで重ねる。基準が十分に大きい区間のうち、
+    録音が基準の 1/4 未満になった区間を途切れとする。
+
+    :param list reference: 基準の WAV の区間ごとのRMS
+    :param list recorded: 録音の区間ごとのRMS
+    :return float: 途切れの割合(%)
+    """
+
+    period = len(reference)
+    if not recorded or not period:
+        return 100.0
+
+    window = recorded[: period * 2]
+    lag = max(
+        range(period),
+        key=lambda lag: sum(
+            value * reference[(number + lag) % period]
+            for number, value in enumerate(window)
+        ),
+    )
+    gain = sum(recorded) / max(
+        sum(reference[(number + lag) % period] for number in range(len(recorded))), 1e-9
+    )
+
+    loud = max(reference) * 0.3
+    frames = dropped = 0
+    for number, value in enumerate(recorded):
+        expected = reference[(number + lag) % period] * gain
+        if reference[(number + lag) % period] < loud:
+            continue
+        frames += 1
+        if value < expected / 4:
+            dropped += 1
+
+    return dropped * 100.0 / max(frames, 1)
+
+
+def _click_wav(path: str, seconds: float = CLICK_PERIOD, rate: int = 16000) -> None:
+    """遅延の計測用の音声(WAV, 16ビット, モノラル)を書き出す
+
+    CLICK_PERIOD 秒ごとの最初の CLICK_LENGTH 秒だけ 1 kHz を鳴らし、残りは無音とする。
+
+    :param str path: 書き出すファイル
+    :param float seconds: 長さ(秒)
+    :param int rate: 標本化周波数(Hz)
+    """
+
+    samples = array.array("h")
+    for number in range(int(seconds * rate)):
+        t = number / rate
+        if t % CLICK_PERIOD < CLICK_LENGTH:
+            samples.append(int(16000 * math.sin(2 * math.pi * 1000.0 * t)))
+        else:
+            samples.append(0)
+
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+
+def _click_delays(path: str) -> list[float]:
+    """録音の中の、クリック音とその遅れた写しの間隔
+
+    録音は、クリック音そのものと、経路を通って遅れたクリック音を重ねたもの。
+    立ち上がり(ONSET_QUIET 秒の無音の後に、最大値の 1/10 を超えた区間)を順に見て、
+    CLICK_PERIOD の半分より短い間隔で続く2つを、元と写しの組とする。
+
+    :param str path: 録音(WAV, 16ビット, モノラル)
+    :return list[float]: 遅延(秒)
+    """
+
+    envelope = _envelope(path, ONSET_FRAME)
+    if not envelope:
+        return []
+
+    threshold = max(envelope) / 10
+    quiet = int(ONSET_QUIET / ONSET_FRAME)
+    onsets = [
+        number * ONSET_FRAME
+        for number in range(quiet, len(envelope))
+        if envelope[number] > threshold
+        and all(value <= threshold for value in envelope[number - quiet : number])
+    ]
+
+    delays = []
+    while len(onsets) >= 2:
+        first, second = onsets[0], onsets[1]
+        if second - first < CLICK_PERIOD / 2:
+            delays.append(second - first)
+            onsets = onsets[2:]
+        else:
+            # 写しが届かなかった(あるいは写しだけが残った)
+            onsets = onsets[1:]
+    return delays
+
+
+def _step(user_agent, seconds: float) -> None:
+    """UIスレッドの1回分の待ち
+
+    "polling" では、待つ代わりに libHandleEvents を呼び出す。
+
+    :param UserAgent user_agent: UserAgent
+    :param float seconds: 待つ時間(秒)
+    """
+
+    if user_agent.event_mode == "polling":
+        user_agent.endpoint.libHandleEvents(max(int(seconds * 1000), 1))
+    else:
+        time.sleep(seconds)
+
+
+def _wait(user_agent, condition) -> None:
+    """UIスレッドを模擬して dispatcher を drain() しながら、条件を満たすまで待つ
+
+    :param UserAgent user_agent: UserAgent
+    :param Callable condition: 条件
+    """
+
+    deadline = time.perf_counter() + CALL_TIMEOUT
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("通話の状態の変化を待ちきれなかった")
+        user_agent.dispatcher.drain()
+        _step(user_agent, 0.001)
+    user_agent.dispatcher.drain()
+
+
+def soak(calls: int) -> dict:
+    """null audio device で発信・応答・切断を繰り返し、資源が解放されることを確かめる
+
+    同じ UserAgent に、登録しない2つのアカウント(caller, callee)を作り、
+    caller から callee へ直接発信する。calleeは caller を通話相手として登録する。
+
+    :param int calls: 通話の回数
+    :return dict: 測定値(RSS, オブジェクト数, 登録簿の大きさ)のリスト
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.account import Buddy as BUDDY
+    from intercom.libs.pjsip.call import Call as CALL
+    from intercom.libs.pjsip.events import CallState
+
+    user_agent = UA("thread")
+    user_agent.endpoint.audDevManager().setNullDev()
+    port = _port(user_agent)
+
+    accounts = {}
+    for name in ("caller", "callee"):
+        config = pj.AccountConfig()
+        config.idUri = f"sip:{name}@127.0.0.1"
+        accounts[name] = ACC(user_agent.dispatcher)
+        accounts[name].create(config, name == "caller")
+    caller, callee = accounts["caller"], accounts["callee"]
+
+    buddy_config = pj.BuddyConfig()
+    buddy_config.uri = "sip:caller@127.0.0.1"
+    buddy = BUDDY(user_agent.dispatcher)
+    buddy.create(callee, buddy_config)
+    callee.buddies.add(buddy_config.uri)
+
+    states: list[CallState] = []
+    user_agent.dispatcher.subscribe(CallState, states.append)
+
+    samples = []
+    warmup = int(calls * SOAK_WARMUP)
+    every = max((calls - warmup) // SOAK_SAMPLES, 1)
+    start = time.perf_counter()
+
+    for number in range(calls):
+        states.clear()
+
+        prm = pj.CallOpParam(True)
+        prm.opt.audioCount = 1
+        prm.opt.videoCount = 0
+        call = CALL(caller)
+        call.makeCall(f"sip:callee@127.0.0.1:{port}", prm)
+        caller.calls.add(call)
+        del call
+
+        # 双方が通話中になるまで待つ
+        _wait(user_agent, lambda: sum(state.confirmed for state in states) >= 2)
+
+        caller.calls.current.hangup(pj.CallOpParam())
+
+        # 双方の登録簿が空になるまで待つ
+        _wait(user_agent, lambda: len(caller.calls) == 0 and len(callee.calls) == 0)
+
+        if number >= warmup and (number - warmup) % every == 0:
+            gc.collect()
+            samples.append(
+                {
+                    "call": number,
+                    "rss": _rss(),
+                    "objects": len(gc.get_objects()),
+                    "calls": len(caller.calls) + len(callee.calls),
+                }
+            )
+
+    elapsed = time.perf_counter() - start
+    user_agent.stop()
+
+    return {"calls": calls, "seconds": elapsed, "samples": samples}
+
+
+def page(rooms: int) -> dict:
+    """null audio device の部屋を一斉呼出し、接続時間と会議ブリッジのCPU使用率を測る
+
+    同じ UserAgent に、登録しない2つのアカウント(caller, rooms)を作る。
+    "sip:room<n>@127.0.0.1" への着信は、ドメインが一致する rooms がすべて受ける。
+    呼出側と応答側の通話はどちらも会議ブリッジに接続されるので、
+    ブリッジのポートは部屋の数の2倍になる。
+
+    :param int rooms: 部屋の数
+    :return dict: setup(全部屋の接続までのミリ秒), cpu(通話中のCPU使用率)
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.events import CallState
+    from intercom.libs.pjsip.paging import GroupPage
+
+    user_agent = UA("thread", PAGE_MAX_CALLS)
+    user_agent.endpoint.audDevManager().setNullDev()
+    port = _port(user_agent)
+
+    # 着信先のアカウントはユーザー名、次にドメインで選ばれるので、
+    # caller のドメインは 127.0.0.1 にしない
+    accounts = {}
+    for name, uri in (
+        ("caller", "sip:caller@localhost"),
+        ("rooms", "sip:rooms@127.0.0.1"),
+    ):
+        config = pj.AccountConfig()
+        config.idUri = uri
+        accounts[name] = ACC(user_agent.dispatcher)
+        accounts[name].create(config, name == "rooms")
+    caller, callee = accounts["caller"], accounts["rooms"]
+    callee.buddies.add("sip:caller@localhost")
+
+    states: list[CallState] = []
+    user_agent.dispatcher.subscribe(CallState, states.append)
+
+    group_page = GroupPage(caller)
+    uris = [f"sip:room{number}@127.0.0.1:{port}" for number in range(rooms)]
+
+    start = time.perf_counter()
+    group_page.start(uris)
+    _wait(user_agent, lambda: sum(state.confirmed for state in states) >= rooms * 2)
+    setup = time.perf_counter() - start
+
+    ports = user_agent.endpoint.mediaActivePorts()
+    cpu = time.process_time()
+    hold = time.perf_counter()
+    while time.perf_counter() - hold < PAGE_HOLD:
+        user_agent.dispatcher.drain()
+        time.sleep(0.01)
+    cpu = (time.process_time() - cpu) / (time.perf_counter() - hold) * 100
+
+    group_page.hangup()
+    _wait(user_agent, lambda: len(caller.calls) == 0 and len(callee.calls) == 0)
+    user_agent.stop()
+
+    return {"rooms": rooms, "setup": setup * 1e3, "cpu": cpu, "ports": ports}
+
+
+def _hold(user_agent, seconds: float) -> float:
+    """dispatcher を drain() しながら待ち、その間のCPU使用率(%)を返す
+
+    :param UserAgent user_agent: UserAgent
+    :param float seconds: 待つ時間(秒)
+    :return float: CPU使用率(1コアを100%)
+    """
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        user_agent.dispatcher.drain()
+        _step(user_agent, 0.01)
+    return (time.process_time() - cpu) / (time.perf_counter() - start) * 100
+
+
+def codec(name: str, wav: str | None = None) -> dict:
+    """null audio device で、1つのコーデックだけを有効にして通話し、CPU使用率と送信量を測る
+
+    soak() と同じく、同じ UserAgent の caller から callee へ発信する。
+    通話中は双方が基準の WAV を送るので、符号化と復号のストリームは2つになる。
+    ストリームあたりのCPU使用率は、通話をしていない間との差の半分とする。
+
+    :param str name: コーデックの名前(opus, g722, pcmu など)
+    :param str wav: 基準の WAV(省略時は掃引音を作る)
+    :return dict: codec id, ストリームあたりのCPU使用率, 送信のビットレート
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.call import Call as CALL
+    from intercom.libs.pjsip.codec import OpusSettings
+    from intercom.libs.pjsip.error import PJError
+    from intercom.libs.pjsip.events import CallState
+
+    user_agent = UA("thread")
+    user_agent.endpoint.audDevManager().setNullDev()
+
+    try:
+        codec_id = user_agent.configureCodecs(name, OpusSettings())[0]
+    except PJError:
+        user_agent.stop()
+        return {"codec": name, "available": False}
+
+    port = _port(user_agent)
+
+    if wav is None:
+        wav = os.path.join(tempfile.mkdtemp(), "reference.wav")
+        _reference_wav(wav)
+
+    accounts = {}
+    for user in ("caller", "callee"):
+        config = pj.AccountConfig()
+        config.idUri = f"sip:{user}@127.0.0.1"
+        accounts[user] = ACC(user_agent.dispatcher)
+        accounts[user].create(config, user == "caller")
+    caller, callee = accounts["caller"], accounts["callee"]
+    callee.buddies.add("sip:caller@127.0.0.1")
+
+    states: list[CallState] = []
+    user_agent.dispatcher.subscribe(CallState, states.append)
+
+    # 通話をしていない間(会議ブリッジと null audio device だけ)
+    idle = _hold(user_agent, CODEC_HOLD)
+
+    prm = pj.CallOpParam(True)
+    prm.opt.audioCount = 1
+    prm.opt.videoCount = 0
+    call = CALL(caller)
+    call.makeCall(f"sip:callee@127.0.0.1:{port}", prm)
+    caller.calls.add(call)
+    del call
+    _wait(user_agent, lambda: sum(state.confirmed for state in states) >= 2)
+
+    calls = [caller.calls.current, callee.calls.current]
+    player = pj.AudioMediaPlayer()
+    player.createPlayer(wav, 0)
+    for call in calls:
+        player.startTransmit(call.getAudioMedia(-1))
+
+    before = [call.getStreamStat(0).rtcp.txStat for call in calls]
+    busy = _hold(user_agent, CODEC_HOLD)
+    after = [call.getStreamStat(0).rtcp.txStat for call in calls]
+    info = calls[0].getStreamInfo(0)
+
+    payload = sum(end.bytes - start.bytes for start, end in zip(before, after)) / 2
+    packets = sum(end.pkt - start.pkt for start, end in zip(before, after)) / 2
+
+    del calls
+    caller.calls.current.hangup(pj.CallOpParam())
+    _wait(user_agent, lambda: len(caller.calls) == 0 and len(callee.calls) == 0)
+    del player
+    user_agent.stop()
+
+    return {
+        "codec": codec_id,
+        "available": True,
+        "negotiated": f"{info.codecName}/{info.codecClockRate}",
+        "cpu": (busy - idle) / 2,
+        "payload": payload * 8 / CODEC_HOLD,
+        "wire": (payload + packets * PACKET_OVERHEAD) * 8 / CODEC_HOLD,
+        "packets": packets / CODEC_HOLD,
+    }
+
+
+def adaptive(mode: str, loss: float, burst: float, capacity_kbps: float) -> dict:
+    """パケットロスのある中継を通して Opus で通話し、途切れの割合と送信量を測る
+
+    caller と callee は SDP で別のループバックのアドレス(127.0.0.3, 127.0.0.2)を知らせ、
+    LossyRelay がそのアドレスで受けて中継する。caller -> callee の向きだけロスと
+    帯域の制限がある。caller は基準の WAV を送り、callee は受けた音声を録音する。
+    "adaptive" では、caller の通話が ADAPTIVE_INTERVAL 秒ごとに adaptCodec() する。
+
+    :param str mode: "fixed"(最初の設定のまま) か "adaptive"
+    :param float loss: 平均のロス率(%)
+    :param float burst: 続けて落ちるパケット数の平均
+    :param float capacity_kbps: 帯域(kbps, 0 なら制限しない)
+    :return dict: 途切れの割合, 中継でのロス率, 送信のビットレート, 設定の変更回数
+    """
+
+    import pjsua2 as pj
+
+    from tests.lossy_relay import LossyRelay
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.call import Call as CALL
+    from intercom.libs.pjsip.adaptive import AdaptivePolicy
+    from intercom.libs.pjsip.codec import OpusSettings
+    from intercom.libs.pjsip.error import PJError
+    from intercom.libs.pjsip.events import CallState
+
+    user_agent = UA("thread")
+    user_agent.endpoint.audDevManager().setNullDev()
+
+    opus = OpusSettings()
+    try:
+        user_agent.configureCodecs("opus", opus)
+    except PJError:
+        user_agent.stop()
+        return {"mode": mode, "available": False}
+
+    port = _port(user_agent)
+
+    directory = tempfile.mkdtemp()
+    reference = os.path.join(directory, "reference.wav")
+    recorded = os.path.join(directory, "recorded.wav")
+    _reference_wav(reference)
+
+    accounts = {}
+    for user, public in (("caller", "127.0.0.3"), ("callee", "127.0.0.2")):
+        config = pj.AccountConfig()
+        config.idUri = f"sip:{user}@127.0.0.1"
+        config.mediaConfig.transportConfig.boundAddress = "127.0.0.1"
+        config.mediaConfig.transportConfig.publicAddress = public
+        accounts[user] = ACC(user_agent.dispatcher)
+        accounts[user].create(config, user == "caller")
+    caller, callee = accounts["caller"], accounts["callee"]
+    callee.buddies.add("sip:caller@127.0.0.1")
+    if mode == "adaptive":
+        caller.adaptive = AdaptivePolicy()
+        caller.opus = opus
+
+    states: list[CallState] = []
+    user_agent.dispatcher.subscribe(CallState, states.append)
+
+    prm = pj.CallOpParam(True)
+    prm.opt.audioCount = 1
+    prm.opt.videoCount = 0
+    call = CALL(caller)
+    call.makeCall(f"sip:callee@127.0.0.1:{port}", prm)
+    caller.calls.add(call)
+    del call
+    _wait(user_agent, lambda: sum(state.confirmed for state in states) >= 2)
+
+    # SDP で知らせたアドレス(public)と、実際に受信するアドレス(real)
+    relays = []
+    for offset in (0, 1):  # RTP, RTCP
+        addresses = {}
+        for name, account in (("caller", callee), ("callee", caller)):
+            info = account.calls.current.getStreamInfo(0)
+            host, rtp_port = info.remoteRtpAddress.rsplit(":", 1)
+            number = int(rtp_port) + offset
+            addresses[name] = ((host, number), ("127.0.0.1", number))
+        relays.append(
+            LossyRelay(
+                *addresses["caller"],
+                *addresses["callee"],
+                loss=loss / 100 if offset == 0 else 0.0,
+                burst=burst,
+                capacity_bps=int(capacity_kbps * 1000) if offset == 0 else 0,
+            )
+        )
+
+    player = pj.AudioMediaPlayer()
+    player.createPlayer(reference, 0)
+    recorder = pj.AudioMediaRecorder()
+    recorder.createRecorder(recorded)
+
+    changes = 0
+    start = time.perf_counter()
+    adapted = start
+    while time.perf_counter() - start < ADAPTIVE_SECONDS:
+        # re-INVITE でストリームが作り直されると、会議ブリッジの接続が外れる
+        try:
+            player.startTransmit(caller.calls.current.getAudioMedia(-1))
+            callee.calls.current.getAudioMedia(-1).startTransmit(recorder)
+        except pj.Error:
+            pass
+
+        if time.perf_counter() - adapted >= ADAPTIVE_INTERVAL:
+            adapted = time.perf_counter()
+            changes += caller.calls.current.adaptCodec()
+
+        user_agent.dispatcher.drain()
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+
+    settings = caller.calls.current.adaptive.settings if mode == "adaptive" else opus
+    del recorder
+    del player
+    for relay in relays:
+        relay.close()
+
+    caller.calls.current.hangup(pj.CallOpParam())
+    _wait(user_agent, lambda: len(caller.calls) == 0 and len(callee.calls) == 0)
+    user_agent.stop()
+
+    rtp = relays[0]
+    return {
+        "mode": mode,
+        "available": True,
+        "dropouts": _dropouts(_envelope(reference), _envelope(recorded)),
+        "loss": rtp.loss * 100,
+        "offered": rtp.offered_bytes * 8 / elapsed,
+        "changes": changes,
+        "bitrate": settings.bitrate,
+        "packet_loss": settings.packet_loss,
+        "fec": settings.fec,
+    }
+
+
+def profile(name: str, device: bool = False) -> dict:
+    """遅延のプロファイルで、口から耳までの遅延を測る
+
+    通話: soak() と同じく、同じ UserAgent の caller から callee へ発信する。
+    クリック音を caller の通話と録音の両方に送り、callee が受けた音声も同じ録音に送る。
+    録音の中のクリック音と写しの間隔が、パケット化、ジッターバッファ、
+    会議ブリッジを通した一方向の遅延になる(null device なのでサウンドデバイスは含まない)。
+
+    device: クリック音をスピーカー(playback device)へ送り、マイク(capture device)の
+    音声と重ねて録音する。スピーカーとマイクをつないでおくと、サウンドデバイスの
+    往復の遅延(再生のバッファ + 録音のバッファ)になる。通話の遅延に加えたものを
+    口から耳までの遅延とする。
+
+    :param str name: プロファイルの名前
+    :param bool device: サウンドデバイスの往復の遅延も測るかどうか
+    :return dict: 設定から見積もった遅延, 通話の遅延, サウンドデバイスの遅延, 合計
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.call import Call as CALL
+    from intercom.libs.pjsip.events import CallState
+
+    user_agent = UA("thread", profile=name)
+    settings = user_agent.profile
+    manager = user_agent.endpoint.audDevManager()
+
+    directory = tempfile.mkdtemp()
+    clicks = os.path.join(directory, "clicks.wav")
+    _click_wav(clicks)
+
+    result = {
+        "profile": name,
+        "nominal": settings.nominal_ms,
+        "ptime": settings.ptime,
+        "jb_init": settings.jb_init,
+    }
+
+    if device:
+        recorded = os.path.join(directory, "device.wav")
+        player = pj.AudioMediaPlayer()
+        player.createPlayer(clicks, 0)
+        recorder = pj.AudioMediaRecorder()
+        recorder.createRecorder(recorded)
+        manager.getCaptureDevMedia().startTransmit(recorder)
+        player.startTransmit(recorder)
+        player.startTransmit(manager.getPlaybackDevMedia())
+        _hold(user_agent, PROFILE_SECONDS)
+        del recorder
+        del player
+        result["device"] = _percentiles(_click_delays(recorded))
+
+    manager.setNullDev()
+    port = _port(user_agent)
+
+    accounts = {}
+    for user in ("caller", "callee"):
+        config = pj.AccountConfig()
+        config.idUri = f"sip:{user}@127.0.0.1"
+        accounts[user] = ACC(user_agent.dispatcher)
+        accounts[user].create(config, user == "caller")
+    caller, callee = accounts["caller"], accounts["callee"]
+    callee.buddies.add("sip:caller@127.0.0.1")
+
+    states: list[CallState] = []
+    user_agent.dispatcher.subscribe(CallState, states.append)
+
+    prm = pj.CallOpParam(True)
+    prm.opt.audioCount = 1
+    prm.opt.videoCount = 0
+    call = CALL(caller)
+    call.makeCall(f"sip:callee@127.0.0.1:{port}", prm)
+    caller.calls.add(call)
+    del call
+    _wait(user_agent, lambda: sum(state.confirmed for state in states) >= 2)
+
+    recorded = os.path.join(directory, "call.wav")
+    recorder = pj.AudioMediaRecorder()
+    recorder.createRecorder(recorded)
+    callee.calls.current.getAudioMedia(-1).startTransmit(recorder)
+    player = pj.AudioMediaPlayer()
+    player.createPlayer(clicks, 0)
+    player.startTransmit(recorder)
+    player.startTransmit(caller.calls.current.getAudioMedia(-1))
+    _hold(user_agent, PROFILE_SECONDS)
+    del player
+    del recorder
+
+    caller.calls.current.hangup(pj.CallOpParam())
+    _wait(user_agent, lambda: len(caller.calls) == 0 and len(callee.calls) == 0)
+    user_agent.stop()
+
+    result["call"] = _percentiles(_click_delays(recorded))
+    if device and None not in (result["call"]["median"], result["device"]["median"]):
+        result["total"] = result["call"]["median"] + result["device"]["median"]
+    return result
+
+
+def _echo(account) -> None:
+    """応答側: 受けた音声を、同じ通話で送り返す(会議ブリッジでポートを自身へ接続)
+
+    :param Account account: 応答側のアカウント
+    """
+
+    import pjsua2 as pj
+
+    call = account.calls.current
+    if call is None:
+        return
+    try:
+        media = call.getAudioMedia(-1)
+        media.startTransmit(media)
+    except pj.Error:
+        pass
+
+
+def _callee(user_agent):
+    """応答側のアカウント: caller からの着信に応答し、音声を送り返す
+
+    :param UserAgent user_agent: UserAgent
+    :return Account: アカウント
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.events import CallState
+
+    config = pj.AccountConfig()
+    config.idUri = "sip:callee@127.0.0.1"
+    callee = ACC(user_agent.dispatcher)
+    callee.create(config, False)
+    callee.buddies.add("sip:caller@127.0.0.1")
+
+    def confirmed(state: CallState) -> None:
+        if state.confirmed:
+            _echo(callee)
+
+    user_agent.dispatcher.subscribe(CallState, confirmed)
+    return callee
+
+
+def answer(event_mode: str, name: str) -> None:
+    """ベンチマークの応答側のプロセス
+
+    最初に SIP のポートを JSON で1行書き出し、標準入力が閉じられるまで応答を続ける。
+
+    :param str event_mode: "polling" か "thread"
+    :param str name: コーデックの名前
+    """
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+
+    user_agent = UA(event_mode)
+    user_agent.endpoint.audDevManager().setNullDev()
+    user_agent.configureCodecs(name)
+    callee = _callee(user_agent)
+    print(json.dumps({"port": _port(user_agent)}), flush=True)
+
+    # 呼出側が標準入力を閉じたら終える
+    closed = threading.Event()
+
+    def watch() -> None:
+        sys.stdin.read()
+        closed.set()
+
+    threading.Thread(target=watch, daemon=True).start()
+    while not closed.is_set():
+        user_agent.dispatcher.drain()
+        _step(user_agent, 0.01)
+
+    user_agent.stop()
+    del callee
+
+
+def _dial(user_agent, caller, uri: str):
+    """発信し、呼出側が最初の RTP を受けるまで待つ
+
+    コールバックの時刻は、呼出側の通話(Call のサブクラス)で記録する。
+      invite_200: makeCall() から 200 OK を受けるまで(onCallState)
+      answer_media: 200 OK から、呼出側の音声メディアが有効になるまで(onCallMediaState)
+      answer_rtp: 200 OK から、呼出側が最初の RTP を受けるまで
+
+    :param UserAgent user_agent: UserAgent
+    :param Account caller: 呼出側のアカウント
+    :param str uri: 発信先
+    :return tuple: 通話と、それぞれの時間(秒)
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.call import Call as CALL
+
+    class TimedCall(CALL):
+        """コールバックの時刻を記録する通話"""
+
+        def __init__(self, account):
+            super().__init__(account)
+            self.times: dict[str, float] = {}
+
+        def onCallState(self, prm):
+            now = time.perf_counter()
+            try:
+                if self.getInfo().lastStatusCode == pj.PJSIP_SC_OK:
+                    self.times.setdefault("answered", now)
+            except pj.Error:
+                pass
+            super().onCallState(prm)
+
+        def onCallMediaState(self, prm):
+            self.times.setdefault("media", time.perf_counter())
+            super().onCallMediaState(prm)
+
+    prm = pj.CallOpParam(True)
+    prm.opt.audioCount = 1
+    prm.opt.videoCount = 0
+    call = TimedCall(caller)
+    start = time.perf_counter()
+    call.makeCall(uri, prm)
+    caller.calls.add(call)
+
+    _wait(user_agent, lambda: "answered" in call.times and "media" in call.times)
+
+    def received() -> bool:
+        try:
+            return call.getStreamStat(0).rtcp.rxStat.pkt > 0
+        except pj.Error:
+            return False
+
+    _wait(user_agent, received)
+    first_rtp = time.perf_counter()
+
+    answered = call.times["answered"]
+    return call, {
+        "invite_200": answered - start,
+        "answer_media": max(call.times["media"] - answered, 0.0),
+        "answer_rtp": first_rtp - answered,
+    }
+
+
+def bench(event_mode: str, name: str, calls: int, processes: int) -> dict:
+    """null audio device で直接発信を繰り返し、通話の確立と音声の遅延を測る
+
+    SIPサーバーを使わない。processes が 1 なら同じ UserAgent の caller から callee へ、
+    2 なら answer() を実行する別のプロセスの callee へ発信する。
+      invite_200, answer_media, answer_rtp: _dial() を参照
+      one_way: 最後の通話で、callee が送り返すクリック音の往復の遅延の半分
+
+    :param str event_mode: "polling" か "thread"
+    :param str name: コーデックの名前
+    :param int calls: 通話の回数
+    :param int processes: 1 か 2
+    :return dict: それぞれの中央値, p99, 最大値(ミリ秒)
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.error import PJError
+
+    user_agent = UA(event_mode)
+    user_agent.endpoint.audDevManager().setNullDev()
+    result = {"mode": event_mode, "codec": name, "processes": processes}
+    try:
+        user_agent.configureCodecs(name)
+    except PJError:
+        user_agent.stop()
+        return dict(result, available=False)
+
+    answerer = None
+    if processes == 2:
+        answerer = subprocess.Popen(
+            [sys.executable, "-m", "tests.pjsip_harness", "answer", event_mode, name],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        port = json.loads(answerer.stdout.readline())["port"]
+        callee = None
+    else:
+        port = _port(user_agent)
+        callee = _callee(user_agent)
+
+    config = pj.AccountConfig()
+    config.idUri = "sip:caller@127.0.0.1"
+    caller = ACC(user_agent.dispatcher)
+    caller.create(config, True)
+
+    directory = tempfile.mkdtemp()
+    clicks = os.path.join(directory, "clicks.wav")
+    recorded = os.path.join(directory, "echo.wav")
+    _click_wav(clicks)
+
+    times: dict[str, list[float]] = {
+        key: [] for key in ("invite_200", "answer_media", "answer_rtp")
+    }
+    for number in range(calls):
+        call, setup = _dial(user_agent, caller, f"sip:callee@127.0.0.1:{port}")
+        for key, value in setup.items():
+            times[key].append(value)
+
+        if number == calls - 1:
+            # クリック音そのものと、callee が送り返したクリック音を同じ録音に重ねる
+            recorder = pj.AudioMediaRecorder()
+            recorder.createRecorder(recorded)
+            call.getAudioMedia(-1).startTransmit(recorder)
+            player = pj.AudioMediaPlayer()
+            player.createPlayer(clicks, 0)
+            player.startTransmit(recorder)
+            player.startTransmit(call.getAudioMedia(-1))
+            _hold(user_agent, BENCH_HOLD)
+            del player
+            del recorder
+
+        call.hangup(pj.CallOpParam())
+        _wait(user_agent, lambda: len(caller.calls) == 0)
+        if callee is not None:
+            _wait(user_agent, lambda: len(callee.calls) == 0)
+        del call
+
+    user_agent.stop()
+    if answerer is not None:
+        answerer.stdin.close()
+        answerer.wait(timeout=CALL_TIMEOUT)
+
+    return dict(
+        result,
+        available=True,
+        calls=calls,
+        **{key: _percentiles(values) for key, values in times.items()},
+        one_way=_percentiles([delay / 2 for delay in _click_delays(recorded)]),
+    )
+
+
+def direct(server: str, password: str, calls: int) -> dict:
+    """SIPサーバー(Asterisk)を経由した発信と、直接の発信の確立時間を比べる
+
+    callee("intercom2")は SIPサーバーに登録し、caller("intercom1")は登録しない
+    アカウント(認証だけ)とする。同じ callee へ "sip:intercom2@server"(SIPサーバーの
+    dialplan を経由)と、"sip:intercom2@ip:port"(直接)で交互に発信する。
+
+    :param str server: SIPサーバーのホスト名
+    :param str password: intercom1, intercom2 のパスワード
+    :param int calls: それぞれの通話の回数
+    :return dict: 経路ごとの invite_200, answer_rtp の中央値, p99, 最大値(ミリ秒)
+    """
+
+    import pjsua2 as pj
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+    from intercom.libs.pjsip.account import Account as ACC
+    from intercom.libs.pjsip.events import RegState
+
+    user_agent = UA("thread")
+    user_agent.endpoint.audDevManager().setNullDev()
+    local_name = user_agent.endpoint.transportGetInfo(user_agent.transport_id).localName
+
+    registered: list[RegState] = []
+    user_agent.dispatcher.subscribe(RegState, registered.append)
+
+    accounts = {}
+    for user in ("intercom1", "intercom2"):
+        config = pj.AccountConfig()
+        config.idUri = f"sip:{user}@{server}"
+        if user == "intercom2":
+            config.regConfig.registrarUri = f"sip:{server}"
+        config.sipConfig.authCreds.append(
+            pj.AuthCredInfo("digest", "asterisk", user, 0, password)
+        )
+        accounts[user] = ACC(user_agent.dispatcher)
+        accounts[user].create(config, True)
+    caller, callee = accounts["intercom1"], accounts["intercom2"]
+    callee.buddies.add(f"sip:intercom1@{server}")
+
+    _wait(user_agent, lambda: any(state.active for state in registered))
+
+    routes = {
+        "server": f"sip:intercom2@{server}",
+        "direct": f"sip:intercom2@{local_name}",
+    }
+    times = {route: {"invite_200": [], "answer_rtp": []} for route in routes}
+    for number in range(calls * 2):
+        route = "server" if number % 2 == 0 else "direct"
+        call, setup = _dial(user_agent, caller, routes[route])
+        for key in times[route]:
+            times[route][key].append(setup[key])
+
+        call.hangup(pj.CallOpParam())
+        _wait(user_agent, lambda: len(caller.calls) == 0 and len(callee.calls) == 0)
+        del call
+
+    user_agent.stop()
+
+    return {
+        route: {key: _percentiles(samples) for key, samples in setup.items()}
+        for route, setup in times.items()
+    }
+
+
+def latency(event_mode: str) -> dict:
+    """SIPの応答時間と、UIスレッドのフレームの処理時間を測る
+
+    UIスレッドを模擬して TICK 秒ごとにフレームを処理し、その間に別のスレッドから
+    OPTIONS を送る。"polling" ではフレームごとに libHandleEvents(10) を呼び出す。
+
+    :param str event_mode: "polling" か "thread"
+    :return dict: sip(応答時間), frame(フレームの処理時間)
+    """
+
+    from intercom.libs.pjsip.useragent import UserAgent as UA
+
+    user_agent = UA(event_mode)
+    port = _port(user_agent)
+
+    stop = threading.Event()
+    latencies: list[float] = []
+    prober = threading.Thread(target=_probe, args=(port, stop, latencies))
+    prober.start()
+
+    frames = []
+    start = time.perf_counter()
+    for tick in range(TICKS):
+        deadline = start + tick * TICK
+        now = time.perf_counter()
+        if now < deadline:
+            time.sleep(deadline - now)
+
+        frame = time.perf_counter()
+        if event_mode == "polling":
+            user_agent.endpoint.libHandleEvents(10)
+        user_agent.dispatcher.drain()
+        frames.append(time.perf_counter() - frame)
+
+    stop.set()
+    # "polling" では、応答待ちの OPTIONS を処理してから終える
+    while prober.is_alive():
+        if event_mode == "polling":
+            user_agent.endpoint.libHandleEvents(10)
+        prober.join(0.01)
+
+    user_agent.stop()
+
+    return {
+        "mode": event_mode,
+        "probes": len(latencies),
+        "sip": _percentiles(latencies),
+        "frame": _percentiles(frames),
+    }
+
+
+if __name__ == "__main__":
+    match sys.argv[1:]:
+        case ["latency", event_mode]:
+            print(json.dumps(latency(event_mode)))
+        case ["soak", calls]:
+            print(json.dumps(soak(int(calls))))
+        case ["page", rooms]:
+            print(json.dumps(page(int(rooms))))
+        case ["codec", name]:
+            print(json.dumps(codec(name)))
+        case ["codec", name, wav]:
+            print(json.dumps(codec(name, wav)))
+        case ["adaptive", mode, loss, burst, capacity_kbps]:
+            result = adaptive(mode, float(loss), float(burst), float(capacity_kbps))
+            print(json.dumps(result))
+        case ["profile", name]:
+            print(json.dumps(profile(name)))
+        case ["profile", name, "device"]:
+            print(json.dumps(profile(name, device=True)))
+        case ["bench", event_mode, name, calls, processes]:
+            print(json.dumps(bench(event_mode, name, int(calls), int(processes))))
+        case ["answer", event_mode, name]:
+            answer(event_mode, name)
+        case ["direct", server, password, calls]:
+            print(json.dumps(direct(server, password, int(calls))))
+        case _:
+            print(__doc__)
@@ -0,0 +1,210 @@
+"""test_configgen
+
+部屋の一覧からの設定ファイルの生成: 生成した内容を tests/configgen/expected と
+config/asterisk の内容と比べる(差分を表示する)。部屋が数百でも生成が速く、
+extensions.conf がパターンにまとまること。
+
+生成の内容を意図して変えた時は、環境変数 CONFIGGEN_UPDATE=1 を付けて実行すると
+tests/configgen/expected を書き直す。
+"""
+
+import difflib
+import logging
+import os
+import time
+import unittest
+from configparser import ConfigParser
+from pathlib import Path
+
+from intercom.configgen import (
+    PJSUA_MAX_BUDDIES,
+    _digits,
+    dial_patterns,
+    generate,
+    load_inventory,
+)
+
+logger = logging.getLogger(__name__)
+
+CONFIGGEN_UPDATE = os.environ.get("CONFIGGEN_UPDATE", "") == "1"
+
+ROOT = Path(__file__).parent.parent
+FIXTURES = Path(__file__).parent / "configgen"
+TEMPLATE = (ROOT / "config" / "intercom.ini").read_text(encoding="utf-8")
+
+# 多数の部屋の生成の時間の上限(秒)
+LARGE_ROOMS = 300
+LARGE_SECONDS = 2.0
+
+
+def _inventory(text: str) -> ConfigParser:
+    inventory = ConfigParser()
+    inventory.read_string(text)
+    return inventory
+
+
+def _large_inventory(rooms: int) -> ConfigParser:
+    lines = ["[DEFAULT]", "SipServer = pbx", "Password = secret", "Codecs = opus"]
+    for number in range(rooms):
+        host = f"10.0.{number // 250}.{number % 250}"
+        lines += [f"[ROOM {1000 + number}]", f"Host = {host}"]
+    return _inventory("\n".join(lines))
+
+
+class TestGolden(unittest.TestCase):
+    def assertSameText(self, generated: str, path: Path):
+        """生成した内容とファイルの内容を比べ、違えば差分を表示する"""
+
+        expected = path.read_text(encoding="utf-8")
+        if generated != expected:
+            diff = difflib.unified_diff(
+                expected.splitlines(keepends=True),
+                generated.splitlines(keepends=True),
+                str(path),
+                "generated",
+            )
+            self.fail("".join(diff))
+
+    def test_expected(self):
+        files = generate(
+            _inventory((FIXTURES / "rooms.ini").read_text(encoding="utf-8")), TEMPLATE
+        )
+        self.assertEqual(
+            sorted(files),
+            [
+                "601/intercom.ini",
+                "602/intercom.ini",
+                "603/intercom.ini",
+                "610/intercom.ini",
+                "asterisk/extensions.conf",
+                "asterisk/pjsip.conf",
+                "garage/intercom.ini",
+            ],
+        )
+
+        for name, content in files.items():
+            path = FIXTURES / "expected" / name
+            if CONFIGGEN_UPDATE:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(content, encoding="utf-8")
+            with self.subTest(name):
+                self.assertSameText(content, path)
+
+    def test_shipped(self):
+        # config/asterisk は config/rooms.ini から生成したものと同じ
+        files = generate(
+            _inventory((ROOT / "config" / "rooms.ini").read_text(encoding="utf-8")),
+            TEMPLATE,
+        )
+        for name in ("pjsip.conf", "extensions.conf"):
+            with self.subTest(name):
+                self.assertSameText(
+                    files[f"asterisk/{name}"], ROOT / "config" / "asterisk" / name
+                )
+
+    def test_device_ini(self):
+        # 生成した intercom.ini は、アプリの設定として読める
+        files = generate(
+            _inventory((FIXTURES / "rooms.ini").read_text(encoding="utf-8")), TEMPLATE
+        )
+        config = _inventory(files["601/intercom.ini"])
+
+        self.assertEqual(config["DEFAULT"]["AccountUri"], "sip:601@192.168.1.10")
+        self.assertEqual(config["DEFAULT"]["BuddyUri"], "sip:603@192.168.1.10")
+        self.assertEqual(config["PJSIP"]["CallMode"], "direct")
+        self.assertEqual(config["CODEC"]["Priority"], "opus, pcmu, pcma")
+        self.assertEqual(
+            [section for section in config.sections() if section.startswith("ROOM ")],
+            ["ROOM 602", "ROOM 603", "ROOM 610", "ROOM garage"],
+        )
+        self.assertEqual(config["ROOM 610"]["Direct"], "sip:610@192.168.1.20:5070")
+        self.assertFalse(config.has_option("ROOM garage", "Direct"))
+
+    def test_commented_key(self):
+        # ひな形でコメントにしたキーは、その行で有効にする
+        template = TEMPLATE.replace("\nCallMode = server\n", "\n# CallMode = server\n")
+        self.assertNotEqual(template, TEMPLATE)
+        files = generate(
+            _inventory((FIXTURES / "rooms.ini").read_text(encoding="utf-8")), template
+        )
+        lines = files["601/intercom.ini"].splitlines()
+
+        self.assertIn("CallMode = direct", lines)
+        self.assertNotIn("# CallMode = server", lines)
+        self.assertEqual(files["601/intercom.ini"].count("CallMode ="), 1)
+
+
+class TestDialPatterns(unittest.TestCase):
+    def test_digits(self):
+        self.assertEqual(_digits(list("0123456789")), "X")
+        self.assertEqual(_digits(list("123456789")), "Z")
+        self.assertEqual(_digits(list("23456789")), "N")
+        self.assertEqual(_digits(list("7")), "7")
+        self.assertEqual(_digits(list("12")), "[12]")
+        self.assertEqual(_digits(list("123579")), "[1-3579]")
+
+    def test_patterns(self):
+        self.assertEqual(
+            dial_patterns(["601", "602", "603", "610", "garage", "room9", "room10"]),
+            ["_60[1-3]", "610", "garage", "room9", "room10"],
+        )
+        # パターンで特別な意味を持つ英字(N, X, Z)は [] で囲む
+        self.assertEqual(dial_patterns(["intercom1", "intercom2"]), ["_i[n]tercom[12]"])
+
+
+class TestInventory(unittest.TestCase):
+    def test_errors(self):
+        base = "[DEFAULT]\nSipServer = pbx\nPassword = secret\n"
+        cases = {
+            "codec": base + "Codecs = opus, gsm\n[ROOM 1]\n[ROOM 2]\n",
+            "rooms": base + "[ROOM 1]\n",
+            "buddy": base + "[ROOM 1]\nBuddy = 3\n[ROOM 2]\n",
+            "password": "[DEFAULT]\nSipServer = pbx\n[ROOM 1]\n[ROOM 2]\n",
+        }
+        for name, text in cases.items():
+            with self.subTest(name), self.assertRaises(ValueError):
+                load_inventory(_inventory(text))
+
+    def test_large(self):
+        inventory = _large_inventory(LARGE_ROOMS)
+
+        start = time.perf_counter()
+        with self.assertLogs("intercom.configgen", "WARNING"):
+            files = generate(inventory, TEMPLATE)
+        seconds = time.perf_counter() - start
+        logger.info(
+            f"{LARGE_ROOMS} rooms: {len(files)} files in {seconds * 1000:.0f} ms"
+        )
+
+        self.assertLess(seconds, LARGE_SECONDS)
+        self.assertEqual(len(files), LARGE_ROOMS + 2)
+
+        # 1000 - 1299 は 10部屋ずつ 30 のパターンにまとまる
+        extensions = files["asterisk/extensions.conf"]
+        self.assertEqual(extensions.count("Dial(PJSIP/"), LARGE_ROOMS // 10)
+        self.assertIn("exten = _100X,1,Dial(PJSIP/${EXTEN},3)", extensions)
+
+        # 一斉呼出の通話が pjsua2 の上限を超えるので、放送にする
+        config = _inventory(files["1000/intercom.ini"])
+        self.assertEqual(config["PJSIP"]["MaxCalls"], "32")
+        self.assertEqual(config["MULTICAST"]["PageMode"], "multicast")
+        self.assertEqual(len(config.sections()), 5 + LARGE_ROOMS - 1)
+
+    def test_buddy_limit(self):
+        # 通話相手が pjsua2 の上限を超えたら警告し、それでもすべての部屋を書き出す
+        rooms = PJSUA_MAX_BUDDIES + 2
+        with self.assertLogs("intercom.configgen", "WARNING") as logs:
+            files = generate(_large_inventory(rooms), TEMPLATE)
+        self.assertIn(str(PJSUA_MAX_BUDDIES), logs.output[0])
+
+        config = _inventory(files["1000/intercom.ini"])
+        sections = [section for section in config.sections() if section[:5] == "ROOM "]
+        self.assertEqual(len(sections), rooms - 1)
+
+        # 上限ちょうどなら警告しない
+        with self.assertNoLogs("intercom.configgen", "WARNING"):
+            generate(_large_inventory(PJSUA_MAX_BUDDIES + 1), TEMPLATE)
+
+
+if __name__ == "__main__":
+    unittest.main()
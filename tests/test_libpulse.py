@@ -1,7 +1,14 @@
 """test_libpulse"""
 
+import os
 import unittest
+from unittest import mock
 from intercom.libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+from intercom.libs.pulseaudio.libpulse import PulseaudioConnection as PAC
+from intercom.libs.pulseaudio.libpulse import PAError, PA_INVALID_INDEX
+from intercom.libs.pulseaudio.libpulse import LevelMeterPulseaudio as LPA
+from intercom.libs.pulseaudio.libpulse import VolumeBatch
+from intercom.libs.pulseaudio.libpulse import VolumeRamp, VolumeDucking
 
 
 class TestLibpulse(unittest.TestCase):
@@ -18,11 +25,165 @@ class TestLibpulse(unittest.TestCase):
         with self.assertRaises(KeyError):
             any = VPA(type="ANY", name="VolumeAny")
 
+    def test_connect_failed(self):
+        # 接続できなくても、mainloopのスレッドを残さない
+        tasks = len(os.listdir("/proc/self/task"))
+        server = {"PULSE_SERVER": "unix:/nonexistent/pulse/native"}
+        with mock.patch.dict(os.environ, server):
+            for _ in range(3):
+                with self.assertRaises(PAError):
+                    PAC("failed")
+        self.assertEqual(len(os.listdir("/proc/self/task")), tasks)
+
     def test_value(self):
         speaker = VPA(type="SINK", name="VolmeSpeaker")
         speaker.value = 4000
         self.assertEqual(speaker.value, 4000)
 
+    def test_coalesced_value(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(0).result()
+        count = speaker._write_count
+
+        # スライダーのドラッグを模擬: 途中の音量値は纏められる
+        futures = [speaker.set_value(value) for value in range(0, 65536, 655)]
+        for future in futures:
+            self.assertEqual(future.result(), 65500)
+        self.assertLess(speaker._write_count - count, len(futures))
+        self.assertEqual(speaker.get_value().result(), 65500)
+
+    def test_subscribe_unchanged(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(3000).result()
+        origins = []
+        speaker.subscribe(lambda value, origin: origins.append(origin)).result()
+
+        # 音量値が変わらなければ、callback関数は呼び出されない
+        speaker.set_value(3000).result()
+        self.assertNotIn("LOCAL", origins)
+        speaker.set_value(3500).result()
+        self.assertIn("LOCAL", origins)
+
+    def test_default_device(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        name, index = speaker._connection.devices.default("SINK")
+        self.assertEqual(speaker.facility_name, name)
+        self.assertEqual(speaker._index.value, index)
+
+    def test_device_pending(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(1000).result()
+        name, index = speaker._connection.devices.default("SINK")
+
+        with speaker._connection.locked():
+            speaker._on_device(name, index)
+            future = speaker.set_value(2000)
+            # 新しい操作対象のチャンネル数が分かるまでは送信しない
+            self.assertEqual(speaker._pending, 2000)
+
+        self.assertEqual(future.result(), 2000)
+        self.assertEqual(speaker.get_value().result(), 2000)
+
+    def test_batch(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        mic = VPA(type="SOURCE", name="VolumeMic")
+        batch = VolumeBatch()
+
+        volumes = {
+            ("SINK", speaker.facility_name): 5000,
+            ("SOURCE", mic.facility_name): 6000,
+        }
+        self.assertEqual(batch.set_many(volumes).result(), volumes)
+
+        result = batch.get_all().result()
+        self.assertEqual(result[("SINK", speaker.facility_name)], 5000)
+        self.assertEqual(result[("SOURCE", mic.facility_name)], 6000)
+
+    def test_shared_connection(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        mic = VPA(type="SOURCE", name="VolumeMic")
+        self.assertIs(speaker._connection, mic._connection)
+        self.assertIs(PAC.acquire(), speaker._connection)
+        PAC.release(speaker._connection)
+
+    def test_ramp(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(0).result()
+        ramp = VolumeRamp(speaker)
+
+        future = ramp.ramp(20000, 0.2)
+        self.assertTrue(ramp.active)
+        self.assertEqual(future.result(timeout=2), 20000)
+        self.assertFalse(ramp.active)
+        self.assertGreater(ramp._tick_count, 0)
+        self.assertEqual(speaker.get_value().result(), 20000)
+
+    def test_ramp_coalesced(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(0).result()
+        ramp = VolumeRamp(speaker)
+
+        # ランプ中の新しいランプは、前のランプを取り消して引き継ぐ
+        first = ramp.ramp(60000, 1.0)
+        second = ramp.ramp(10000, 0.1)
+        self.assertTrue(first.cancelled())
+        self.assertEqual(second.result(timeout=2), 10000)
+        self.assertEqual(speaker.get_value().result(), 10000)
+
+    def test_ramp_cancel(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(0).result()
+        ramp = VolumeRamp(speaker)
+
+        future = ramp.ramp(60000, 10.0)
+        ramp.cancel()
+        self.assertTrue(future.cancelled())
+        self.assertFalse(ramp.active)
+        self.assertLess(speaker.get_value().result(), 60000)
+
+    def test_fade(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(30000).result()
+        ramp = VolumeRamp(speaker)
+
+        self.assertEqual(ramp.fade_out(0.1).result(timeout=2), 0)
+        self.assertEqual(ramp.fade_in(0.1).result(timeout=2), 30000)
+        self.assertEqual(speaker.get_value().result(), 30000)
+
+    def test_ducking(self):
+        speaker = VPA(type="SINK", name="VolumeSpeaker")
+        speaker.set_value(30000).result()
+        ramp = VolumeRamp(speaker)
+        ducking = VolumeDucking(ramp, threshold=0.1, depth=0.5, attack=0.0, hold=0.0)
+
+        ducking.active = True
+        ducking.on_level(0.5, 0.3)
+        self.assertTrue(ducking.ducked)
+        self.assertEqual(ramp.level, 15000)
+
+        ducking.active = False
+        self.assertFalse(ducking.ducked)
+        self.assertEqual(ramp.level, 30000)
+
+    def test_level_device(self):
+        meter = LPA("SOURCE", "mic-level")
+        meter.start(lambda peak, rms: None)
+        name, index = meter._connection.devices.default("SOURCE")
+
+        # デフォルトが抜かれても測定中のままで、次のデフォルトで開き直す
+        with meter._connection.locked():
+            meter._on_device(None, PA_INVALID_INDEX)
+        self.assertTrue(meter.active)
+        self.assertIsNone(meter._stream)
+
+        with meter._connection.locked():
+            meter._on_device(name, index)
+        self.assertIsNotNone(meter._stream)
+
+        meter.stop()
+        self.assertFalse(meter.active)
+        self.assertIsNone(meter._stream)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,252 @@
+"""test_libpulse_benchmark
+
+VolumePulseaudio の value の読み書きのマイクロベンチマーク
+LevelMeterPulseaudio のCPU使用率の測定
+VolumeRamp のオーバーヘッドの測定
+
+ローカルに起動した pulseaudio (--system=false, null-sink) に接続し、
+1操作あたりの時間(ns/op)とメモリ確保(blocks/op, objects/op)を表示する。
+"""
+
+import gc
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+ITERATIONS = 10000
+# レベルメーターを動かす時間(秒)
+METER_SECONDS = 5.0
+# ランプの時間(秒)
+RAMP_SECONDS = 1.0
+
+_daemon: subprocess.Popen | None = None
+_runtime_dir: tempfile.TemporaryDirectory | None = None
+
+
+def setUpModule():
+    """null-sink と null-source だけを持つ pulseaudio を起動する"""
+
+    global _daemon, _runtime_dir
+
+    if shutil.which("pulseaudio") is None:
+        raise unittest.SkipTest("pulseaudio が見つからない")
+
+    _runtime_dir = tempfile.TemporaryDirectory()
+    socket = Path(_runtime_dir.name) / "native"
+    script = Path(_runtime_dir.name) / "bench.pa"
+    script.write_text(
+        f"load-module module-native-protocol-unix socket={socket}\n"
+        "load-module module-null-sink sink_name=bench_sink\n"
+        "load-module module-null-source source_name=bench_source\n"
+        "set-default-sink bench_sink\n"
+        "set-default-source bench_source\n"
+    )
+
+    env = dict(os.environ, XDG_RUNTIME_DIR=_runtime_dir.name)
+    _daemon = subprocess.Popen(
+        [
+            "pulseaudio",
+            "--system=false",
+            "--daemonize=no",
+            "--exit-idle-time=-1",
+            "-n",
+            f"--file={script}",
+        ],
+        env=env,
+    )
+
+    for _ in range(100):
+        if socket.exists():
+            break
+        time.sleep(0.05)
+
+    os.environ["PULSE_SERVER"] = f"unix:{socket}"
+
+
+def tearDownModule():
+    if _daemon is not None:
+        _daemon.terminate()
+        _daemon.wait()
+    if _runtime_dir is not None:
+        _runtime_dir.cleanup()
+
+
+def _bench(label: str, operation) -> dict:
+    """1操作あたりの時間とメモリ確保を測る
+
+    :param str label: 表示名
+    :param Callable operation: 測定する操作
+    :return dict: ns/op, blocks/op, objects/op
+    """
+
+    for _ in range(100):
+        operation()
+
+    gc.collect()
+    gc.disable()
+    try:
+        objects = len(gc.get_objects())
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter_ns()
+        for _ in range(ITERATIONS):
+            operation()
+        elapsed = time.perf_counter_ns() - start
+        blocks = sys.getallocatedblocks() - blocks
+        objects = len(gc.get_objects()) - objects
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    for _ in range(ITERATIONS):
+        operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "ns/op": elapsed / ITERATIONS,
+        "blocks/op": blocks / ITERATIONS,
+        "objects/op": objects / ITERATIONS,
+        "peak": peak,
+    }
+    logger.info(
+        f"{label:24s} {result['ns/op']:10.0f} ns/op "
+        f"{result['blocks/op']:8.3f} blocks/op "
+        f"{result['objects/op']:8.3f} objects/op "
+        f"{result['peak']:8d} peak bytes"
+    )
+    return result
+
+
+def _cpu_seconds(pid: int) -> float:
+    """プロセスのCPU時間(user + system)
+
+    :param int pid: プロセスID
+    :return float: CPU時間(秒)
+    """
+
+    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    # utime, stime は stat の14, 15番目(pid と comm を除いて数えると12, 13番目)
+    ticks = int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+class TestLibpulseBenchmark(unittest.TestCase):
+    def setUp(self):
+        from intercom.libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+
+        self.speaker = VPA(type="SINK", name="BenchSpeaker")
+        self.mic = VPA(type="SOURCE", name="BenchMic")
+        self.speaker.subscribe(lambda value, origin: None).result()
+        self.mic.subscribe(lambda value, origin: None).result()
+
+    def tearDown(self):
+        # 書き込みキューを空にしてから次のベンチマークへ
+        self.speaker.set_value(self.speaker.value).result()
+        self.mic.set_value(self.mic.value).result()
+
+    def test_value_get(self):
+        result = _bench("value get (subscribed)", lambda: self.speaker.value)
+        self.assertLess(result["blocks/op"], 0.01)
+
+    def test_value_set(self):
+        values = iter(range(10**9))
+
+        def operation():
+            self.speaker.value = next(values) % 65536
+
+        result = _bench("value set (coalesced)", operation)
+        self.assertLess(result["objects/op"], 0.01)
+
+    def test_get_value_round_trip(self):
+        _bench("get_value().result()", lambda: self.mic.get_value().result())
+
+
+class TestLevelMeterBenchmark(unittest.TestCase):
+    def test_meter_cpu(self):
+        """マイクとスピーカーのレベルメーターを動かした時のCPU使用率"""
+
+        from intercom.libs.pulseaudio.libpulse import LevelMeterPulseaudio as LPA
+
+        calls = {"SOURCE": 0, "SINK": 0}
+
+        def counter(type):
+            def callback(peak, rms):
+                calls[type] += 1
+
+            return callback
+
+        mic = LPA("SOURCE", "BenchMicLevel")
+        speaker = LPA("SINK", "BenchSpeakerLevel")
+
+        client = time.process_time()
+        daemon = _cpu_seconds(_daemon.pid)
+        mic.start(counter("SOURCE"))
+        speaker.start(counter("SINK"))
+        time.sleep(METER_SECONDS)
+        mic.stop()
+        speaker.stop()
+        client = (time.process_time() - client) / METER_SECONDS * 100
+        daemon = (_cpu_seconds(_daemon.pid) - daemon) / METER_SECONDS * 100
+
+        logger.info(
+            f"level meter x2 {client:6.2f} % client {daemon:6.2f} % daemon "
+            f"{calls['SOURCE']:4d} / {calls['SINK']:4d} callbacks"
+        )
+        self.assertGreater(calls["SOURCE"], 0)
+        self.assertGreater(calls["SINK"], 0)
+        self.assertLess(client, 5.0)
+
+
+class TestVolumeRampBenchmark(unittest.TestCase):
+    def setUp(self):
+        from intercom.libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+        from intercom.libs.pulseaudio.libpulse import VolumeRamp
+
+        self.speaker = VPA(type="SINK", name="BenchSpeaker")
+        self.speaker.set_value(0).result()
+        self.ramp = VolumeRamp(self.speaker)
+
+    def test_ramp_call(self):
+        """ramp() の呼び出しは待たない(ランプ中の呼び出しは纏められる)"""
+
+        targets = iter(range(10**9))
+        result = _bench(
+            "ramp() (coalesced)",
+            lambda: self.ramp.ramp(next(targets) % 65536, RAMP_SECONDS),
+        )
+        self.ramp.cancel()
+        self.assertLess(result["ns/op"], 1_000_000)
+
+    def test_ramp_overhead(self):
+        """1回のランプのCPU時間と、サーバーへの書き込み回数"""
+
+        writes = self.speaker._write_count
+        client = time.process_time()
+        daemon = _cpu_seconds(_daemon.pid)
+        start = time.perf_counter()
+        self.ramp.ramp(65535, RAMP_SECONDS).result(timeout=RAMP_SECONDS + 5)
+        elapsed = time.perf_counter() - start
+        client = (time.process_time() - client) / elapsed * 100
+        daemon = (_cpu_seconds(_daemon.pid) - daemon) / elapsed * 100
+        writes = self.speaker._write_count - writes
+
+        logger.info(
+            f"ramp {RAMP_SECONDS:.1f}s {elapsed:6.3f} s {client:6.2f} % client "
+            f"{daemon:6.2f} % daemon {self.ramp._tick_count:4d} ticks "
+            f"{writes:4d} writes"
+        )
+        self.assertGreaterEqual(elapsed, RAMP_SECONDS)
+        self.assertLessEqual(writes, self.ramp._tick_count + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""test_libpulse_latency
+
+時間の比較は環境変数 BENCHMARK=1 のときだけ確かめる。
+"""
+
+import logging
+import os
+import statistics
+import time
+import unittest
+
+from intercom.libs.pulseaudio.libpulse import VolumePulseaudio as VPA
+from intercom.libs.pulseaudio.libpulse import VolumeBatch
+
+logger = logging.getLogger(__name__)
+
+# UIの1フレームの間隔(秒)
+TICK = 0.01
+TICKS = 200
+# 時間の比較を確かめる(計測する環境によって結果が変わるので、既定では確かめない)
+BENCHMARK = os.environ.get("BENCHMARK", "") == "1"
+
+
+def _run_ticks(work) -> list[float]:
+    """UIのtickを模擬し、各tickの開始時刻の予定からのずれ(jitter)を返す
+
+    :param Callable work: 1tickごとに実行する処理
+    :return list[float]: jitter(秒)のリスト
+    """
+
+    jitters = []
+    start = time.perf_counter()
+    for tick in range(TICKS):
+        deadline = start + tick * TICK
+        now = time.perf_counter()
+        if now < deadline:
+            time.sleep(deadline - now)
+        jitters.append(time.perf_counter() - deadline)
+        work()
+
+    return jitters
+
+
+def _report(label: str, jitters: list[float]) -> dict:
+    result = {
+        "median": statistics.median(jitters) * 1e3,
+        "p99": statistics.quantiles(jitters, n=100)[98] * 1e3,
+        "max": max(jitters) * 1e3,
+    }
+    logger.info(
+        f"{label}: median {result['median']:.3f} ms, "
+        f"p99 {result['p99']:.3f} ms, max {result['max']:.3f} ms"
+    )
+    return result
+
+
+class TestLibpulseLatency(unittest.TestCase):
+    """UIスレッドのtick jitterを、ブロックする場合としない場合で比較する"""
+
+    def setUp(self):
+        self.mic = VPA(type="SOURCE", name="LatencyMic")
+        self.speaker = VPA(type="SINK", name="LatencySpeaker")
+
+    def test_tick_jitter(self):
+        # 変更前: tickごとに音量値を取得し、完了を待つ
+        def blocking():
+            self.mic.get_value().result()
+            self.speaker.get_value().result()
+
+        # 変更後: 購読モードで、通知で更新された音量値を読むだけ
+        def nonblocking():
+            _ = self.mic.value
+            _ = self.speaker.value
+
+        before = _report("blocking", _run_ticks(blocking))
+
+        self.mic.subscribe(lambda value, origin: None).result()
+        self.speaker.subscribe(lambda value, origin: None).result()
+        after = _report("nonblocking", _run_ticks(nonblocking))
+
+        # 購読モードでは、通知で更新された音量値を読むだけで、取得した値と同じ
+        self.assertEqual(self.mic.value, self.mic.get_value().result())
+        self.assertEqual(self.speaker.value, self.speaker.get_value().result())
+        if BENCHMARK:
+            self.assertLessEqual(after["median"], before["median"])
+
+    def test_batch_latency(self):
+        batch = VolumeBatch()
+
+        # 変更前: マイクとスピーカーを1つずつ往復
+        def serialized():
+            self.mic.get_value().result()
+            self.speaker.get_value().result()
+
+        # 変更後: 纏めて要求し、纏めて待つ
+        def pipelined():
+            batch.get_all().result()
+
+        def measure(work) -> float:
+            start = time.perf_counter()
+            for _ in range(TICKS):
+                work()
+            return (time.perf_counter() - start) / TICKS * 1e3
+
+        before = measure(serialized)
+        after = measure(pipelined)
+        logger.info(f"serialized: {before:.3f} ms, pipelined: {after:.3f} ms")
+
+        # sinkの一覧とsourceの一覧を纏めて取得する
+        kinds = {kind for kind, _ in batch.get_all().result()}
+        self.assertEqual(kinds, {"SINK", "SOURCE"})
+        if BENCHMARK:
+            # 往復を纏めるので、1つずつ往復するより遅くならない
+            self.assertLessEqual(after, before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+"""test_pjsip_adaptive
+
+Opus の設定の適応: RTCP の累積値からの判断、パケットロスのある中継(LossyRelay)、
+中継を通した Opus の固定設定と適応の比較(途切れの割合と送信のビットレート)。
+
+比較のロス率(%)、続けて落ちる平均のパケット数、帯域(kbps)は、環境変数
+ADAPTIVE_LOSS, ADAPTIVE_BURST, ADAPTIVE_CAPACITY で変えられる(既定は 5, 2, 40)。
+"""
+
+import importlib.util
+import logging
+import os
+import socket
+import time
+import unittest
+
+from intercom.libs.pjsip.adaptive import AdaptiveOpus, AdaptivePolicy
+from intercom.libs.pjsip.codec import OpusSettings
+from tests.lossy_relay import LossyRelay
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_LOSS = os.environ.get("ADAPTIVE_LOSS", "5")
+ADAPTIVE_BURST = os.environ.get("ADAPTIVE_BURST", "2")
+ADAPTIVE_CAPACITY = os.environ.get("ADAPTIVE_CAPACITY", "40")
+
+
+class TestAdaptiveOpus(unittest.TestCase):
+    def setUp(self):
+        self.adaptive = AdaptiveOpus(OpusSettings(bitrate=24000), AdaptivePolicy())
+        self.rx = [0, 0]
+        self.tx = [0, 0]
+
+    def _update(self, packets: int = 100, rx_lost: int = 0, tx_lost: int = 0):
+        """区間の値を累積値に加えて update() する"""
+
+        self.rx[0] += packets - rx_lost
+        self.rx[1] += rx_lost
+        self.tx[0] += packets
+        self.tx[1] += tx_lost
+        return self.adaptive.update(*self.rx, *self.tx, 5.0)
+
+    def test_first_sample(self):
+        self.assertIsNone(self._update(rx_lost=50))
+
+    def test_degrade_recover(self):
+        self._update()
+
+        # 相手の受信報告で 10 % のロス: FEC を有効にし、ビットレートを下げる
+        settings = self._update(tx_lost=10)
+        self.assertEqual(settings.bitrate, 16000)
+        self.assertEqual(settings.packet_loss, 10)
+        self.assertTrue(settings.fec)
+
+        # 悪化が続けば、さらに下げる
+        settings = self._update(rx_lost=8)
+        self.assertEqual(settings.bitrate, 12000)
+        self.assertEqual(settings.packet_loss, 10)
+
+        # ロスの無い状態が hold 回続いたら、1段戻す
+        self.assertIsNone(self._update())
+        self.assertIsNone(self._update())
+        settings = self._update()
+        self.assertEqual(settings.bitrate, 16000)
+        self.assertEqual(settings.packet_loss, 0)
+        self.assertFalse(settings.fec)
+
+    def test_moderate_loss(self):
+        self._update()
+
+        # 悪化とも回復ともいえないロス: ビットレートは変えずに FEC だけ有効にする
+        settings = self._update(rx_lost=1)
+        self.assertEqual(settings.bitrate, 24000)
+        self.assertEqual(settings.packet_loss, 5)
+        self.assertTrue(settings.fec)
+        self.assertIsNone(self._update(rx_lost=1))
+
+    def test_restarted_stream(self):
+        self._update()
+        self.rx = [0, 0]
+        self.tx = [0, 0]
+
+        # re-INVITE で累積値が戻った回は判断しない
+        self.assertIsNone(self._update(rx_lost=50))
+        self.assertIsNotNone(self._update(rx_lost=50))
+
+    def test_few_packets(self):
+        self._update()
+        self.assertIsNone(self._update(packets=10, rx_lost=5))
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestLossyRelay(unittest.TestCase):
+    def setUp(self):
+        self.a_port = _free_port()
+        self.b_port = _free_port()
+
+    def _relay(self, **kwargs) -> LossyRelay:
+        relay = LossyRelay(
+            ("127.0.0.3", self.a_port),
+            ("127.0.0.1", self.a_port),
+            ("127.0.0.2", self.b_port),
+            ("127.0.0.1", self.b_port),
+            **kwargs,
+        )
+        self.addCleanup(relay.close)
+        return relay
+
+    def test_gilbert_elliott(self):
+        relay = self._relay(loss=0.1, burst=3.0, seed=1)
+
+        dropped = [not relay.forward(bytes(100), 0.0) for _ in range(20000)]
+        runs = [
+            number
+            for number in range(1, len(dropped))
+            if dropped[number - 1] and not dropped[number]
+        ]
+
+        self.assertAlmostEqual(relay.loss, 0.1, delta=0.02)
+        # 続けて落ちるパケット数の平均
+        self.assertAlmostEqual(sum(dropped) / len(runs), 3.0, delta=0.5)
+
+    def test_capacity(self):
+        relay = self._relay(capacity_bps=80000)
+
+        # 50 パケット/秒 x 228 バイト = 91.2 kbps は、80 kbps を超える
+        start = time.monotonic() + 1.0
+        delivered = sum(
+            relay.forward(bytes(200), start + number * 0.02) for number in range(500)
+        )
+
+        self.assertAlmostEqual(delivered / 500, 80000 / 91200, delta=0.03)
+        self.assertEqual(relay.dropped_loss, 0)
+
+    def test_forward(self):
+        self._relay()
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as a, socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM
+        ) as b:
+            a.bind(("127.0.0.1", self.a_port))
+            b.bind(("127.0.0.1", self.b_port))
+            a.settimeout(1.0)
+            b.settimeout(1.0)
+
+            # どちらの端点からも、相手は SDP に書かれたアドレスから送ってくる
+            a.sendto(b"to b", ("127.0.0.2", self.b_port))
+            self.assertEqual(b.recvfrom(100), (b"to b", ("127.0.0.3", self.a_port)))
+            b.sendto(b"to a", ("127.0.0.3", self.a_port))
+            self.assertEqual(a.recvfrom(100), (b"to a", ("127.0.0.2", self.b_port)))
+
+
+def _adaptive(mode: str) -> dict:
+    """中継を通した通話の計測を別のプロセスで実行する
+
+    :param str mode: "fixed" か "adaptive"
+    :return dict: 計測結果
+    """
+
+    return run(
+        "adaptive", mode, ADAPTIVE_LOSS, ADAPTIVE_BURST, ADAPTIVE_CAPACITY, timeout=180
+    )
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestAdaptiveBenchmark(unittest.TestCase):
+    def test_fixed_adaptive(self):
+        results = {mode: _adaptive(mode) for mode in ("fixed", "adaptive")}
+        if not results["fixed"]["available"]:
+            self.skipTest("Opus が pjsua2 に組み込まれていない")
+
+        for mode, result in results.items():
+            logger.info(
+                f"{mode:8s} dropouts {result['dropouts']:5.1f} % "
+                f"relay loss {result['loss']:5.1f} % "
+                f"offered {result['offered'] / 1000:5.1f} kbps "
+                f"changes {result['changes']} -> {result['bitrate']} bps "
+                f"packet_loss {result['packet_loss']} % FEC {result['fec']}"
+            )
+
+        # 同じか少ない送信量で、途切れが同じか少ない
+        fixed, adaptive = results["fixed"], results["adaptive"]
+        self.assertLessEqual(adaptive["offered"], fixed["offered"] * 1.05)
+        self.assertLessEqual(adaptive["dropouts"], fixed["dropouts"])
+
+
+if __name__ == "__main__":
+    unittest.main()
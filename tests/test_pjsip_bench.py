@@ -0,0 +1,159 @@
+"""test_pjsip_bench
+
+SIPサーバーを使わないベンチマーク: null audio device と直接発信で、
+INVITE から 200 OK まで、200 OK から音声メディアと最初の RTP まで、片方向の音声の遅延を
+イベント処理("polling", "thread")と、1つ/2つのプロセスの組み合わせごとに測る。
+
+環境変数
+  BENCH_CALLS: 組み合わせごとの通話の回数(既定 20)
+  BENCH_CODECS: コーデックの名前(既定 pcmu、"opus, pcmu" のように複数を指定できる)
+  BENCH_OUTPUT: 結果を書き出すJSON(次回の BENCH_BASELINE にする)
+  BENCH_BASELINE: 比べる前回の結果のJSON。中央値が BENCH_TOLERANCE 倍
+                  (既定 1.5)と BENCH_SLACK ミリ秒(既定 2)を超えたら失敗する
+"""
+
+import importlib.util
+import json
+import logging
+import os
+import unittest
+
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+BENCH_CALLS = os.environ.get("BENCH_CALLS", "20")
+BENCH_CODECS = [
+    name.strip() for name in os.environ.get("BENCH_CODECS", "pcmu").split(",")
+]
+BENCH_OUTPUT = os.environ.get("BENCH_OUTPUT", "")
+BENCH_BASELINE = os.environ.get("BENCH_BASELINE", "")
+BENCH_TOLERANCE = float(os.environ.get("BENCH_TOLERANCE", "1.5"))
+BENCH_SLACK = float(os.environ.get("BENCH_SLACK", "2"))
+
+# 比べる値
+METRICS = ("invite_200", "answer_media", "answer_rtp", "one_way")
+
+
+def _key(result: dict) -> str:
+    return f"{result['mode']}/{result['processes']}/{result['codec']}"
+
+
+def _regressions(
+    results: dict, baseline: dict, tolerance: float, slack: float
+) -> list[str]:
+    """前回の結果より遅くなった値
+
+    :param dict results: 今回の結果(_key() -> 結果)
+    :param dict baseline: 前回の結果(_key() -> 結果)
+    :param float tolerance: 許す倍率
+    :param float slack: 許す差(ミリ秒): 1ミリ秒に満たない値の揺らぎを除く
+    :return list[str]: 遅くなった値の説明
+    """
+
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None or not result.get("available"):
+            continue
+
+        for metric in METRICS:
+            now, then = result[metric]["median"], before[metric]["median"]
+            if now is None or then is None:
+                continue
+            if now > then * tolerance + slack:
+                regressions.append(f"{key} {metric}: {then:.1f} -> {now:.1f} ms")
+
+    return regressions
+
+
+class TestRegressions(unittest.TestCase):
+    def _result(self, median: float | None) -> dict:
+        values = {"median": median, "p99": median, "max": median}
+        return dict(
+            {metric: values for metric in METRICS},
+            mode="thread",
+            processes=1,
+            codec="pcmu",
+            available=True,
+        )
+
+    def test_regressions(self):
+        baseline = {"thread/1/pcmu": self._result(10.0)}
+
+        # 倍率と差の両方を超えたら遅くなった
+        self.assertEqual(
+            _regressions({"thread/1/pcmu": self._result(16.0)}, baseline, 1.5, 0.5),
+            [f"thread/1/pcmu {metric}: 10.0 -> 16.0 ms" for metric in METRICS],
+        )
+        self.assertEqual(
+            _regressions({"thread/1/pcmu": self._result(16.0)}, baseline, 1.5, 2.0),
+            [],
+        )
+
+    def test_missing(self):
+        # 前回に無い組み合わせと、測れなかった値は比べない
+        results = {"thread/2/pcmu": self._result(100.0)}
+        baseline = {"thread/1/pcmu": self._result(1.0)}
+        self.assertEqual(_regressions(results, baseline, 1.5, 2.0), [])
+
+        results = {"thread/1/pcmu": self._result(None)}
+        self.assertEqual(_regressions(results, baseline, 1.5, 2.0), [])
+
+
+def _bench(event_mode: str, name: str, processes: int) -> dict:
+    """ベンチマークを別のプロセスで実行する
+
+    :param str event_mode: "polling" か "thread"
+    :param str name: コーデックの名前
+    :param int processes: 1 か 2
+    :return dict: 計測結果
+    """
+
+    return run("bench", event_mode, name, BENCH_CALLS, processes, timeout=300)
+
+
+def _log(result: dict) -> None:
+    line = f"{_key(result):18s}"
+    for metric in METRICS:
+        values = result[metric]
+        if values["median"] is None:
+            line += f" {metric} -"
+        else:
+            line += f" {metric} {values['median']:6.1f}/{values['p99']:6.1f}"
+    logger.info(line + " ms (median/p99)")
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestPjsipBench(unittest.TestCase):
+    def test_bench(self):
+        results = {}
+        for name in BENCH_CODECS:
+            for event_mode in ("polling", "thread"):
+                for processes in (1, 2):
+                    result = _bench(event_mode, name, processes)
+                    if not result["available"]:
+                        continue
+                    results[_key(result)] = result
+                    _log(result)
+
+                    # 通話ごとに確立し、送り返したクリック音が届いた
+                    self.assertEqual(result["calls"], int(BENCH_CALLS))
+                    self.assertIsNotNone(result["one_way"]["median"])
+
+        if not results:
+            self.skipTest(f"コーデック {', '.join(BENCH_CODECS)} が使えない")
+
+        if BENCH_OUTPUT:
+            with open(BENCH_OUTPUT, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2)
+
+        if BENCH_BASELINE:
+            with open(BENCH_BASELINE, encoding="utf-8") as file:
+                baseline = json.load(file)
+            regressions = _regressions(results, baseline, BENCH_TOLERANCE, BENCH_SLACK)
+            self.assertEqual(regressions, [], "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""test_pjsip_codec
+
+コーデックの優先度の決め方と、null audio device でのコーデックごとの
+ストリームあたりのCPU使用率と送信のビットレート(ヘッダを含む)の表示。
+
+計測するコーデックは環境変数 CODECS で変えられる(既定は "opus, g722, pcmu")。
+基準の WAV は環境変数 CODEC_WAV で指定できる(省略時は掃引音)。
+"""
+
+import importlib.util
+import logging
+import os
+import unittest
+from types import SimpleNamespace
+
+from intercom.libs.pjsip.codec import (
+    PRIORITY_DISABLED,
+    PRIORITY_MAX,
+    apply_codecs,
+    codec_priorities,
+    parse_codecs,
+)
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+CODECS = os.environ.get("CODECS", "opus, g722, pcmu")
+CODEC_WAV = os.environ.get("CODEC_WAV")
+
+# pjsua2 が持つコーデックの codec id の例
+CODEC_IDS = [
+    "speex/16000/1",
+    "speex/8000/1",
+    "iLBC/8000/1",
+    "GSM/8000/1",
+    "PCMU/8000/1",
+    "PCMA/8000/1",
+    "G722/16000/1",
+    "opus/48000/2",
+]
+
+
+class TestCodecPriorities(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_codecs("Opus, g722 ,pcmu,"), ["opus/48000", "G722/16000", "PCMU/8000"]
+        )
+        self.assertEqual(parse_codecs("speex/8000"), ["speex/8000"])
+        with self.assertRaises(ValueError):
+            parse_codecs("g729")
+
+    def test_priorities(self):
+        priorities = codec_priorities(parse_codecs("opus, g722, pcmu"), CODEC_IDS)
+
+        self.assertEqual(priorities["opus/48000/2"], PRIORITY_MAX)
+        self.assertEqual(priorities["G722/16000/1"], PRIORITY_MAX - 1)
+        self.assertEqual(priorities["PCMU/8000/1"], PRIORITY_MAX - 2)
+        # 指定しなかったコーデックは無効
+        for codec_id in ("speex/16000/1", "speex/8000/1", "iLBC/8000/1", "PCMA/8000/1"):
+            self.assertEqual(priorities[codec_id], PRIORITY_DISABLED)
+
+    def test_unavailable(self):
+        # Opus を組み込まずにビルドした pjsua2
+        priorities = codec_priorities(parse_codecs("opus, pcmu"), CODEC_IDS[:-1])
+
+        self.assertNotIn("opus/48000/2", priorities)
+        self.assertEqual(priorities["PCMU/8000/1"], PRIORITY_MAX - 1)
+
+
+class _Endpoint:
+    """apply_codecs が使うメソッドだけを持つ Endpoint"""
+
+    def __init__(self, codec_ids: list[str]):
+        self.params = {
+            codec_id: SimpleNamespace(setting=SimpleNamespace(vad=True))
+            for codec_id in codec_ids
+        }
+        self.priorities: dict[str, int] = {}
+
+    def codecEnum2(self) -> list:
+        return [SimpleNamespace(codecId=codec_id) for codec_id in self.params]
+
+    def codecSetPriority(self, codec_id: str, priority: int) -> None:
+        self.priorities[codec_id] = priority
+
+    def codecGetParam(self, codec_id: str):
+        return self.params[codec_id]
+
+    def codecSetParam(self, codec_id: str, param) -> None:
+        self.params[codec_id] = param
+
+
+class TestApplyCodecs(unittest.TestCase):
+    def test_vad(self):
+        endpoint = _Endpoint(CODEC_IDS)
+        enabled = apply_codecs(endpoint, parse_codecs("opus, g722, pcmu"))
+
+        self.assertEqual(enabled, ["opus/48000/2", "G722/16000/1", "PCMU/8000/1"])
+        # VAD を止めるのは Opus だけ
+        self.assertFalse(endpoint.params["opus/48000/2"].setting.vad)
+        self.assertTrue(endpoint.params["G722/16000/1"].setting.vad)
+        self.assertTrue(endpoint.params["PCMU/8000/1"].setting.vad)
+
+
+def _codec(name: str) -> dict:
+    """コーデックの計測を別のプロセスで実行する
+
+    :param str name: コーデックの名前
+    :return dict: 計測結果
+    """
+
+    args = ["codec", name]
+    if CODEC_WAV:
+        args.append(CODEC_WAV)
+
+    return run(*args, timeout=120)
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestCodecBenchmark(unittest.TestCase):
+    def test_codecs(self):
+        for name in (name.strip() for name in CODECS.split(",")):
+            result = _codec(name)
+            if not result["available"]:
+                logger.info(f"{name:6s} は pjsua2 に組み込まれていない")
+                continue
+
+            logger.info(
+                f"{result['negotiated']:16s} cpu/stream {result['cpu']:6.2f} % "
+                f"payload {result['payload'] / 1000:6.1f} kbps "
+                f"wire {result['wire'] / 1000:6.1f} kbps "
+                f"{result['packets']:5.1f} pkt/s"
+            )
+            self.assertTrue(result["negotiated"].lower().startswith(name.lower()))
+            self.assertGreater(result["packets"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
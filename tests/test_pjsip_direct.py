@@ -0,0 +1,134 @@
+"""test_pjsip_direct
+
+部屋への直接の発信: 発信先の選び方と、SIPサーバーを経由した発信への切り替え、
+音声(RTP)の経路(direct か anchored)の判定、
+SIPサーバー(Asterisk)を経由した発信と直接の発信の確立時間の比較。
+
+比較には config/asterisk の設定の Asterisk が必要で、環境変数 SIP_SERVER にホスト名
+(intercom1 など)を付ける。パスワードは SIP_PASSWORD(既定 unsecurepassword)、
+通話の回数は DIRECT_CALLS(既定 20)で変えられる。
+"""
+
+import importlib.util
+import logging
+import os
+import unittest
+
+from intercom.libs.pjsip.direct import (
+    MEDIA_ANCHORED,
+    MEDIA_DIRECT,
+    DirectDial,
+    media_path,
+    resolve_hosts,
+)
+from intercom.libs.pjsip.events import CallState
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+SIP_SERVER = os.environ.get("SIP_SERVER", "")
+SIP_PASSWORD = os.environ.get("SIP_PASSWORD", "unsecurepassword")
+DIRECT_CALLS = os.environ.get("DIRECT_CALLS", "20")
+
+ROOM = "sip:intercom2@intercom1"
+DIRECT = "sip:intercom2@192.168.1.12:5060"
+
+
+class TestDirectDial(unittest.TestCase):
+    def setUp(self):
+        self.direct = DirectDial({ROOM: DIRECT}, fallback=True, timeout=2.0)
+
+    def test_target(self):
+        self.assertEqual(self.direct.target("<SIP:Intercom2@intercom1>"), DIRECT)
+        self.assertEqual(
+            self.direct.target("sip:intercom3@intercom1"), "sip:intercom3@intercom1"
+        )
+
+    def test_answered(self):
+        self.direct.started(1, ROOM, 0.0)
+
+        # 180 Ringing が届いたら、以後は通常の通話
+        self.assertIsNone(self.direct.update(CallState(1, 3, "EARLY", 180)))
+        self.assertEqual(len(self.direct), 0)
+        self.assertEqual(self.direct.expired(10.0), [])
+        self.assertIsNone(self.direct.update(CallState(1, 6, "DISCONNCTD", 200)))
+
+    def test_unreachable(self):
+        self.direct.started(1, ROOM, 0.0)
+
+        # トランスポートのエラー(503)で終わったら、SIPサーバーを経由して発信し直す
+        self.assertIsNone(self.direct.update(CallState(1, 1, "CALLING", 0)))
+        self.assertEqual(self.direct.update(CallState(1, 6, "DISCONNCTD", 503)), ROOM)
+        self.assertEqual(self.direct.fallbacks, 1)
+
+    def test_timeout(self):
+        self.direct.started(1, ROOM, 0.0)
+        self.direct.started(2, "sip:intercom3@intercom1", 1.0)
+
+        # 期限を過ぎた通話は1回だけ返す
+        self.assertEqual(self.direct.expired(2.5), [1])
+        self.assertEqual(self.direct.expired(2.6), [])
+
+        # 取り消した通話(487)は、SIPサーバーを経由して発信し直す
+        self.assertEqual(self.direct.update(CallState(1, 6, "DISCONNCTD", 487)), ROOM)
+
+    def test_rejected(self):
+        self.direct.started(1, ROOM, 0.0)
+
+        # 話し中は相手に届いているので、発信し直さない
+        self.assertIsNone(self.direct.update(CallState(1, 6, "DISCONNCTD", 486)))
+        self.assertEqual(self.direct.fallbacks, 0)
+
+    def test_no_fallback(self):
+        direct = DirectDial({ROOM: DIRECT}, fallback=False)
+        direct.started(1, ROOM, 0.0)
+        self.assertIsNone(direct.update(CallState(1, 6, "DISCONNCTD", 503)))
+
+    def test_not_direct(self):
+        # 直接の発信でない通話は扱わない
+        self.assertIsNone(self.direct.update(CallState(7, 6, "DISCONNCTD", 503)))
+
+
+class TestMediaPath(unittest.TestCase):
+    def test_resolve_hosts(self):
+        self.assertIn("127.0.0.1", resolve_hosts("sip:localhost:5060"))
+        self.assertEqual(
+            resolve_hosts("sip:intercom2@192.168.1.10"), frozenset({"192.168.1.10"})
+        )
+        # 名前解決できなくても、ホストの文字列は残す
+        self.assertIn("intercom1.invalid", resolve_hosts("sip:intercom1.invalid"))
+
+    def test_media_path(self):
+        servers = resolve_hosts("sip:192.168.1.10")
+
+        # SDP の相手が SIPサーバー: 中継されている
+        self.assertEqual(media_path("192.168.1.10:10000", servers), MEDIA_ANCHORED)
+        # SDP の相手が部屋: 直接
+        self.assertEqual(media_path("192.168.1.12:4000", servers), MEDIA_DIRECT)
+        self.assertEqual(media_path("[fd00::12]:4000", servers), MEDIA_DIRECT)
+        # SIPサーバーが分からなければ、直接とみなす
+        self.assertEqual(media_path("192.168.1.10:10000", ()), MEDIA_DIRECT)
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+@unittest.skipIf(not SIP_SERVER, "SIP_SERVER が無い")
+class TestDirectBenchmark(unittest.TestCase):
+    def test_setup_time(self):
+        result = run("direct", SIP_SERVER, SIP_PASSWORD, DIRECT_CALLS, timeout=300)
+
+        for route, setup in result.items():
+            invite, rtp = setup["invite_200"], setup["answer_rtp"]
+            logger.info(
+                f"{route:6s} INVITE->200 median {invite['median']:6.1f} ms "
+                f"p99 {invite['p99']:6.1f} ms / 200->RTP median {rtp['median']:6.1f} ms"
+            )
+
+        # SIPサーバーの中継と認証の往復が無い分、直接の発信は早い
+        self.assertLess(
+            result["direct"]["invite_200"]["median"],
+            result["server"]["invite_200"]["median"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
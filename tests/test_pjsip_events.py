@@ -0,0 +1,61 @@
+"""test_pjsip_events"""
+
+import threading
+import unittest
+
+from intercom.libs.pjsip.dispatcher import Dispatcher
+from intercom.libs.pjsip.events import RegState, CallState, BuddyState
+
+
+class TestPjsipEvents(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = Dispatcher()
+        self.received = []
+
+    def test_publish(self):
+        self.dispatcher.subscribe(RegState, self.received.append)
+        self.dispatcher.publish(RegState(True, 200, "OK"))
+
+        # UIスレッドで drain() するまでは配られない
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.dispatcher.drain(), 1)
+        self.assertEqual(self.received, [RegState(True, 200, "OK")])
+
+    def test_publish_by_type(self):
+        calls = []
+        self.dispatcher.subscribe(RegState, self.received.append)
+        self.dispatcher.subscribe(CallState, calls.append)
+        self.dispatcher.publish(CallState(0, 5, "CONFIRMED", 200))
+        self.dispatcher.drain()
+
+        self.assertEqual(self.received, [])
+        self.assertEqual(len(calls), 1)
+
+    def test_publish_from_thread(self):
+        self.dispatcher.subscribe(CallState, self.received.append)
+
+        def worker():
+            for state in range(7):
+                self.dispatcher.publish(CallState(0, state, "", 0))
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.dispatcher.drain()
+
+        # 発生した順に配られる
+        self.assertEqual([event.state for event in self.received], list(range(7)))
+
+    def test_call_state(self):
+        self.assertTrue(CallState(0, 5, "CONFIRMED", 200).confirmed)
+        self.assertTrue(CallState(0, 6, "DISCONNCTD", 200).disconnected)
+        self.assertFalse(CallState(0, 3, "EARLY", 180).confirmed)
+
+    def test_buddy_state(self):
+        self.assertTrue(BuddyState("sip:a@b", 1, "Online").online)
+        self.assertTrue(BuddyState("sip:a@b", 2, "Offline").offline)
+        self.assertFalse(BuddyState("sip:a@b", 0, "Unknown").offline)
+
+
+if __name__ == "__main__":
+    unittest.main()
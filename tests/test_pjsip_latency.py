@@ -0,0 +1,62 @@
+"""test_pjsip_latency
+
+pjsua2 のイベント処理を UIスレッドでポーリングする場合("polling")と、
+専用のスレッドで処理する場合("thread")で、SIPの応答時間と
+UIスレッドのフレームの処理時間を比較する。
+
+時間の比較は環境変数 BENCHMARK=1 のときだけ確かめる。
+"""
+
+import importlib.util
+import logging
+import os
+import unittest
+
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+# 時間の比較を確かめる(計測する環境によって結果が変わるので、既定では確かめない)
+BENCHMARK = os.environ.get("BENCHMARK", "") == "1"
+
+
+def _run(command: str, event_mode: str) -> dict:
+    """計測用ハーネスを別のプロセスで実行する
+
+    :param str command: ハーネスのコマンド
+    :param str event_mode: "polling" か "thread"
+    :return dict: 計測結果
+    """
+
+    return run(command, event_mode, timeout=60)
+
+
+def _log(result: dict) -> None:
+    sip, frame = result["sip"], result["frame"]
+    logger.info(
+        f"{result['mode']:8s} sip median {sip['median']:.3f} ms "
+        f"p99 {sip['p99']:.3f} ms / frame median {frame['median']:.3f} ms "
+        f"p99 {frame['p99']:.3f} ms max {frame['max']:.3f} ms"
+    )
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestPjsipLatency(unittest.TestCase):
+    def test_event_mode(self):
+        polling = _run("latency", "polling")
+        thread = _run("latency", "thread")
+        _log(polling)
+        _log(thread)
+
+        self.assertEqual(polling["mode"], "polling")
+        self.assertEqual(thread["mode"], "thread")
+        self.assertGreater(polling["probes"], 0)
+        self.assertGreater(thread["probes"], 0)
+
+        if BENCHMARK:
+            # 専用のスレッドでは、UIスレッドは libHandleEvents で待たない
+            self.assertLess(thread["frame"]["median"], polling["frame"]["median"])
+
+
+if __name__ == "__main__":
+    unittest.main()
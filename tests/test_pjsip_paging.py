@@ -0,0 +1,44 @@
+"""test_pjsip_paging
+
+null audio device の部屋を一斉呼出し、全部屋の接続までの時間と
+通話中の会議ブリッジのCPU使用率を、部屋の数ごとに表示する。
+
+部屋の数の上限は環境変数 PAGE_ROOMS で変えられる(既定は 8)。
+"""
+
+import importlib.util
+import logging
+import os
+import unittest
+
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+PAGE_ROOMS = int(os.environ.get("PAGE_ROOMS", "8"))
+
+
+def _page(rooms: int) -> dict:
+    """一斉呼出の計測を別のプロセスで実行する
+
+    :param int rooms: 部屋の数
+    :return dict: 計測結果
+    """
+
+    return run("page", rooms, timeout=120)
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestPjsipPaging(unittest.TestCase):
+    def test_page(self):
+        for rooms in sorted({1, max(PAGE_ROOMS // 2, 1), PAGE_ROOMS}):
+            result = _page(rooms)
+            logger.info(
+                f"{result['rooms']:3d} rooms setup {result['setup']:8.1f} ms "
+                f"bridge cpu {result['cpu']:6.2f} % ports {result['ports']}"
+            )
+            self.assertEqual(result["rooms"], rooms)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""test_pjsip_profile
+
+遅延のプロファイル: MediaConfig への反映、クリック音による遅延の計測、
+プロファイルごとの口から耳までの遅延。
+
+サウンドデバイスの往復の遅延も測るには、スピーカーとマイクをつないで、
+環境変数 PROFILE_DEVICE=1 を付ける(既定は null device の通話の遅延だけ)。
+"""
+
+import array
+import importlib.util
+import logging
+import os
+import tempfile
+import types
+import unittest
+import wave
+
+from intercom.libs.pjsip.profile import PROFILES, apply_media_config, get_profile
+from tests.pjsip_harness import _click_delays, _click_wav, run
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DEVICE = os.environ.get("PROFILE_DEVICE", "") == "1"
+
+
+class TestAudioProfile(unittest.TestCase):
+    def test_get_profile(self):
+        self.assertIs(get_profile(" LowLatency "), PROFILES["lowlatency"])
+        with self.assertRaises(ValueError):
+            get_profile("studio")
+
+    def test_order(self):
+        # 遅延の短い順
+        names = ("lowlatency", "balanced", "robust")
+        nominal = [PROFILES[name].nominal_ms for name in names]
+        self.assertEqual(nominal, sorted(nominal))
+
+    def test_jitter_buffer(self):
+        # 最初の溜めは、溜めの最小と最大の間で、最大を超えない
+        for name, profile in PROFILES.items():
+            with self.subTest(name):
+                self.assertLessEqual(profile.jb_min_pre, profile.jb_init)
+                self.assertLessEqual(profile.jb_init, profile.jb_max_pre)
+                self.assertLessEqual(profile.jb_max_pre, profile.jb_max)
+                self.assertEqual(profile.frame_ptime % 10, 0)
+
+    def test_apply_media_config(self):
+        media_config = types.SimpleNamespace()
+        apply_media_config(media_config, PROFILES["robust"])
+
+        self.assertEqual(media_config.ptime, 20)
+        self.assertEqual(media_config.jbInit, 80)
+        self.assertEqual(media_config.jbMax, 1000)
+        self.assertEqual(media_config.sndPlayLatency, 140)
+
+
+class TestClickDelays(unittest.TestCase):
+    def test_delayed_copy(self):
+        directory = tempfile.mkdtemp()
+        clicks = os.path.join(directory, "clicks.wav")
+        mixed = os.path.join(directory, "mixed.wav")
+        _click_wav(clicks, 5.0)
+
+        with wave.open(clicks, "rb") as wav:
+            rate = wav.getframerate()
+            samples = array.array("h", wav.readframes(wav.getnframes()))
+
+        # 73 ミリ秒遅れた半分の大きさの写しを重ねる
+        lag = int(0.073 * rate)
+        copy = array.array("h", bytes(2 * lag)) + samples[:-lag]
+        with wave.open(mixed, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(
+                array.array(
+                    "h", (value + delayed // 2 for value, delayed in zip(samples, copy))
+                ).tobytes()
+            )
+
+        delays = _click_delays(mixed)
+        self.assertGreaterEqual(len(delays), 4)
+        for delay in delays:
+            self.assertAlmostEqual(delay, 0.073, delta=0.002)
+
+
+def _profile(name: str) -> dict:
+    """プロファイルの遅延の計測を別のプロセスで実行する
+
+    :param str name: プロファイルの名前
+    :return dict: 計測結果
+    """
+
+    args = ["profile", name]
+    if PROFILE_DEVICE:
+        args.append("device")
+
+    return run(*args, timeout=120)
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestProfileBenchmark(unittest.TestCase):
+    def test_profiles(self):
+        results = {name: _profile(name) for name in PROFILES}
+
+        for name, result in results.items():
+            call = result["call"]
+            line = (
+                f"{name:10s} nominal {result['nominal']:4d} ms "
+                f"call median {call['median']:6.1f} ms max {call['max']:6.1f} ms"
+            )
+            if "device" in result:
+                line += f" device {result['device']['median']:6.1f} ms"
+            if "total" in result:
+                line += f" total {result['total']:6.1f} ms"
+            logger.info(line)
+
+        # ジッターバッファが浅いほど、通話の遅延は短い
+        self.assertLess(
+            results["lowlatency"]["call"]["median"], results["robust"]["call"]["median"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""test_pjsip_registry"""
+
+import unittest
+
+from intercom.libs.pjsip.registry import CallRegistry
+
+
+class _Call:
+    """CallRegistry が使う属性だけを持つ通話"""
+
+    def __init__(self, call_id: int):
+        self.call_id = call_id
+        self.ended = False
+
+    def getId(self) -> int:
+        return self.call_id
+
+
+class TestCallRegistry(unittest.TestCase):
+    def setUp(self):
+        self.calls = CallRegistry()
+
+    def test_add_discard(self):
+        call = _Call(0)
+        self.assertTrue(self.calls.add(call))
+        self.assertIs(self.calls.get(0), call)
+        self.assertIs(self.calls.current, call)
+
+        self.calls.discard(call)
+        self.assertEqual(len(self.calls), 0)
+        self.assertIsNone(self.calls.current)
+        self.assertTrue(call.ended)
+
+    def test_current(self):
+        first, second = _Call(0), _Call(1)
+        self.calls.add(first)
+        self.calls.add(second)
+        self.assertIs(self.calls.current, second)
+
+        # 遠端が切断した通話も除かれる
+        self.calls.discard(second)
+        self.assertIs(self.calls.current, first)
+
+    def test_ended_before_add(self):
+        # makeCall() の完了より先に切断された通話は登録しない
+        call = _Call(0)
+        self.calls.discard(call)
+        self.assertFalse(self.calls.add(call))
+        self.assertEqual(len(self.calls), 0)
+
+    def test_reused_id(self):
+        # 切断済みの通話の discard() は、同じ id の新しい通話を除かない
+        old, new = _Call(0), _Call(0)
+        self.calls.add(old)
+        self.calls.add(new)
+        self.calls.discard(old)
+        self.assertIs(self.calls.get(0), new)
+
+
+if __name__ == "__main__":
+    unittest.main()
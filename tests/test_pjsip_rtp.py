@@ -0,0 +1,195 @@
+"""test_pjsip_rtp
+
+RTPマルチキャストの一斉放送: μ-law の変換、RTPパケット、受信の順番の扱い、
+ループバックのマルチキャストで、受信する部屋の数ごとの送信の帯域とCPU使用率。
+
+受信する部屋の数の上限は環境変数 MULTICAST_LISTENERS で変えられる(既定は 16)。
+"""
+
+import array
+import logging
+import os
+import time
+import unittest
+
+from intercom.libs.pjsip.rtp import (
+    PT_PCMU,
+    SAMPLES_PER_PACKET,
+    RtpPacket,
+    RtpReceiver,
+    RtpSender,
+    ulaw_decode,
+    ulaw_encode,
+)
+
+logger = logging.getLogger(__name__)
+
+MULTICAST_LISTENERS = int(os.environ.get("MULTICAST_LISTENERS", "16"))
+# ループバックの試験用のマルチキャストアドレスとポート
+GROUP = "239.255.42.1"
+PORT = 50004
+# 放送の長さ(パケット数, 20ミリ秒単位)
+PACKETS = 50
+
+
+def _pcm(samples: list[int]) -> bytes:
+    return array.array("h", samples).tobytes()
+
+
+def _samples(pcm: bytes) -> list[int]:
+    return array.array("h", pcm).tolist()
+
+
+class TestUlaw(unittest.TestCase):
+    def test_round_trip(self):
+        samples = list(range(-32768, 32768, 97))
+        decoded = _samples(ulaw_decode(ulaw_encode(_pcm(samples))))
+
+        self.assertEqual(len(decoded), len(samples))
+        for sample, value in zip(samples, decoded):
+            # μ-law の量子化誤差は、振幅のおよそ 1/16 以内(最大値 32124 を超える分は切り捨て)
+            sample = max(min(sample, 32124), -32124)
+            self.assertLessEqual(abs(sample - value), max(abs(sample) // 16, 8))
+
+    def test_known_codes(self):
+        self.assertEqual(
+            ulaw_encode(_pcm([0, -1, 32767, -32768])), bytes([0xFF, 0x7F, 0x80, 0x00])
+        )
+        self.assertEqual(
+            _samples(ulaw_decode(bytes([0xFF, 0x80, 0x00]))), [0, 32124, -32124]
+        )
+
+
+class TestRtpPacket(unittest.TestCase):
+    def test_pack_parse(self):
+        packet = RtpPacket(PT_PCMU, 65535, 0xFFFFFF60, 0x12345678, True, b"\xff" * 160)
+        data = packet.pack()
+
+        self.assertEqual(len(data), 12 + 160)
+        self.assertEqual(RtpPacket.parse(data), packet)
+
+    def test_parse_csrc_extension_padding(self):
+        first = 0x80 | 0x20 | 0x10 | 0x01  # V=2, パディング, 拡張ヘッダ, CSRC 1個
+        header = bytes([first, 0x00, 0, 1, 0, 0, 0, 160, 0, 0, 0, 1])
+        csrc = b"\x00\x00\x00\x02"
+        extension = b"\xbe\xde\x00\x01" + b"\x00" * 4
+        padding = b"\x00\x00\x03"
+        packet = RtpPacket.parse(header + csrc + extension + b"\x7f" * 4 + padding)
+
+        self.assertEqual(packet.sequence, 1)
+        self.assertEqual(packet.timestamp, 160)
+        self.assertEqual(packet.payload, b"\x7f" * 4)
+
+    def test_parse_invalid(self):
+        with self.assertRaises(ValueError):
+            RtpPacket.parse(b"\x80\x00")
+        with self.assertRaises(ValueError):
+            RtpPacket.parse(bytes(12))
+
+
+class TestRtpReceiver(unittest.TestCase):
+    def setUp(self):
+        self.receiver = RtpReceiver(GROUP, PORT, "127.0.0.1", depth=3)
+
+    def tearDown(self):
+        self.receiver.close()
+
+    def _receive(self, sequence: int, ssrc: int = 1):
+        payload = b"\xff" * SAMPLES_PER_PACKET
+        packet = RtpPacket(PT_PCMU, sequence, sequence * 160, ssrc, False, payload)
+        self.receiver.receive(packet.pack())
+
+    def test_sequence(self):
+        for sequence in (65534, 65535, 0, 2, 1, 2):
+            self._receive(sequence)
+
+        # 0 の次の 1 が失われ、遅れて届いた 1 と重複した 2 は捨てる
+        self.assertEqual(self.receiver.received, 4)
+        self.assertEqual(self.receiver.lost, 1)
+        self.assertEqual(self.receiver.discarded, 2)
+
+    def test_depth(self):
+        for sequence in range(10):
+            self._receive(sequence)
+
+        # 再生を待つのは新しい depth パケットだけ
+        frames = [self.receiver.read() for _ in range(4)]
+        self.assertEqual(
+            [frame is not None for frame in frames], [True, True, True, False]
+        )
+        self.assertEqual(len(frames[0]), SAMPLES_PER_PACKET * 2)
+
+    def test_new_source(self):
+        self._receive(100, ssrc=1)
+        self._receive(5, ssrc=2)
+
+        self.assertEqual(self.receiver.received, 2)
+        self.assertEqual(self.receiver.lost, 0)
+        # 前の送信元の再生待ちは捨てる
+        self.assertIsNotNone(self.receiver.read())
+        self.assertIsNone(self.receiver.read())
+
+
+class TestMulticastLoopback(unittest.TestCase):
+    def _broadcast(self, listeners: int) -> dict:
+        """ループバックのマルチキャストで、listeners 部屋に PACKETS パケットを放送する
+
+        :param int listeners: 受信する部屋の数
+        :return dict: 送信のバイト数、送信のCPU時間(ミリ秒)、部屋ごとの受信パケット数
+        """
+
+        receivers = [RtpReceiver(GROUP, PORT, "127.0.0.1") for _ in range(listeners)]
+        for receiver in receivers:
+            receiver.start()
+
+        sender = RtpSender(GROUP, PORT, ttl=0, loop=True, interface="127.0.0.1")
+        pcm = _pcm([1000] * SAMPLES_PER_PACKET)
+
+        cpu = 0.0
+        start = time.perf_counter()
+        for number in range(PACKETS):
+            deadline = start + number * 0.02
+            now = time.perf_counter()
+            if now < deadline:
+                time.sleep(deadline - now)
+
+            thread_time = time.thread_time()
+            sender.send(pcm)
+            cpu += time.thread_time() - thread_time
+
+        time.sleep(0.2)
+        sender.close()
+        for receiver in receivers:
+            receiver.close()
+
+        return {
+            "packets": sender.packets,
+            "octets": sender.octets,
+            "cpu": cpu * 1e3,
+            "received": [receiver.received for receiver in receivers],
+        }
+
+    def test_constant_bandwidth(self):
+        results = {}
+        counts = {1, max(MULTICAST_LISTENERS // 4, 1), MULTICAST_LISTENERS}
+        for listeners in sorted(counts):
+            result = self._broadcast(listeners)
+            results[listeners] = result
+            logger.info(
+                f"{listeners:3d} listeners sent {result['octets']:6d} bytes "
+                f"({result['octets'] * 8 / (PACKETS * 0.02) / 1000:5.1f} kbps) "
+                f"sender cpu {result['cpu']:6.2f} ms "
+                f"received min {min(result['received'])}"
+            )
+
+            # すべての部屋が、すべてのパケットを受信する
+            self.assertEqual(result["received"], [PACKETS] * listeners)
+
+        # 送信の帯域は部屋の数に依らない
+        # (ループバックでは複製がカーネルの送信処理に含まれるので、CPU時間は表示だけ)
+        octets = {result["octets"] for result in results.values()}
+        self.assertEqual(octets, {PACKETS * (12 + SAMPLES_PER_PACKET)})
+
+
+if __name__ == "__main__":
+    unittest.main()
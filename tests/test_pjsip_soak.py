@@ -0,0 +1,45 @@
+"""test_pjsip_soak
+
+null audio device で発信・応答・切断を繰り返し、
+通話の登録簿が空に戻り、RSS とオブジェクト数が増え続けないことを確かめる。
+
+通話の回数は環境変数 SOAK_CALLS で変えられる(既定は 50)。
+長時間の確認では SOAK_CALLS=2000 のように数千回にする。
+"""
+
+import importlib.util
+import logging
+import os
+import unittest
+
+from tests.pjsip_harness import run
+
+logger = logging.getLogger(__name__)
+
+SOAK_CALLS = int(os.environ.get("SOAK_CALLS", "50"))
+# 測定の最初と最後の差の上限
+RSS_GROWTH = 4 * 1024 * 1024
+OBJECTS_GROWTH = 1000
+
+
+@unittest.skipIf(importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない")
+class TestPjsipSoak(unittest.TestCase):
+    def test_soak(self):
+        result = run("soak", SOAK_CALLS, timeout=SOAK_CALLS * 2 + 60)
+        samples = result["samples"]
+
+        for sample in samples:
+            logger.info(
+                f"call {sample['call']:6d} rss {sample['rss'] / 1024:10.0f} KiB "
+                f"objects {sample['objects']:8d} calls {sample['calls']}"
+            )
+        logger.info(f"{result['calls']} calls in {result['seconds']:.1f} s")
+
+        self.assertGreaterEqual(len(samples), 2)
+        self.assertTrue(all(sample["calls"] == 0 for sample in samples))
+        self.assertLess(samples[-1]["rss"] - samples[0]["rss"], RSS_GROWTH)
+        self.assertLess(samples[-1]["objects"] - samples[0]["objects"], OBJECTS_GROWTH)
+
+
+if __name__ == "__main__":
+    unittest.main()
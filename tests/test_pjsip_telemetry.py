@@ -0,0 +1,152 @@
+"""test_pjsip_telemetry
+
+音声品質の記録: E-model の MOS、リングバッファ、区間のパケットロス率、
+Prometheus のテキスト形式(テキストファイルとHTTP)、標本の記録の所要時間。
+"""
+
+import logging
+import os
+import tempfile
+import time
+import unittest
+import urllib.request
+
+from intercom.libs.pjsip.telemetry import SampleRing, Telemetry, e_model_mos
+
+logger = logging.getLogger(__name__)
+
+SAMPLE = dict(jitter=1.0, loss=0.0, remote_loss=0.0, rtt=2.0, delay=31.0, mos=4.4)
+
+
+def _stats(rx_packets: int, rx_lost: int, timestamp: float = 0.0) -> dict:
+    return dict(
+        rx_packets=rx_packets,
+        rx_lost=rx_lost,
+        tx_packets=rx_packets,
+        tx_lost=0,
+        jitter_ms=3.0,
+        rtt_ms=20.0,
+        buffer_ms=40.0,
+        timestamp=timestamp,
+    )
+
+
+class TestEModel(unittest.TestCase):
+    def test_mos(self):
+        # 遅延もロスも無い G.711 は R = 93.2
+        self.assertAlmostEqual(e_model_mos(0.0, 0.0, "PCMU"), 4.41, places=2)
+        # ロスと遅延で下がる
+        self.assertLess(e_model_mos(0, 0.05, "pcmu"), e_model_mos(0, 0.01, "pcmu"))
+        self.assertLess(e_model_mos(300, 0.0, "pcmu"), e_model_mos(100, 0.0, "pcmu"))
+        # 範囲
+        self.assertEqual(e_model_mos(2000.0, 1.0, "pcmu"), 1.0)
+
+
+class TestSampleRing(unittest.TestCase):
+    def test_wrap(self):
+        ring = SampleRing(3)
+        self.assertIsNone(ring.latest())
+
+        for number in range(5):
+            ring.append(float(number), **dict(SAMPLE, jitter=float(number)))
+
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.values("jitter"), [2.0, 3.0, 4.0])
+        self.assertEqual(ring.latest()["time"], 4.0)
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.telemetry = Telemetry(capacity=4)
+
+    def test_interval_loss(self):
+        self.telemetry.update(0, "sip:intercom2@intercom1", "opus", **_stats(90, 10))
+        self.telemetry.update(0, "sip:intercom2@intercom1", "opus", **_stats(190, 10))
+
+        loss = self.telemetry.get(0).samples.values("loss")
+        # 最初は累積値、次は区間(100 パケットでロス無し)
+        self.assertEqual(loss, [0.1, 0.0])
+
+        # re-INVITE で累積値が戻った
+        self.telemetry.update(0, "sip:intercom2@intercom1", "opus", **_stats(45, 5))
+        self.assertEqual(self.telemetry.get(0).samples.values("loss")[-1], 0.1)
+
+    def test_render(self):
+        self.telemetry.update(3, 'sip:"room"@intercom1', "PCMU", **_stats(100, 0))
+        self.telemetry.update(4, "sip:intercom3@intercom1", "opus", **_stats(100, 0))
+        self.telemetry.remove(4)
+
+        text = self.telemetry.render()
+        self.assertIn("intercom_calls_active 1\n", text)
+        self.assertIn("intercom_calls_finished_total 1\n", text)
+        self.assertIn(
+            'intercom_call_rtt_milliseconds{call="3",remote="sip:\\"room\\"@intercom1",'
+            'codec="PCMU"} 20\n',
+            text,
+        )
+        self.assertIn("# TYPE intercom_call_mos gauge\n", text)
+        self.assertNotIn('call="4"', text)
+        # 経路が分からない通話は、経路を出力しない
+        self.assertNotIn("intercom_call_media_path{", text)
+
+    def test_media_path(self):
+        self.telemetry.update(
+            0, "sip:intercom2@intercom1", "opus", path="anchored", **_stats(100, 0)
+        )
+        self.telemetry.update(
+            0, "sip:intercom2@intercom1", "opus", path="direct", **_stats(200, 0)
+        )
+
+        # re-INVITE で経路が変わったら、新しい経路だけを出力する
+        text = self.telemetry.render()
+        self.assertIn(
+            'intercom_call_media_path{call="0",remote="sip:intercom2@intercom1",'
+            'codec="opus",path="direct"} 1\n',
+            text,
+        )
+        self.assertNotIn('path="anchored"', text)
+
+    def test_textfile(self):
+        self.telemetry.update(0, "sip:intercom2@intercom1", "opus", **_stats(100, 0))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "intercom.prom")
+            self.telemetry.write_textfile(path)
+
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual(file.read(), self.telemetry.render())
+            self.assertEqual(os.listdir(directory), ["intercom.prom"])
+
+    def test_http(self):
+        self.telemetry.update(0, "sip:intercom2@intercom1", "opus", **_stats(100, 0))
+        port = self.telemetry.serve("127.0.0.1", 0)
+        self.addCleanup(self.telemetry.shutdown)
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            self.assertEqual(response.read().decode("utf-8"), self.telemetry.render())
+
+    def test_http_in_use(self):
+        # ポートが使用中でも例外にせず、公開しない(0)
+        port = self.telemetry.serve("127.0.0.1", 0)
+        self.addCleanup(self.telemetry.shutdown)
+
+        other = Telemetry()
+        with self.assertLogs("intercom.libs.pjsip.telemetry", "WARNING"):
+            self.assertEqual(other.serve("127.0.0.1", port), 0)
+
+    def test_update_cost(self):
+        # 32 通話を 5 秒ごとに記録しても、UIスレッドの1フレームに収まる
+        start = time.perf_counter()
+        for number in range(1000):
+            for call_id in range(32):
+                stats = _stats(number * 250, 0)
+                self.telemetry.update(
+                    call_id, "sip:intercom2@intercom1", "opus", **stats
+                )
+        per_update = (time.perf_counter() - start) / 32000
+        logger.info(f"update {per_update * 1e6:.1f} us")
+        self.assertLess(per_update * 32, 0.005)
+
+
+if __name__ == "__main__":
+    unittest.main()
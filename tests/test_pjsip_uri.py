@@ -0,0 +1,107 @@
+"""test_pjsip_uri
+
+通話相手の URI の正規化と索引、着信の受け入れ判定のベンチマーク
+"""
+
+import logging
+import time
+import unittest
+
+from intercom.libs.pjsip.uri import normalize_uri, BuddyIndex
+
+logger = logging.getLogger(__name__)
+
+# 1回の測定での受け入れ判定の回数
+LOOKUPS = 1000
+
+
+def _bench(label: str, admit, remote_uri: str) -> float:
+    """1回の受け入れ判定の時間(ns)
+
+    :param str label: 表示名
+    :param Callable admit: 受け入れ判定
+    :param str remote_uri: 着信相手の URI
+    :return float: ns/op
+    """
+
+    start = time.perf_counter_ns()
+    for _ in range(LOOKUPS):
+        admit(remote_uri)
+    result = (time.perf_counter_ns() - start) / LOOKUPS
+    logger.info(f"{label:32s} {result:12.0f} ns/op")
+    return result
+
+
+class TestNormalizeUri(unittest.TestCase):
+    def test_angle_brackets(self):
+        self.assertEqual(
+            normalize_uri("<sip:intercom2@intercom1>"), "sip:intercom2@intercom1"
+        )
+
+    def test_display_name_and_params(self):
+        self.assertEqual(
+            normalize_uri('"Intercom 2" <sip:intercom2@intercom1;transport=udp>;tag=1'),
+            "sip:intercom2@intercom1",
+        )
+
+    def test_case_and_port(self):
+        self.assertEqual(
+            normalize_uri("SIP:Intercom2@Intercom1:5060"), "sip:intercom2@intercom1"
+        )
+
+    def test_password_and_headers(self):
+        self.assertEqual(
+            normalize_uri("sip:intercom2:secret@intercom1?subject=x"),
+            "sip:intercom2@intercom1",
+        )
+
+    def test_ipv6(self):
+        self.assertEqual(
+            normalize_uri("<sip:intercom2@[fe80::1]:5060>"), "sip:intercom2@[fe80::1]"
+        )
+
+    def test_no_user(self):
+        self.assertEqual(normalize_uri("sip:Intercom1"), "sip:intercom1")
+
+
+class TestBuddyIndex(unittest.TestCase):
+    def test_admission(self):
+        buddies = BuddyIndex(["sip:intercom2@intercom1"])
+        self.assertIn("<sip:intercom2@intercom1>", buddies)
+        self.assertIn('"2" <SIP:INTERCOM2@intercom1:5060>;tag=x', buddies)
+        self.assertNotIn("<sip:intercom3@intercom1>", buddies)
+
+    def test_incremental(self):
+        buddies = BuddyIndex()
+        buddies.add("sip:intercom2@intercom1")
+        self.assertIn("<sip:intercom2@intercom1>", buddies)
+        buddies.discard("<sip:intercom2@intercom1>")
+        self.assertNotIn("<sip:intercom2@intercom1>", buddies)
+        self.assertEqual(len(buddies), 0)
+
+    def test_benchmark(self):
+        """受け入れ判定: 着信ごとに作るリスト(変更前)と索引(変更後)"""
+
+        results = {}
+        for count in (1, 100, 10_000):
+            uris = [f"sip:room{number}@intercom1" for number in range(count)]
+            remote_uri = f"<sip:room{count - 1}@intercom1>"
+
+            # 変更前: 着信ごとに通話相手の URI を山括弧で包んで線形に比較
+            # (実際はさらに、通話相手ごとに getInfo() の構造体のコピーがかかる)
+            def linear(remote_uri):
+                return remote_uri in map(lambda uri: "<" + uri + ">", uris)
+
+            buddies = BuddyIndex(uris)
+            _bench(f"list  {count:6d} buddies", linear, remote_uri)
+            results[count] = _bench(
+                f"index {count:6d} buddies", buddies.__contains__, remote_uri
+            )
+            self.assertIn(remote_uri, buddies)
+
+        # 索引の判定時間は、通話相手の数に依らない
+        self.assertLess(results[10_000], results[1] * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
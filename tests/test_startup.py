@@ -0,0 +1,145 @@
+"""test_startup
+
+起動の段階ごとの時間(StartupProfiler)と、起動を遅くする import をしないこと:
+intercom.py の import では pjsua2 と libpulse を import せず、
+useragent の import では pjsua2 の Endpoint を作らない。
+"""
+
+import importlib.util
+import logging
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from intercom.libs.startup import StartupProfiler
+
+logger = logging.getLogger(__name__)
+
+
+class FakeClock:
+    """進めた分だけ進む時計"""
+
+    def __init__(self):
+        self.value = 100.0
+
+    def __call__(self) -> float:
+        return self.value
+
+
+class TestStartupProfiler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.profiler = StartupProfiler(self.clock)
+
+    def test_phases(self):
+        with self.profiler.phase("import kivy"):
+            self.clock.value += 0.25
+        with self.profiler.phase("build"):
+            self.clock.value += 0.05
+        self.clock.value += 0.01
+        self.profiler.mark("ready")
+
+        phases = self.profiler.phases
+        self.assertEqual(
+            [phase.name for phase in phases], ["import kivy", "build", "ready"]
+        )
+        self.assertAlmostEqual(phases[0].duration, 0.25)
+        self.assertAlmostEqual(phases[1].start, 0.25)
+        self.assertEqual(phases[2].duration, 0.0)
+        self.assertAlmostEqual(self.profiler.elapsed("ready"), 0.31)
+        self.assertIsNone(self.profiler.elapsed("first frame"))
+
+    def test_exception(self):
+        # 例外で抜けた段階も記録する
+        with self.assertRaises(RuntimeError):
+            with self.profiler.phase("pulseaudio speaker"):
+                self.clock.value += 1.0
+                raise RuntimeError("connection refused")
+
+        self.assertAlmostEqual(self.profiler.elapsed("pulseaudio speaker"), 1.0)
+
+    def test_threads(self):
+        # 並行した段階は、それぞれのスレッドの名前で記録する
+        profiler = StartupProfiler()
+        started = threading.Barrier(2)
+
+        def work(name: str):
+            started.wait()
+            with profiler.phase(name):
+                time.sleep(0.05)
+
+        threads = [
+            threading.Thread(target=work, args=(name,), name=name)
+            for name in ("startup_0", "startup_1")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        phases = profiler.phases
+        self.assertEqual({phase.thread for phase in phases}, {"startup_0", "startup_1"})
+        # 重なって動いたので、全体は2つの合計より短い
+        end = max(phase.end for phase in phases)
+        start = min(phase.start for phase in phases)
+        self.assertLess(end - start, sum(phase.duration for phase in phases))
+
+    def test_report(self):
+        with self.profiler.phase("import pjsua2"):
+            self.clock.value += 0.125
+        self.profiler.mark("ready")
+
+        report = self.profiler.report().splitlines()
+        logger.info("\n".join(report))
+
+        self.assertIn("phase", report[0])
+        self.assertTrue(report[1].endswith("import pjsua2"))
+        self.assertIn("125.0ms", report[1])
+        self.assertTrue(report[2].endswith("ready"))
+        self.assertTrue(report[-1].startswith("total 125.0 ms"))
+
+
+def _imported(code: str) -> str:
+    """別のプロセスで import して、結果を返す
+
+    :param str code: intercom/ を sys.path に加えてから実行するコード
+    :return str: 標準出力の最後の行
+    """
+
+    completed = subprocess.run(
+        [sys.executable, "-c", f"import sys; sys.path.insert(0, 'intercom'); {code}"],
+        capture_output=True,
+        text=True,
+        timeout=60,
+        check=True,
+    )
+    return completed.stdout.strip().splitlines()[-1]
+
+
+class TestLazyImport(unittest.TestCase):
+    @unittest.skipIf(importlib.util.find_spec("kivy") is None, "kivy が見つからない")
+    def test_intercom(self):
+        result = _imported(
+            "import time; start = time.perf_counter(); import intercom; "
+            "print(time.perf_counter() - start, "
+            "'pjsua2' in sys.modules, 'libs.pulseaudio.libpulse' in sys.modules)"
+        )
+        seconds, pjsua2, libpulse = result.split()
+        logger.info(f"import intercom: {float(seconds) * 1000:.0f} ms")
+
+        self.assertEqual((pjsua2, libpulse), ("False", "False"))
+
+    @unittest.skipIf(
+        importlib.util.find_spec("pjsua2") is None, "pjsua2 が見つからない"
+    )
+    def test_useragent(self):
+        result = _imported(
+            "from libs.pjsip.useragent import UserAgent; print(UserAgent.endpoint)"
+        )
+        self.assertEqual(result, "None")
+
+
+if __name__ == "__main__":
+    unittest.main()